@@ -1,171 +1,7 @@
 import License from "../models/licenseModel.js";
 import cloudinary from "../utils/cloudinaryConfig.js";
-import { spawn } from "child_process";
-import path from "path";
-import fs from "fs";
-import os from "os";
-import { fileURLToPath } from 'url';
 import { parseLicenseText } from "../utils/licenseParser.js";
-
-const __filename = fileURLToPath(import.meta.url);
-const __dirname = path.dirname(__filename);
-
-// --- OCR HELPERS (Ported from operatorController.js) ---
-
-const resolveOcrScriptPath = () => {
-  const scriptCandidates = [
-    path.join(process.cwd(), 'ocr', 'paddle_scan.py'),
-    path.join(process.cwd(), 'server', 'ocr', 'paddle_scan.py'),
-    path.join(process.cwd(), '..', 'server', 'ocr', 'paddle_scan.py'),
-  ];
-
-  for (const candidate of scriptCandidates) {
-    try {
-      if (fs.existsSync(candidate)) {
-        return { scriptPath: candidate, scriptCandidates };
-      }
-    } catch (error) {
-      // ignore fs permission errors and continue
-    }
-  }
-
-  return { scriptPath: null, scriptCandidates };
-};
-
-const runPaddleOcr = async ({ filepath, langArg, noClsFlag }) => {
-  const { scriptPath, scriptCandidates } = resolveOcrScriptPath();
-
-  if (!scriptPath) {
-    const err = new Error('OCR script not found on server');
-    err.meta = { scriptCandidates };
-    throw err;
-  }
-
-  const baseArgs = [scriptPath, filepath];
-  if (langArg) {
-    baseArgs.push('--lang', String(langArg));
-  }
-  if (noClsFlag) {
-    baseArgs.push('--no-cls');
-  }
-
-  const trySpawn = (cmd) =>
-    new Promise((resolve, reject) => {
-      let proc;
-      try {
-        proc = spawn(cmd, baseArgs, { shell: false, cwd: process.cwd() });
-      } catch (error) {
-        return reject({ code: 'spawn_error', error });
-      }
-
-      let out = '';
-      let err = '';
-      proc.stdout.on('data', (d) => {
-        out += d.toString();
-      });
-      proc.stderr.on('data', (d) => {
-        err += d.toString();
-      });
-
-      const timeout = setTimeout(() => {
-        try {
-          proc.kill();
-        } catch (_) {
-          // ignore
-        }
-        reject({ code: 'timeout', error: new Error('Python script execution timed out') });
-      }, 30000);
-
-      proc.on('error', (error) => {
-        clearTimeout(timeout);
-        reject({ code: 'spawn_error', error });
-      });
-
-      proc.on('close', (code) => {
-        clearTimeout(timeout);
-        resolve({ code, out, err, cmd, args: baseArgs });
-      });
-    });
-
-  const isWindows = process.platform === 'win32';
-  const pythonCommands = isWindows ? ['py', 'python', 'python3'] : ['python3', 'python'];
-  const venvCandidates = [
-    path.join(process.cwd(), '.venv', isWindows ? 'Scripts' : 'bin', isWindows ? 'python.exe' : 'python'),
-    path.join(process.cwd(), 'venv', isWindows ? 'Scripts' : 'bin', isWindows ? 'python.exe' : 'python'),
-  ];
-  for (const vp of venvCandidates) {
-    try {
-      if (fs.existsSync(vp) && !pythonCommands.includes(vp)) {
-        pythonCommands.unshift(vp);
-        break;
-      }
-    } catch (_) {
-      // ignore
-    }
-  }
-
-  const attempts = [];
-  let result = null;
-
-  for (const cmd of pythonCommands) {
-    try {
-      const attempt = await trySpawn(cmd);
-      attempts.push({
-        cmd,
-        code: attempt.code,
-        stderr: attempt.err,
-        hasOutput: Boolean(attempt.out && attempt.out.length > 0),
-      });
-
-      if (attempt.code === 0 && attempt.out && attempt.out.length > 0) {
-        result = attempt;
-        break;
-      }
-
-      if (!result && attempt.out && attempt.out.length > 0) {
-        result = attempt; // keep the most informative output even if exit code != 0
-      }
-    } catch (spawnErr) {
-      attempts.push({
-        cmd,
-        code: spawnErr.code || 'spawn_error',
-        error: spawnErr.error?.message || spawnErr.message || String(spawnErr),
-      });
-    }
-  }
-
-  if (!result || (result.code !== 0 && (!result.out || result.out.length === 0))) {
-    const err = new Error('Failed to execute OCR python');
-    err.meta = { attempts, scriptPath, platform: process.platform };
-    throw err;
-  }
-
-  if (result.out && result.out.length > 0) {
-    try {
-      const parsed = JSON.parse(result.out);
-      if (parsed.error) {
-        const err = new Error(parsed.error || 'OCR python reported an error');
-        err.meta = { detail: parsed, attempts, scriptPath, stderr: result.err };
-        throw err;
-      }
-      return parsed;
-    } catch (parseErr) {
-      const err = new Error('Invalid OCR output');
-      err.meta = {
-        parseError: parseErr.message || String(parseErr),
-        raw: result.out,
-        stderr: result.err,
-        attempts,
-        scriptPath,
-      };
-      throw err;
-    }
-  }
-
-  const err = new Error('OCR python returned no output');
-  err.meta = { attempts, scriptPath, stderr: result?.err };
-  throw err;
-};
+import { runPaddleOcr, sendOcrRejection } from "../utils/ocrRunner.js";
 
 let cachedTesseract = null;
 const loadTesseract = async () => {
@@ -200,12 +36,13 @@ const normalizeTesseractLang = (langArg) => {
   return 'eng';
 };
 
-const runTesseractFallback = async (imagePath, langArg) => {
+// image may be a file path or a Buffer
+const runTesseractFallback = async (image, langArg) => {
   const Tesseract = await loadTesseract();
   const lang = normalizeTesseractLang(langArg);
 
   try {
-    const { data } = await Tesseract.recognize(imagePath, lang, { logger: () => {} });
+    const { data } = await Tesseract.recognize(image, lang, { logger: () => {} });
     const normalizeConfidence = (value) => {
       if (typeof value !== 'number' || Number.isNaN(value)) return null;
       return value > 1 ? value / 100 : value;
@@ -260,28 +97,22 @@ export const parseLicense = async (req, res) => {
   if (!userId) return res.status(400).json({ success: false, message: "User ID is required" });
   if (!image) return res.status(400).json({ success: false, message: "Image is required" });
 
-  let tempFilePath = null;
-
   try {
-    // Save buffer to temp file
-    const tempDir = os.tmpdir();
-    tempFilePath = path.join(tempDir, `license-${Date.now()}.jpg`);
-    await fs.promises.writeFile(tempFilePath, image.buffer);
-
-    // Run OCR (PaddleOCR with Tesseract Fallback)
-    console.log("Running OCR on:", tempFilePath);
+    // Run OCR (PaddleOCR with Tesseract Fallback) straight from the upload buffer
+    console.log("Running OCR on uploaded license image:", image.originalname, image.size);
     let ocrResult = null;
     
     try {
-      ocrResult = await runPaddleOcr({ filepath: tempFilePath });
+      ocrResult = await runPaddleOcr({ buffer: image.buffer, profile: 'license' });
     } catch (error) {
+      if (sendOcrRejection(res, error)) return;
       console.error('PaddleOCR execution failed:', error.message);
     }
 
     if (!ocrResult) {
         console.log("PaddleOCR failed, trying Tesseract fallback...");
         try {
-            ocrResult = await runTesseractFallback(tempFilePath);
+            ocrResult = await runTesseractFallback(image.buffer);
         } catch (fallbackError) {
             console.error('Tesseract fallback failed:', fallbackError.message);
             throw new Error("OCR failed on both PaddleOCR and Tesseract");
@@ -306,9 +137,6 @@ export const parseLicense = async (req, res) => {
       stream.end(image.buffer);
     });
 
-    // Cleanup temp file
-    try { await fs.promises.unlink(tempFilePath); } catch (e) {}
-
     // Helper to safely parse dates
     const safeDate = (dateStr) => {
         if (!dateStr) return undefined;
@@ -349,7 +177,6 @@ export const parseLicense = async (req, res) => {
     });
 
   } catch (error) {
-    if (tempFilePath) { try { await fs.promises.unlink(tempFilePath); } catch (e) {} }
     console.error("Parse License Error:", error);
     res.status(500).json({ success: false, message: error.message });
   }
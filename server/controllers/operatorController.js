@@ -1,163 +1,6 @@
 import Tricycle from '../models/tricycleModel.js';
 import User from '../models/userModel.js';
-import fs from 'fs';
-import path from 'path';
-import { spawn } from 'child_process';
-
-const resolveOcrScriptPath = () => {
-  const scriptCandidates = [
-    path.join(process.cwd(), 'ocr', 'paddle_scan.py'),
-    path.join(process.cwd(), 'server', 'ocr', 'paddle_scan.py'),
-    path.join(process.cwd(), '..', 'server', 'ocr', 'paddle_scan.py'),
-  ];
-
-  for (const candidate of scriptCandidates) {
-    try {
-      if (fs.existsSync(candidate)) {
-        return { scriptPath: candidate, scriptCandidates };
-      }
-    } catch (error) {
-      // ignore fs permission errors and continue
-    }
-  }
-
-  return { scriptPath: null, scriptCandidates };
-};
-
-const runPaddleOcr = async ({ filepath, langArg, noClsFlag }) => {
-  const { scriptPath, scriptCandidates } = resolveOcrScriptPath();
-
-  if (!scriptPath) {
-    const err = new Error('OCR script not found on server');
-    err.meta = { scriptCandidates };
-    throw err;
-  }
-
-  const baseArgs = [scriptPath, filepath];
-  if (langArg) {
-    baseArgs.push('--lang', String(langArg));
-  }
-  if (noClsFlag) {
-    baseArgs.push('--no-cls');
-  }
-
-  const trySpawn = (cmd) =>
-    new Promise((resolve, reject) => {
-      let proc;
-      try {
-        proc = spawn(cmd, baseArgs, { shell: false, cwd: process.cwd() });
-      } catch (error) {
-        return reject({ code: 'spawn_error', error });
-      }
-
-      let out = '';
-      let err = '';
-      proc.stdout.on('data', (d) => {
-        out += d.toString();
-      });
-      proc.stderr.on('data', (d) => {
-        err += d.toString();
-      });
-
-      const timeout = setTimeout(() => {
-        try {
-          proc.kill();
-        } catch (_) {
-          // ignore
-        }
-        reject({ code: 'timeout', error: new Error('Python script execution timed out') });
-      }, 30000);
-
-      proc.on('error', (error) => {
-        clearTimeout(timeout);
-        reject({ code: 'spawn_error', error });
-      });
-
-      proc.on('close', (code) => {
-        clearTimeout(timeout);
-        resolve({ code, out, err, cmd, args: baseArgs });
-      });
-    });
-
-  const isWindows = process.platform === 'win32';
-  const pythonCommands = isWindows ? ['py', 'python', 'python3'] : ['python3', 'python'];
-  const venvCandidates = [
-    path.join(process.cwd(), '.venv', isWindows ? 'Scripts' : 'bin', isWindows ? 'python.exe' : 'python'),
-    path.join(process.cwd(), 'venv', isWindows ? 'Scripts' : 'bin', isWindows ? 'python.exe' : 'python'),
-  ];
-  for (const vp of venvCandidates) {
-    try {
-      if (fs.existsSync(vp) && !pythonCommands.includes(vp)) {
-        pythonCommands.unshift(vp);
-        break;
-      }
-    } catch (_) {
-      // ignore
-    }
-  }
-
-  const attempts = [];
-  let result = null;
-
-  for (const cmd of pythonCommands) {
-    try {
-      const attempt = await trySpawn(cmd);
-      attempts.push({
-        cmd,
-        code: attempt.code,
-        stderr: attempt.err,
-        hasOutput: Boolean(attempt.out && attempt.out.length > 0),
-      });
-
-      if (attempt.code === 0 && attempt.out && attempt.out.length > 0) {
-        result = attempt;
-        break;
-      }
-
-      if (!result && attempt.out && attempt.out.length > 0) {
-        result = attempt; // keep the most informative output even if exit code != 0
-      }
-    } catch (spawnErr) {
-      attempts.push({
-        cmd,
-        code: spawnErr.code || 'spawn_error',
-        error: spawnErr.error?.message || spawnErr.message || String(spawnErr),
-      });
-    }
-  }
-
-  if (!result || (result.code !== 0 && (!result.out || result.out.length === 0))) {
-    const err = new Error('Failed to execute OCR python');
-    err.meta = { attempts, scriptPath, platform: process.platform };
-    throw err;
-  }
-
-  if (result.out && result.out.length > 0) {
-    try {
-      const parsed = JSON.parse(result.out);
-      if (parsed.error) {
-        const err = new Error(parsed.error || 'OCR python reported an error');
-        err.meta = { detail: parsed, attempts, scriptPath, stderr: result.err };
-        throw err;
-      }
-      return parsed;
-    } catch (parseErr) {
-      const err = new Error('Invalid OCR output');
-      err.meta = {
-        parseError: parseErr.message || String(parseErr),
-        raw: result.out,
-        stderr: result.err,
-        attempts,
-        scriptPath,
-      };
-      throw err;
-    }
-  }
-
-  const err = new Error('OCR python returned no output');
-  err.meta = { attempts, scriptPath, stderr: result?.err };
-  throw err;
-};
+import { runPaddleOcr, sendOcrRejection } from '../utils/ocrRunner.js';
 
 let cachedTesseract = null;
 const loadTesseract = async () => {
@@ -192,12 +35,13 @@ const normalizeTesseractLang = (langArg) => {
   return 'eng';
 };
 
-const runTesseractFallback = async (imagePath, langArg) => {
+// image may be a file path or a Buffer
+const runTesseractFallback = async (image, langArg) => {
   const Tesseract = await loadTesseract();
   const lang = normalizeTesseractLang(langArg);
 
   try {
-    const { data } = await Tesseract.recognize(imagePath, lang, { logger: () => {} });
+    const { data } = await Tesseract.recognize(image, lang, { logger: () => {} });
     const normalizeConfidence = (value) => {
       if (typeof value !== 'number' || Number.isNaN(value)) return null;
       return value > 1 ? value / 100 : value;
@@ -614,17 +458,13 @@ export const getDriverDetails = async (req, res) => {
 
 // ==================== SCAN RECEIPT (PaddleOCR via Python) ====================
 export const scanReceipt = async (req, res) => {
-  let filepath = null;
   try {
     if (!req.file) {
       return res.status(400).json({ success: false, message: 'No image uploaded' });
     }
 
-    const uploadsDir = path.join(process.cwd(), 'tmp_uploads');
-    if (!fs.existsSync(uploadsDir)) fs.mkdirSync(uploadsDir, { recursive: true });
-    const filename = `receipt-${Date.now()}-${Math.random().toString(36).slice(2, 8)}${path.extname(req.file.originalname) || '.jpg'}`;
-    filepath = path.join(uploadsDir, filename);
-    fs.writeFileSync(filepath, req.file.buffer);
+    // The image bytes are piped straight to the OCR process; nothing is written to tmp_uploads.
+    const imageBuffer = req.file.buffer;
 
     const langArg = (req.body && req.body.lang) || (req.query && req.query.lang) || process.env.PADDLE_OCR_LANG || 'en';
     const noClsFlag =
@@ -635,8 +475,9 @@ export const scanReceipt = async (req, res) => {
     let paddleError = null;
 
     try {
-      paddleResult = await runPaddleOcr({ filepath, langArg, noClsFlag });
+      paddleResult = await runPaddleOcr({ buffer: imageBuffer, langArg, noClsFlag, profile: 'receipt' });
     } catch (error) {
+      if (sendOcrRejection(res, error)) return;
       paddleError = error;
       console.error('PaddleOCR execution failed:', error.message, error.meta || '');
     }
@@ -650,7 +491,7 @@ export const scanReceipt = async (req, res) => {
     }
 
     try {
-      const fallbackResult = await runTesseractFallback(filepath, langArg);
+      const fallbackResult = await runTesseractFallback(imageBuffer, langArg);
       return res.status(200).json({
         success: true,
         data: fallbackResult,
@@ -675,14 +516,6 @@ export const scanReceipt = async (req, res) => {
   } catch (error) {
     console.error('Error in scanReceipt:', error.message);
     res.status(500).json({ success: false, message: 'Server Error', error: error.message });
-  } finally {
-    if (filepath) {
-      try {
-        if (fs.existsSync(filepath)) fs.unlinkSync(filepath);
-      } catch (cleanupError) {
-        console.warn('Failed to cleanup temp OCR file:', cleanupError.message);
-      }
-    }
   }
 };
 
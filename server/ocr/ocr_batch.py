@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Bulk scanning for paddle_scan.py (--batch).
+
+Images are fanned out to a pool of worker processes, each holding its own warm PaddleOCR, and one JSON
+line is streamed per image, then a {"event": "done"} summary. Started through paddle_scan.py:
+
+  python paddle_scan.py --batch tmp_uploads --batch manifest.txt --workers 4
+"""
+import sys, os, json
+import glob
+import time
+
+from paddle_scan import (OcrResultCache, cached_scan, encode_compact, get_ocr, instrumented_scan,
+                         open_protocol_stream, resolve_scan_options, set_cpu_threads)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def resolve_batch_inputs(specs):
+    """
+    Expand --batch specs into unique image paths. Each spec may be a directory (its images, sorted),
+    an image file, a manifest (one path per line, or a JSON list; relative paths resolve against
+    the manifest's folder) or a glob pattern (** allowed).
+    """
+    paths = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            for name in sorted(os.listdir(spec)):
+                full = os.path.join(spec, name)
+                if os.path.isfile(full) and name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(full)
+        elif os.path.isfile(spec) and spec.lower().endswith(IMAGE_EXTENSIONS):
+            paths.append(spec)
+        elif os.path.isfile(spec):
+            base = os.path.dirname(os.path.abspath(spec))
+            with open(spec, 'r', encoding='utf-8') as fh:
+                content = fh.read()
+            if spec.lower().endswith('.json'):
+                entries = json.loads(content)
+            else:
+                entries = [ln.strip() for ln in content.splitlines() if ln.strip() and not ln.strip().startswith('#')]
+            for entry in entries:
+                entry = str(entry)
+                paths.append(entry if os.path.isabs(entry) else os.path.join(base, entry))
+        else:
+            paths.extend(sorted(p for p in glob.glob(spec, recursive=True) if os.path.isfile(p)))
+    # the same file reached through several specs is scanned once
+    seen = set()
+    unique = []
+    for path in paths:
+        key = os.path.normcase(os.path.abspath(path))
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+
+# Per-process state of a --batch worker, set once by _batch_worker_init.
+_BATCH_WORKER = {}
+
+
+def _batch_worker_init(lang, use_cls, options, cache_dir, cache_max_bytes, metrics_mode='off', profile_dir=None,
+                       cpu_threads=None):
+    # stdout belongs to the parent's result stream
+    sys.stdout = sys.stderr
+    set_cpu_threads(cpu_threads)
+    _BATCH_WORKER['metrics_mode'] = metrics_mode
+    _BATCH_WORKER['profile_dir'] = profile_dir
+    _BATCH_WORKER['lang'] = lang
+    _BATCH_WORKER['use_cls'] = use_cls
+    _BATCH_WORKER['options'] = options
+    _BATCH_WORKER['cache'] = OcrResultCache(cache_dir=cache_dir, max_bytes=cache_max_bytes) if cache_dir else None
+    try:
+        # warm up before the first image arrives
+        get_ocr(lang, profile=resolve_scan_options(options)['inference_profile'])
+    except Exception as e:
+        _BATCH_WORKER['init_error'] = str(e)
+
+
+def _batch_scan_one(path):
+    """
+    Scan one image inside a worker. Never raises: failures come back as an error payload.
+    """
+    started = time.time()
+    try:
+        if _BATCH_WORKER.get('init_error'):
+            payload = {'error': 'Failed to initialize PaddleOCR', 'detail': _BATCH_WORKER['init_error']}
+        else:
+            payload = instrumented_scan(
+                _BATCH_WORKER['metrics_mode'],
+                lambda timer, metrics: cached_scan(_BATCH_WORKER['cache'], get_ocr, path, _BATCH_WORKER['lang'],
+                                                   use_cls=_BATCH_WORKER['use_cls'], options=_BATCH_WORKER['options'],
+                                                   timer=timer, metrics=metrics),
+                context={'path': path, 'lang': _BATCH_WORKER['lang']}, profile_dir=_BATCH_WORKER['profile_dir'],
+            )
+    except Exception as e:
+        payload = {'error': 'OCR failed', 'detail': str(e)}
+    result = {'path': path}
+    result.update(payload)
+    result['elapsed_ms'] = round((time.time() - started) * 1000, 1)
+    result['worker_pid'] = os.getpid()
+    return result
+
+
+def run_batch(specs, workers=None, lang='en', use_cls=True, options=None, cache_dir=None,
+              cache_max_bytes=200 * 1024 * 1024, metrics_mode='off', profile_dir=None, output_format='json'):
+    """
+    Scan many images with a fixed pool of worker processes, each holding its own warm PaddleOCR.
+    Streams one JSON line per image (in completion order) followed by a
+    {"event": "done", ...} summary line. One bad image only yields an error line for that image.
+    """
+    import multiprocessing
+
+    out = open_protocol_stream()
+
+    def send(payload):
+        out.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        out.flush()
+
+    try:
+        paths = resolve_batch_inputs(specs)
+    except Exception as e:
+        send({'event': 'error', 'error': 'Could not resolve batch inputs', 'detail': str(e)})
+        return 1
+    if not paths:
+        send({'event': 'error', 'error': 'No images matched', 'inputs': specs})
+        return 1
+
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(int(workers or min(4, cpus)), len(paths)))
+    # split the cores between workers instead of every paddle process grabbing all of them
+    threads = max(1, cpus // workers)
+    os.environ.setdefault('OMP_NUM_THREADS', str(threads))
+
+    started = time.time()
+    ok = failed = 0
+    # spawn: paddle is not fork-safe once its thread pools exist
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes=workers, initializer=_batch_worker_init,
+                  initargs=(lang, use_cls, resolve_scan_options(options), cache_dir, cache_max_bytes,
+                            metrics_mode, profile_dir, threads)) as pool:
+        for result in pool.imap_unordered(_batch_scan_one, paths, chunksize=1):
+            if 'error' in result:
+                failed += 1
+            else:
+                ok += 1
+            send(encode_compact(result) if output_format == 'compact' else result)
+
+    elapsed = time.time() - started
+    send({'event': 'done', 'total': len(paths), 'ok': ok, 'failed': failed, 'workers': workers,
+          'elapsed_s': round(elapsed, 3), 'images_per_s': round(len(paths) / elapsed, 3) if elapsed > 0 else None})
+    return 0
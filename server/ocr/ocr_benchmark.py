@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+Benchmark harness for the paddle_scan.py pipeline.
+
+Runs scan_image over a corpus (real images and/or synthetic license/receipt images generated in
+memory, so it also works offline) and reports paddle import and model init time, per-stage wall
+time, images/sec, p50/p95 latency and peak RSS as JSON. Pass --baseline to compare against a saved run.
+
+Usage:
+  python ocr_benchmark.py --synthetic 10 --out bench.json
+  python ocr_benchmark.py --corpus ../tmp_uploads --synthetic 5 --repeat 3 --baseline bench.json
+  python ocr_benchmark.py --synthetic 10 --option crop_select=gated --det text_det_thresh=0.3 --preprocess max_width=2400
+"""
+import sys, os, json
+import io
+import platform
+import random
+import time
+
+import paddle_scan
+from ocr_batch import resolve_batch_inputs
+from paddle_scan import (Image, StageTimer, create_ocr, peak_rss_mb, resolve_scan_options, scan_image,
+                         summarize_ms)
+
+# Timing differences below this are noise, never reported as a regression
+NOISE_FLOOR_MS = 1.0
+
+# Metrics compared against a baseline: name -> True when higher is better
+COMPARED_METRICS = {
+    'images_per_s': True,
+    'latency_ms.p50': False,
+    'latency_ms.p95': False,
+    'paddle_import_ms': False,
+    'model_init_ms': False,
+    'peak_rss_mb': False,
+}
+
+
+def _font(size):
+    from PIL import ImageFont
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has a single fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _encode(img, quality=90):
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def synthetic_license(rng, width=1600, height=1000):
+    """
+    LTO-style driver's license card on a noisy background, returned as JPEG bytes.
+    """
+    from PIL import ImageDraw
+    img = Image.new('RGB', (width, height), (rng.randint(90, 140),) * 3)
+    draw = ImageDraw.Draw(img)
+    card = (80, 80, width - 80, height - 80)
+    draw.rounded_rectangle(card, radius=30, fill=(236, 240, 232), outline=(40, 90, 60), width=4)
+    last = rng.choice(['DELA CRUZ', 'SANTOS', 'REYES', 'GARCIA', 'MENDOZA'])
+    first = rng.choice(['JUAN', 'MARIA', 'JOSE', 'ANA', 'PEDRO'])
+    lic = f"{rng.choice('ABCDKLN')}{rng.randint(0, 99):02d}-{rng.randint(0, 99):02d}-{rng.randint(0, 999999):06d}"
+    rows = [
+        ('REPUBLIC OF THE PHILIPPINES', 34),
+        ("DRIVER'S LICENSE", 46),
+        ('Last Name, First Name, Middle Name', 24),
+        (f'{last}, {first} {rng.choice("ABCDEFG")}.', 38),
+        (f'Sex {rng.choice("MF")}   Date of Birth {rng.randint(1960, 2004)}/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}', 30),
+        (f'Address {rng.randint(1, 999)} RIZAL ST, QUEZON CITY', 28),
+        (f'License No. {lic}   Expiration Date {rng.randint(2026, 2035)}/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}', 30),
+        (f'Blood Type {rng.choice(["A+", "B+", "O+", "AB-"])}   Restrictions {rng.choice(["1,2", "A,B", "1"])}', 30),
+    ]
+    y = 130
+    for text, size in rows:
+        draw.text((140, y), text, fill=(20, 20, 20), font=_font(size))
+        y += int(size * 2.2)
+    return _encode(img)
+
+
+def synthetic_receipt(rng, width=700, lines=45):
+    """
+    Long thermal-printer style receipt, returned as JPEG bytes.
+    """
+    from PIL import ImageDraw
+    height = 220 + lines * 42
+    img = Image.new('RGB', (width, height), (250, 250, 246))
+    draw = ImageDraw.Draw(img)
+    font = _font(26)
+    draw.text((180, 40), 'TRICYCLE PARTS & SUPPLY', fill=(10, 10, 10), font=font)
+    draw.text((200, 80), f'OR No. {rng.randint(100000, 999999)}', fill=(10, 10, 10), font=font)
+    total = 0.0
+    y = 140
+    for _ in range(lines):
+        price = rng.randint(20, 2500) + rng.choice([0, 0.5, 0.25])
+        total += price
+        item = rng.choice(['SPARK PLUG', 'ENGINE OIL 1L', 'BRAKE SHOE', 'CHAIN SET', 'TIRE 2.75-17', 'LABOR'])
+        draw.text((40, y), item, fill=(10, 10, 10), font=font)
+        draw.text((width - 200, y), f'{price:,.2f}', fill=(10, 10, 10), font=font)
+        y += 42
+    draw.text((40, y + 10), f'TOTAL {total:,.2f}', fill=(0, 0, 0), font=_font(32))
+    return _encode(img)
+
+
+def build_corpus(corpus_specs, synthetic, seed):
+    """
+    List of (name, image_bytes): files from --corpus specs plus `synthetic` generated images
+    alternating license/receipt.
+    """
+    corpus = []
+    for path in resolve_batch_inputs(corpus_specs or []):
+        with open(path, 'rb') as fh:
+            corpus.append((os.path.basename(path), fh.read()))
+    rng = random.Random(seed)
+    for i in range(synthetic):
+        if i % 2 == 0:
+            corpus.append((f'synthetic-license-{i}', synthetic_license(rng)))
+        else:
+            corpus.append((f'synthetic-receipt-{i}', synthetic_receipt(rng)))
+    return corpus
+
+
+def parse_assignments(pairs):
+    """
+    ['key=value', ...] -> dict with JSON-decoded values where possible (numbers, booleans).
+    """
+    out = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        try:
+            out[key.strip()] = json.loads(value)
+        except ValueError:
+            out[key.strip()] = value
+    return out
+
+
+def compare(current, baseline):
+    """
+    Relative change of COMPARED_METRICS and of every per-stage mean between two runs.
+    Returns {metric: {'baseline', 'current', 'delta_pct', 'regressed'}}.
+    """
+    def lookup(report, dotted):
+        node = report
+        for part in dotted.split('.'):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    metrics = dict(COMPARED_METRICS)
+    for stage in current.get('stages_ms', {}):
+        metrics[f'stages_ms.{stage}.mean'] = False
+
+    result = {}
+    for name, higher_is_better in metrics.items():
+        cur, base = lookup(current, name), lookup(baseline, name)
+        if not isinstance(cur, (int, float)) or not isinstance(base, (int, float)) or base == 0:
+            continue
+        delta = (cur - base) / float(base) * 100.0
+        regressed = delta < 0 if higher_is_better else delta > 0
+        if '_ms' in name and abs(cur - base) < NOISE_FLOOR_MS:
+            regressed = False
+        result[name] = {
+            'baseline': base,
+            'current': cur,
+            'delta_pct': round(delta, 2),
+            'regressed': regressed,
+        }
+    return result
+
+
+def run_benchmark(corpus, lang='en', use_cls=True, options=None, det_params=None, repeat=1, warmup=1):
+    options = resolve_scan_options(options)
+
+    # paddle is imported lazily; time the import apart from building the model
+    t0 = time.perf_counter()
+    paddle_scan.load_paddleocr()
+    paddle_import_ms = (time.perf_counter() - t0) * 1000.0
+    t0 = time.perf_counter()
+    ocr = create_ocr(lang, det_params=det_params, profile=options['inference_profile'])
+    model_init_ms = (time.perf_counter() - t0) * 1000.0
+
+    # untimed warm-up so first-call allocations don't skew the percentiles
+    for name, data in corpus[:max(0, warmup)]:
+        scan_image(ocr, data, use_cls=use_cls, options=options)
+
+    latencies = []
+    stage_samples = {}
+    per_image = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(max(1, repeat)):
+        for name, data in corpus:
+            timer = StageTimer()
+            t = time.perf_counter()
+            payload = scan_image(ocr, data, use_cls=use_cls, options=options, timer=timer)
+            json.dumps(payload, ensure_ascii=False)
+            timer.lap('json')
+            elapsed = (time.perf_counter() - t) * 1000.0
+            latencies.append(elapsed)
+            for stage, ms in timer.stages.items():
+                stage_samples.setdefault(stage, []).append(ms)
+            if 'error' in payload:
+                errors += 1
+            per_image.append({'image': name, 'latency_ms': round(elapsed, 2),
+                              'lines': len(payload.get('lines') or []), 'error': payload.get('error')})
+    wall = time.perf_counter() - started
+
+    return {
+        'images': len(latencies),
+        'errors': errors,
+        'paddle_import_ms': round(paddle_import_ms, 2),
+        'model_init_ms': round(model_init_ms, 2),
+        'wall_s': round(wall, 3),
+        'images_per_s': round(len(latencies) / wall, 3) if wall > 0 else None,
+        'latency_ms': summarize_ms(latencies),
+        'stages_ms': {stage: dict(summarize_ms(v), total=round(sum(v), 2)) for stage, v in stage_samples.items()},
+        'peak_rss_mb': peak_rss_mb(),
+        'config': {
+            'lang': lang,
+            'use_cls': use_cls,
+            'options': options,
+            'det_params': dict(paddle_scan.OCR_DET_PARAMS, **(det_params or {})),
+            'inference': paddle_scan.inference_settings(lang, options['inference_profile']),
+            'preprocess': dict(paddle_scan.PAGE_PREPROCESS),
+            'model': paddle_scan.model_version(),
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'per_image': per_image,
+    }
+
+
+def parse_args(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the paddle_scan.py OCR pipeline.')
+    parser.add_argument('--corpus', action='append', metavar='DIR|GLOB|MANIFEST',
+                        help='real images to include (same forms as paddle_scan.py --batch); repeatable')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='number of generated license/receipt images to add (works offline)')
+    parser.add_argument('--seed', type=int, default=1234, help='seed for the synthetic images')
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the corpus')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed scans before measuring')
+    parser.add_argument('--lang', '-l', default='en')
+    parser.add_argument('--no-cls', dest='use_cls', action='store_false')
+    parser.add_argument('--option', action='append', metavar='KEY=VALUE',
+                        help='scan option override, e.g. crop_select=gated (see DEFAULT_SCAN_OPTIONS)')
+    parser.add_argument('--det', action='append', metavar='KEY=VALUE',
+                        help='PaddleOCR detection parameter override, e.g. text_det_thresh=0.3')
+    parser.add_argument('--preprocess', action='append', metavar='KEY=VALUE',
+                        help='full-page preprocessing override, e.g. max_width=2400')
+    parser.add_argument('--out', help='also write the report to this file')
+    parser.add_argument('--baseline', help='saved report to compare against')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='exit 1 if a compared metric regresses by more than this percent')
+    parser.add_argument('--no-per-image', action='store_true', help='omit per-image rows from the report')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    out = paddle_scan.open_protocol_stream()
+
+    corpus = build_corpus(args.corpus, args.synthetic, args.seed)
+    if not corpus:
+        out.write(json.dumps({'error': 'Empty corpus', 'hint': 'pass --corpus and/or --synthetic N'}) + "\n")
+        sys.exit(1)
+
+    paddle_scan.PAGE_PREPROCESS.update(parse_assignments(args.preprocess))
+    report = run_benchmark(
+        corpus,
+        lang=args.lang,
+        use_cls=args.use_cls,
+        options=parse_assignments(args.option),
+        det_params=parse_assignments(args.det),
+        repeat=args.repeat,
+        warmup=args.warmup,
+    )
+    if args.no_per_image:
+        report.pop('per_image', None)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        report['comparison'] = compare(report, baseline)
+        if args.max_regression is not None:
+            regressions = [name for name, c in report['comparison'].items()
+                           if c['regressed'] and abs(c['delta_pct']) > args.max_regression]
+            report['regressions'] = regressions
+            if regressions:
+                exit_code = 1
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fh:
+            fh.write(text + "\n")
+    out.write(text + "\n")
+    out.flush()
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
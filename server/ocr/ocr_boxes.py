@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Detection box geometry and line merging for paddle_scan.py.
+
+Boxes are point lists as PaddleOCR returns them ([[x, y], ...], numpy arrays included) or flat
+[x1, y1, x2, y2]; lines are {'text', 'confidence', 'box'} dicts.
+"""
+
+
+def box_points(box):
+    """
+    A detection box as a list of (x, y) floats. Accepts point lists/arrays and flat [x1, y1, x2, y2].
+    """
+    if hasattr(box, 'tolist'):
+        box = box.tolist()
+    elif isinstance(box, (list, tuple)):
+        box = [v.tolist() if hasattr(v, 'tolist') else v for v in box]
+    if not isinstance(box, list) or not box:
+        return []
+    if all(isinstance(v, (int, float)) for v in box):
+        if len(box) == 4:
+            x1, y1, x2, y2 = box
+            return [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+        return [(box[i], box[i + 1]) for i in range(0, len(box) - 1, 2)]
+    points = []
+    for p in box:
+        try:
+            points.append((float(p[0]), float(p[1])))
+        except Exception:
+            continue
+    return points
+
+
+def box_rect(box):
+    """
+    Axis-aligned (x0, y0, x1, y1) around a detection box, or None when it has no usable points.
+    """
+    points = box_points(box)
+    if not points:
+        return None
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def rect_iou(a, b):
+    """
+    Intersection over union of two (x0, y0, x1, y1) rects.
+    """
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class BoxIndex:
+    """
+    Uniform grid over rects for overlap lookups. Each rect is filed under every cell it touches,
+    so a query only compares against its neighbours and merging stays near-linear in the box count.
+    """
+
+    def __init__(self, cell=64.0):
+        self.cell = max(float(cell), 1.0)
+        self.rects = []
+        self._cells = {}
+
+    def _keys(self, rect):
+        c = self.cell
+        for gx in range(int(rect[0] // c), int(rect[2] // c) + 1):
+            for gy in range(int(rect[1] // c), int(rect[3] // c) + 1):
+                yield gx, gy
+
+    def add(self, rect):
+        idx = len(self.rects)
+        self.rects.append(rect)
+        for key in self._keys(rect):
+            self._cells.setdefault(key, []).append(idx)
+        return idx
+
+    def overlapping(self, rect):
+        """
+        Indices of the stored rects that intersect rect.
+        """
+        seen = set()
+        for key in self._keys(rect):
+            for idx in self._cells.get(key, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                other = self.rects[idx]
+                if min(rect[2], other[2]) > max(rect[0], other[0]) and min(rect[3], other[3]) > max(rect[1], other[1]):
+                    yield idx
+
+    def best_overlap(self, rect, min_iou=0.5):
+        """
+        Index of the stored rect with the highest IoU against rect (at least min_iou), or None.
+        """
+        best, best_iou = None, min_iou
+        seen = set()
+        for key in self._keys(rect):
+            for idx in self._cells.get(key, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                iou = rect_iou(rect, self.rects[idx])
+                if iou >= best_iou:
+                    best, best_iou = idx, iou
+        return best
+
+
+def line_confidence(item):
+    try:
+        return float(item.get('confidence'))
+    except (TypeError, ValueError):
+        return -1.0
+
+
+def reading_order(lines):
+    """
+    Sort boxed lines top-to-bottom, then left-to-right within a row. A line joins the current row
+    when its vertical centre is within half a line height of the row's; boxless lines go last.
+    """
+    boxed, boxless = [], []
+    for item in lines:
+        rect = box_rect(item.get('box'))
+        (boxed if rect is not None else boxless).append((rect, item))
+    boxed.sort(key=lambda pair: (pair[0][1] + pair[0][3]) / 2.0)
+
+    rows, row, row_cy, row_h = [], [], None, None
+    for rect, item in boxed:
+        cy, h = (rect[1] + rect[3]) / 2.0, max(rect[3] - rect[1], 1.0)
+        if row and abs(cy - row_cy) <= 0.5 * min(h, row_h):
+            row.append((rect, item))
+            continue
+        if row:
+            rows.append(row)
+        row, row_cy, row_h = [(rect, item)], cy, h
+    if row:
+        rows.append(row)
+
+    ordered = []
+    for row in rows:
+        ordered.extend(item for _, item in sorted(row, key=lambda pair: pair[0][0]))
+    ordered.extend(item for _, item in boxless)
+    return ordered
+
+
+def merge_lines(first_pass, crop_results=None, iou_threshold=0.5):
+    """
+    Box-aware merge of first-pass lines and their crop re-reads. Lines whose boxes overlap by at
+    least iou_threshold are the same region: the more confident read wins (a crop re-read wins ties).
+    Equal text in different places is kept; lines without a box fall back to exact-text dedup.
+    Returns (lines in reading order, counts) with counts of duplicates_dropped, crop_replaced
+    and crop_lines_added.
+    """
+    counts = {'duplicates_dropped': 0, 'crop_replaced': 0, 'crop_lines_added': 0}
+    items = [(item, False) for item in first_pass] + [(item, True) for item in (crop_results or [])]
+    rects = [box_rect(item.get('box')) for item, _ in items]
+    heights = sorted(r[3] - r[1] for r in rects if r is not None)
+    # cells a few lines tall keep the candidate lists short on dense receipts
+    index = BoxIndex(cell=4.0 * heights[len(heights) // 2] if heights else 64.0)
+
+    kept = []
+    kept_at = []  # index rect id -> position in kept
+    boxless_texts = set()
+    for (item, is_crop), rect in zip(items, rects):
+        text = str(item.get('text') or '').strip()
+        if not text:
+            continue
+        if rect is None:
+            if text in boxless_texts:
+                if not is_crop:
+                    counts['duplicates_dropped'] += 1
+                continue
+            boxless_texts.add(text)
+            kept.append(item)
+            if is_crop:
+                counts['crop_lines_added'] += 1
+            continue
+        match = index.best_overlap(rect, iou_threshold)
+        if match is None:
+            index.add(rect)
+            kept_at.append(len(kept))
+            kept.append(item)
+            if is_crop:
+                counts['crop_lines_added'] += 1
+            continue
+        current = kept_at[match]
+        if is_crop:
+            if line_confidence(item) >= line_confidence(kept[current]):
+                kept[current] = item
+                counts['crop_replaced'] += 1
+        else:
+            counts['duplicates_dropped'] += 1
+            if line_confidence(item) > line_confidence(kept[current]):
+                kept[current] = item
+    return reading_order(kept), counts
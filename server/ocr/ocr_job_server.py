@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+"""
+Shared OCR job server for paddle_scan.py (--listen).
+
+Clients connect over a Unix socket or local TCP and speak the --server NDJSON protocol; scans wait in
+one bounded queue for a fixed number of inference threads. Started through paddle_scan.py:
+
+  python paddle_scan.py --listen unix:/tmp/ocr.sock --workers 2 --queue-size 16
+"""
+import os, json
+import asyncio
+import signal
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from paddle_scan import (DeadlineTimer, ScanCancelled, cached_scan, encode_compact, get_thread_ocr,
+                         instrumented_scan, log_event, open_protocol_stream, parse_scan_request,
+                         resolve_scan_options, startup_report, summarize_ms)
+
+
+# Request lines carry base64 images, far beyond asyncio's 64 KiB default line limit
+MAX_REQUEST_BYTES = 32 * 1024 * 1024
+
+
+def parse_listen_address(spec):
+    """
+    --listen value -> ('unix', path) or ('tcp', host, port). Accepts 'unix:/path/ocr.sock',
+    'host:port' or a bare port, which binds to 127.0.0.1.
+    """
+    if spec.startswith('unix:'):
+        return ('unix', spec[len('unix:'):])
+    host, _, port = spec.rpartition(':')
+    return ('tcp', host or '127.0.0.1', int(port))
+
+
+class JobServer:
+    """
+    Shared OCR job server (--listen). Clients connect over a Unix socket or local TCP and speak the
+    --server NDJSON protocol, several requests in flight per connection. Scans wait in one bounded
+    queue for `workers` inference threads, each owning its models (get_thread_ocr).
+
+    Backpressure and deadlines:
+      - a scan arriving at a full queue is answered at once with
+        {"id": ..., "error": "Server busy", "busy": true, "queue_depth": n, "queue_size": n}
+      - every scan has a deadline (timeout_ms request field, default job_timeout); past it the client
+        gets {"error": "Job timed out", "timeout_ms": n} and the scan is dropped from the queue or
+        abandoned at its next stage boundary (DeadlineTimer)
+      - {"id": ..., "op": "cancel", "target": <scan id>} and closing the connection cancel the same way
+
+    Ops besides scan/ping/shutdown: {"op": "stats"} answers {"event": "stats", ...} with queue depth,
+    running jobs, counters and wait/run time percentiles. Scan payloads carry
+    "job": {"queue_ms": ..., "run_ms": ...}. "stream": true works as with --server.
+    """
+
+    def __init__(self, workers=2, queue_size=16, job_timeout=30.0, default_lang='en', default_use_cls=True,
+                 preload_langs=None, default_options=None, cache=None, metrics_mode='off', profile_dir=None,
+                 output_format='json'):
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.job_timeout = float(job_timeout)
+        self.default_lang = default_lang
+        self.default_use_cls = default_use_cls
+        self.preload_langs = preload_langs or [default_lang]
+        self.default_options = default_options
+        self.cache = cache
+        self.metrics_mode = metrics_mode
+        self.profile_dir = profile_dir
+        self.output_format = output_format
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected_busy': 0, 'timed_out': 0,
+                         'cancelled': 0}
+        # recent samples only, so the percentiles follow the current load
+        self.wait_ms = deque(maxlen=1000)
+        self.run_ms = deque(maxlen=1000)
+        self.running = 0
+        self.queue = None
+        self.connections = {}
+        self._stop = None
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'queue_size': self.queue_size,
+            'workers': self.workers,
+            'running': self.running,
+            'counters': dict(self.counters),
+            'wait_ms': summarize_ms(list(self.wait_ms)),
+            'run_ms': summarize_ms(list(self.run_ms)),
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
+
+    def _preload(self):
+        profile = resolve_scan_options(self.default_options)['inference_profile']
+        for lang in self.preload_langs:
+            get_thread_ocr(lang, profile=profile)
+
+    def _run_job(self, job):
+        """
+        Runs on an inference thread. Returns the payload, or None when the scan was abandoned.
+        """
+        source, lang, use_cls, options = job['args']
+        try:
+            return instrumented_scan(
+                self.metrics_mode,
+                lambda timer, metrics: cached_scan(self.cache, get_thread_ocr, source, lang, use_cls=use_cls,
+                                                   options=options, timer=timer, metrics=metrics,
+                                                   on_event=job['on_event']),
+                context={'id': job['id'], 'lang': lang, 'queue_ms': round(job['wait_ms'], 2)},
+                profile_dir=self.profile_dir, timer=job['timer'],
+            )
+        except ScanCancelled as e:
+            log_event('ocr_job_abandoned', id=job['id'], reason=str(e))
+            return None
+        except Exception as e:
+            return {'error': 'OCR failed', 'detail': str(e)}
+
+    async def _worker(self, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                # answered already (timed out or cancelled while queued): never start it
+                if job['future'].done():
+                    continue
+                job['wait_ms'] = (time.monotonic() - job['enqueued']) * 1000.0
+                self.wait_ms.append(job['wait_ms'])
+                self.running += 1
+                started = time.monotonic()
+                try:
+                    payload = await loop.run_in_executor(executor, self._run_job, job)
+                finally:
+                    self.running -= 1
+                job['run_ms'] = (time.monotonic() - started) * 1000.0
+                self.run_ms.append(job['run_ms'])
+                if payload is not None and not job['future'].done():
+                    self.counters['failed' if 'error' in payload else 'completed'] += 1
+                    job['future'].set_result(payload)
+            finally:
+                self.queue.task_done()
+
+    def _abandon(self, job, payload, reason):
+        # answers the client (if payload) and stops the scan wherever it is
+        job['timer'].cancel(reason)
+        if not job['future'].done():
+            job['future'].set_result(payload)
+            return True
+        return False
+
+    async def _answer(self, conn, job):
+        try:
+            remaining = max(0.0, job['deadline'] - time.monotonic())
+            payload = await asyncio.wait_for(asyncio.shield(job['future']), remaining)
+        except asyncio.TimeoutError:
+            payload = {'error': 'Job timed out', 'timeout_ms': job['timeout_ms']}
+            if self._abandon(job, payload, 'deadline exceeded'):
+                self.counters['timed_out'] += 1
+            payload = job['future'].result()
+        finally:
+            if conn['jobs'].get(job['id']) is job:
+                del conn['jobs'][job['id']]
+        if payload is None:
+            return  # connection gone
+        payload = dict(payload, id=job['id'])
+        if job['on_event'] is not None:
+            payload['event'] = 'done'
+        if 'wait_ms' in job:
+            payload['job'] = {'queue_ms': round(job['wait_ms'], 2)}
+            if 'run_ms' in job:
+                payload['job']['run_ms'] = round(job['run_ms'], 2)
+        if (job['format'] or self.output_format) == 'compact':
+            payload = encode_compact(payload)
+        await self._send(conn, payload)
+
+    async def _send(self, conn, payload):
+        if conn['closed']:
+            return
+        async with conn['lock']:
+            try:
+                conn['writer'].write((json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8'))
+                await conn['writer'].drain()
+            except Exception:
+                conn['closed'] = True
+
+    def _event_sender(self, conn, job):
+        """
+        on_event for a streamed scan. Called on the inference thread; the messages are written by the
+        loop in the order they were produced, and dropped once the job has been answered.
+        """
+        loop = asyncio.get_running_loop()
+
+        def write(event):
+            if not job['future'].done():
+                task = asyncio.ensure_future(self._send(conn, dict(event, id=job['id'])))
+                conn['tasks'].add(task)
+                task.add_done_callback(conn['tasks'].discard)
+
+        return lambda event: loop.call_soon_threadsafe(write, event)
+
+    def _submit(self, conn, req):
+        req_id = req.get('id')
+        args, error = parse_scan_request(req, self.default_lang, self.default_use_cls, self.default_options)
+        if error:
+            error['id'] = req_id
+            return error
+        try:
+            timeout_ms = float(req.get('timeout_ms') or self.job_timeout * 1000.0)
+        except (TypeError, ValueError):
+            return {'id': req_id, 'error': 'Invalid timeout_ms', 'timeout_ms': req.get('timeout_ms')}
+        now = time.monotonic()
+        job = {
+            'id': req_id, 'args': args, 'format': req.get('format'), 'enqueued': now,
+            'timeout_ms': timeout_ms, 'deadline': now + timeout_ms / 1000.0,
+            'timer': DeadlineTimer(now + timeout_ms / 1000.0),
+            'future': asyncio.get_running_loop().create_future(), 'on_event': None,
+        }
+        if req.get('stream'):
+            job['on_event'] = self._event_sender(conn, job)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counters['rejected_busy'] += 1
+            return {'id': req_id, 'error': 'Server busy', 'busy': True, 'queue_depth': self.queue.qsize(),
+                    'queue_size': self.queue_size}
+        self.counters['submitted'] += 1
+        conn['jobs'][req_id] = job
+        conn['tasks'].add(asyncio.ensure_future(self._answer(conn, job)))
+        return None
+
+    async def _handle(self, reader, writer):
+        conn = {'writer': writer, 'jobs': {}, 'tasks': set(), 'lock': asyncio.Lock(), 'closed': False}
+        self.connections[id(conn)] = conn
+        try:
+            while not self._stop.is_set():
+                try:
+                    raw_line = await reader.readline()
+                except ValueError:
+                    await self._send(conn, {'error': 'Invalid request', 'detail': 'request line too long'})
+                    break
+                if not raw_line:
+                    break
+                raw_line = raw_line.strip()
+                if not raw_line:
+                    continue
+                try:
+                    req = json.loads(raw_line)
+                    if not isinstance(req, dict):
+                        raise ValueError('request must be a JSON object')
+                except Exception as e:
+                    await self._send(conn, {'error': 'Invalid request', 'detail': str(e)})
+                    continue
+
+                req_id = req.get('id')
+                op = req.get('op', 'scan')
+                if op == 'scan':
+                    reply = self._submit(conn, req)
+                elif op == 'cancel':
+                    job = conn['jobs'].get(req.get('target'))
+                    found = job is not None and self._abandon(
+                        job, {'error': 'Job cancelled', 'cancelled': True}, 'cancelled')
+                    if found:
+                        self.counters['cancelled'] += 1
+                    reply = {'id': req_id, 'event': 'cancel', 'target': req.get('target'), 'found': found}
+                elif op == 'ping':
+                    reply = {'id': req_id, 'event': 'pong', 'ready': True, 'pid': os.getpid(), **self.stats()}
+                elif op == 'stats':
+                    reply = {'id': req_id, 'event': 'stats', **self.stats()}
+                elif op == 'shutdown':
+                    reply = {'id': req_id, 'event': 'bye', 'served': self.counters['completed']}
+                    self._stop.set()
+                else:
+                    reply = {'id': req_id, 'error': 'Unknown op', 'op': op}
+                if reply is not None:
+                    await self._send(conn, reply)
+        finally:
+            # nobody is left to read the answers
+            conn['closed'] = True
+            for job in list(conn['jobs'].values()):
+                if self._abandon(job, None, 'client disconnected'):
+                    self.counters['cancelled'] += 1
+            if conn['tasks']:
+                await asyncio.gather(*conn['tasks'], return_exceptions=True)
+            self.connections.pop(id(conn), None)
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def run(self, address, announce):
+        """
+        Build the models on every inference thread, listen on address (see parse_listen_address),
+        call announce(event) once ready, and serve until a shutdown request or SIGTERM/SIGINT.
+        """
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stop = asyncio.Event()
+        executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ocr-worker-{i}")
+                     for i in range(self.workers)]
+        try:
+            await asyncio.gather(*(loop.run_in_executor(ex, self._preload) for ex in executors))
+        except Exception as e:
+            announce({'event': 'error', 'error': 'Failed to initialize PaddleOCR', 'detail': str(e)})
+            return 3
+
+        if address[0] == 'unix':
+            server = await asyncio.start_unix_server(self._handle, path=address[1], limit=MAX_REQUEST_BYTES)
+            listen = 'unix:' + address[1]
+        else:
+            server = await asyncio.start_server(self._handle, host=address[1], port=address[2],
+                                                limit=MAX_REQUEST_BYTES)
+            host, port = server.sockets[0].getsockname()[:2]
+            listen = f"{host}:{port}"
+        for sig in (getattr(signal, 'SIGTERM', None), signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self._stop.set)
+            except (NotImplementedError, RuntimeError, TypeError, ValueError):
+                pass  # Windows: no loop signal handlers, Ctrl+C still ends the process
+        workers = [asyncio.ensure_future(self._worker(ex)) for ex in executors]
+        announce(dict({'event': 'ready', 'pid': os.getpid(), 'listen': listen, 'workers': self.workers,
+                       'queue_size': self.queue_size, 'langs': sorted(self.preload_langs),
+                       'inference_profile': resolve_scan_options(self.default_options)['inference_profile']},
+                      **startup_report()))
+
+        await self._stop.wait()
+        server.close()
+        for conn in list(self.connections.values()):
+            for job in list(conn['jobs'].values()):
+                self._abandon(job, {'error': 'Server shutting down'}, 'shutting down')
+            try:
+                conn['writer'].close()
+            except Exception:
+                pass
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for ex in executors:
+            ex.shutdown(wait=False)
+        if address[0] == 'unix':
+            try:
+                os.unlink(address[1])
+            except OSError:
+                pass
+        log_event('job_server_stopped', **self.stats())
+        return 0
+
+
+def serve_jobs(listen, workers=None, queue_size=16, job_timeout=30.0, **kwargs):
+    """
+    --listen mode: run a JobServer on listen until shut down. The {"event": "ready", "listen": ...}
+    (or startup error) line goes to stdout, everything else to stderr.
+    """
+    out = open_protocol_stream()
+
+    def announce(event):
+        out.write(json.dumps(event) + "\n")
+        out.flush()
+
+    server = JobServer(workers=workers or 2, queue_size=queue_size, job_timeout=job_timeout, **kwargs)
+    return asyncio.run(server.run(parse_listen_address(listen), announce))
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+"""
+LTO driver's license support for paddle_scan.py: field patterns, the card template read used by the
+license profile (locate the card, flatten it and recognize only its field boxes), and field
+extraction from page lines by label position (field_extraction 'on').
+"""
+import re
+
+import numpy as np
+from PIL import Image
+
+from ocr_boxes import BoxIndex, box_rect
+
+
+# Field patterns mirrored from utils/licenseParser.js. The loose variants accept common OCR digit
+# confusions and sloppy separators; a loose match without a strict match may be a misread, see
+# is_near_miss. Their groups alternate digit runs and the separators between them.
+LICENSE_PATTERN = re.compile(r'([A-Z])\s?(\d{2})[\s-]?(\d{2})[\s-]?(\d{6})')
+DATE_PATTERN = re.compile(r'(\d{4})[/\-](\d{2})[/\-](\d{2})')
+_DIGITISH = r'[\dOILSBZG]'
+_LOOKALIKES = frozenset('OILSBZG')
+LICENSE_LOOSE_PATTERN = re.compile(r'[A-Z0-9]\s?(' + _DIGITISH + r'{2})([\s\-_.]?)(' + _DIGITISH + r'{2})([\s\-_.]?)('
+                                   + _DIGITISH + r'{4,7})')
+DATE_LOOSE_PATTERN = re.compile('(' + _DIGITISH + r'{4})([\s/\-_.]?)(' + _DIGITISH + r'{1,2})([\s/\-_.]?)('
+                                + _DIGITISH + r'{1,2})')
+
+
+def is_near_miss(match):
+    """
+    Whether a LICENSE_LOOSE_PATTERN / DATE_LOOSE_PATTERN match looks like a misread field rather
+    than any number: it needs a look-alike letter where a digit belongs, or separators at both of
+    the field's separator positions. Bare digit runs (phone numbers, receipt numbers) don't count,
+    nor do words spelled with look-alikes only ('BOILS'), which need at least two real digits.
+    """
+    digits = match.group(1) + match.group(3) + match.group(5)
+    if sum(ch.isdigit() for ch in digits) < 2:
+        return False
+    return any(ch in _LOOKALIKES for ch in digits) or bool(match.group(2) and match.group(4))
+
+
+# LTO driver's license (ID-1 card, 85.6 x 54 mm). Field boxes are fractions of the normalized
+# card (x0, y0, x1, y1) around the value line only, labels are left out so each box is one line
+# the recognizer can read without detection.
+CARD_ASPECT = 85.6 / 54.0
+CARD_WIDTH = 1600
+LICENSE_TEMPLATE = {
+    'name': (0.28, 0.29, 0.97, 0.37),
+    'nationality': (0.28, 0.42, 0.42, 0.49),
+    'sex': (0.43, 0.42, 0.50, 0.49),
+    'birthdate': (0.51, 0.42, 0.68, 0.49),
+    'address': (0.28, 0.52, 0.97, 0.60),
+    'license_number': (0.28, 0.64, 0.50, 0.71),
+    'expiry': (0.51, 0.64, 0.68, 0.71),
+    'agency_code': (0.69, 0.64, 0.85, 0.71),
+    'blood_type': (0.28, 0.75, 0.38, 0.82),
+    'restrictions': (0.56, 0.75, 0.80, 0.82),
+    'conditions': (0.81, 0.75, 0.97, 0.82),
+}
+# fields that must validate before the template read is trusted over the page pipeline
+LICENSE_REQUIRED_FIELDS = ('license_number',)
+LICENSE_DATE_FIELDS = ('birthdate', 'expiry')
+# fields with a checkable format; free text (name, address...) only counts once the card validated
+LICENSE_CHECKED_FIELDS = ('license_number', 'birthdate', 'expiry', 'sex', 'blood_type')
+SEX_PATTERN = re.compile(r'^(M|F)(ALE|EMALE)?\b')
+BLOOD_TYPE_PATTERN = re.compile(r'^(AB|A|B|O)\s?([+\-−]?)')
+
+
+def normalize_license_field(name, text):
+    """
+    Canonical value of a template field, or None if text doesn't look like that field.
+    Values follow utils/licenseParser.js (L02-12-123456, YYYY/MM/DD, M/F, A+).
+    """
+    text = (text or '').strip()
+    if not text:
+        return None
+    upper = text.upper()
+    if name == 'license_number':
+        m = LICENSE_PATTERN.search(upper)
+        return f"{m.group(1)}{m.group(2)}-{m.group(3)}-{m.group(4)}" if m else None
+    if name in LICENSE_DATE_FIELDS:
+        m = DATE_PATTERN.search(upper)
+        return f"{m.group(1)}/{m.group(2)}/{m.group(3)}" if m else None
+    if name == 'sex':
+        m = SEX_PATTERN.match(upper)
+        return m.group(1) if m else None
+    if name == 'blood_type':
+        m = BLOOD_TYPE_PATTERN.match(upper)
+        return (m.group(1) + m.group(2).replace('−', '-')) if m else None
+    if name == 'name':
+        return text if sum(ch.isalpha() for ch in text) >= 3 else None
+    return text
+
+
+def order_corners(points):
+    """
+    Four (x, y) points as float32 [tl, tr, br, bl], long edge on top so the card comes out landscape.
+    """
+    pts = np.asarray(points, dtype='float32').reshape(4, 2)
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    quad = np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype='float32')
+    if np.linalg.norm(quad[1] - quad[0]) < np.linalg.norm(quad[3] - quad[0]):
+        # portrait in the photo: start from bottom-left so the long edge becomes the top
+        quad = np.roll(quad, 1, axis=0)
+    return quad
+
+
+def locate_card(img, aspect=CARD_ASPECT, work_px=800, min_area=0.1, tolerance=0.2):
+    """
+    Find the largest card-shaped quadrilateral in img (edges + contour approximation on a
+    work_px downscale). Returns its corners as float32 [tl, tr, br, bl] in img pixels, or None if
+    OpenCV is missing or no contour covering min_area of the photo has the card's aspect ratio.
+    """
+    try:
+        import cv2
+    except Exception:
+        return None
+    w, h = img.size
+    scale = min(1.0, work_px / float(max(w, h)))
+    small = np.asarray(img.convert('L').resize((max(1, int(w * scale)), max(1, int(h * scale)))))
+    edges = cv2.Canny(cv2.GaussianBlur(small, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=2)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    area_min = min_area * small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < area_min:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) != 4:
+            continue
+        quad = order_corners(approx.reshape(4, 2) / scale)
+        width = np.linalg.norm(quad[1] - quad[0])
+        height = np.linalg.norm(quad[3] - quad[0])
+        if height > 0 and abs(width / height - aspect) / aspect <= tolerance:
+            return quad
+    return None
+
+
+def normalize_card(img, quad, width=CARD_WIDTH, aspect=CARD_ASPECT):
+    """
+    Perspective-warp the card at quad to a width x width/aspect RGB image.
+    Returns (card PIL image, 3x3 matrix mapping original pixels onto the card).
+    """
+    import cv2
+    height = int(round(width / aspect))
+    dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype='float32')
+    matrix = cv2.getPerspectiveTransform(np.asarray(quad, dtype='float32'), dst)
+    warped = cv2.warpPerspective(np.asarray(img.convert('RGB')), matrix, (width, height), flags=cv2.INTER_CUBIC)
+    return Image.fromarray(warped), matrix
+
+
+def read_card_fields(recognize, card, template=LICENSE_TEMPLATE, batch_size=16):
+    """
+    Recognize every template box of a normalized card in one batched recognize(crops, batch_size)
+    call, which returns (text, score) per crop or None when no recognizer is available.
+    Returns {name: {'text', 'value', 'confidence', 'valid', 'card_box'}} (card_box in card pixels)
+    or None without a recognizer.
+    """
+    cw, ch = card.size
+    names, crops, boxes = [], [], []
+    for name, (x0, y0, x1, y1) in template.items():
+        box = (int(x0 * cw), int(y0 * ch), int(x1 * cw), int(y1 * ch))
+        names.append(name)
+        boxes.append(box)
+        crops.append(card.crop(box))
+    recognized = recognize(crops, batch_size)
+    if recognized is None:
+        return None
+    fields = {}
+    for name, box, (text, score) in zip(names, boxes, recognized):
+        text = str(text).strip() if text is not None else ''
+        value = normalize_license_field(name, text)
+        try:
+            score = float(score) if score is not None else None
+        except (TypeError, ValueError):
+            score = None
+        fields[name] = {'text': text, 'value': value, 'confidence': score, 'valid': value is not None,
+                        'card_box': box, 'source': 'card'}
+    return fields
+
+
+def license_fields_trusted(fields):
+    """
+    True when the required fields and at least one date read cleanly off the template.
+    """
+    if not fields:
+        return False
+    if not all(fields.get(name, {}).get('valid') for name in LICENSE_REQUIRED_FIELDS):
+        return False
+    return any(fields.get(name, {}).get('valid') for name in LICENSE_DATE_FIELDS)
+
+
+def card_box_to_image(box, matrix, card_size, rotated=False):
+    """
+    Map an axis-aligned card box back onto the original photo as a 4-point polygon.
+    """
+    x0, y0, x1, y1 = box
+    pts = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+    if rotated:
+        cw, ch = card_size
+        pts = [(cw - 1 - x, ch - 1 - y) for x, y in pts]
+    inverse = np.linalg.inv(matrix)
+    poly = []
+    for x, y in pts:
+        px, py, pw = inverse @ np.array([x, y, 1.0])
+        poly.append([round(float(px / pw), 1), round(float(py / pw), 1)])
+    return poly
+
+
+def scan_license_card(recognize, orig_img, options, timer, warnings):
+    """
+    License profile: locate and normalize the card, then read only the LICENSE_TEMPLATE boxes with
+    recognize (see read_card_fields).
+    A card that doesn't validate is retried upside down. Returns (payload, fields, reason):
+    payload is None when the page pipeline should run instead (reason says why), fields is the
+    best template read so far (may be None) so the caller can still report its valid fields.
+    """
+    quad = locate_card(orig_img)
+    timer.lap('card_locate')
+    if quad is None:
+        return None, None, 'card_not_found'
+
+    card, matrix = normalize_card(orig_img, quad)
+    best, rotated = None, False
+    for flip in (False, True):
+        view = card.rotate(180) if flip else card
+        try:
+            fields = read_card_fields(recognize, view, batch_size=int(options['crop_batch_size']))
+        except Exception as ex:
+            warnings.append(f"card field recognition failed: {ex}")
+            fields = None
+        if fields is None:
+            timer.lap('card_fields')
+            return None, None, 'recognizer_unavailable'
+        valid = sum(1 for f in fields.values() if f['valid'])
+        if best is None or valid > sum(1 for f in best.values() if f['valid']):
+            best, rotated = fields, flip
+        if license_fields_trusted(fields):
+            break
+    timer.lap('card_fields')
+
+    for field in best.values():
+        field['box'] = card_box_to_image(field.pop('card_box'), matrix, card.size, rotated=rotated)
+    if not license_fields_trusted(best):
+        return None, best, 'fields_not_validated'
+
+    lines = [{'text': f['text'], 'confidence': f['confidence'], 'box': f['box'], 'field': name}
+             for name, f in best.items() if f['text']]
+    stages = {
+        'profile': 'license',
+        'card_rotated': rotated,
+        'crops_selected': len(best),
+        'fields_valid': sum(1 for f in best.values() if f['valid']),
+    }
+    return {'lines': lines, 'fields': best, 'stages': stages}, best, None
+
+
+# Page-line field extraction (field_extraction 'on'), used when the card template can't be read:
+# labels are found with one combined pattern, then each label's value is looked for after it on
+# the same line, in the nearest box to its right and in the box below it, in that order of trust.
+# Weight and height only serve as column boundaries on the card's header row.
+LICENSE_LABELS = {
+    'license_number': r"(?:driver'?s\s+)?lic(?:ense)?\.?\s*(?:no|number|#)\.?",
+    'name': r'(?:last\s+name\W+first\s+name(?:\W+middle\s+name)?|name)',
+    'nationality': r'nationality',
+    'sex': r'(?:sex|gender)',
+    'birthdate': r'(?:date\s+of\s+birth|birth\s*date|dob)',
+    'weight': r'weight(?:\s*\(kg\))?',
+    'height': r'height(?:\s*\(m\))?',
+    'address': r'address',
+    'expiry': r'(?:expiration\s+date|expiry\s+date|expiration|expiry|exp\.?\s*date|valid\s+until)',
+    'agency_code': r'agency\s+code',
+    'blood_type': r'blood\s*type',
+    'restrictions': r'(?:restrictions|dl\s+codes)',
+    'conditions': r'conditions',
+}
+LICENSE_LABEL_PATTERN = re.compile('|'.join(rf'(?P<{name}>\b{pattern}(?!\w))' for name, pattern in LICENSE_LABELS.items()),
+                                   re.IGNORECASE)
+WORD_PATTERN = re.compile(r'\S+')
+LABEL_SEPARATORS = ' :;.,-_|'
+# candidate weights by where the value sits relative to its label; a value found by its format
+# alone (no label) only counts for the license number, and a comma-separated all-caps line for the name
+FIELD_ANCHORS = {'label': 1.0, 'right': 0.95, 'below': 0.9, 'pattern': 0.7, 'name_shape': 0.6}
+FIELD_MIN_SCORE = 0.3
+
+
+def split_words(text):
+    """
+    Whitespace-separated words of text as [(start, end)] character spans.
+    """
+    return [m.span() for m in WORD_PATTERN.finditer(text)]
+
+
+def value_text(line, word_ids):
+    """
+    Text of the given words of a prepared line, without the separators that follow a label.
+    """
+    a, b = line['words'][word_ids[0]][0], line['words'][word_ids[-1]][1]
+    return line['text'][a:b].lstrip(LABEL_SEPARATORS).rstrip(' :;,|')
+
+
+def word_rect(rect, text, first, last, words):
+    """
+    Estimated rect of words[first:last + 1] inside a line box, assuming evenly spaced characters.
+    """
+    x0, y0, x1, y1 = rect
+    per_char = (x1 - x0) / float(max(len(text), 1))
+    return (x0 + per_char * words[first][0], y0, x0 + per_char * words[last][1], y1)
+
+
+def index_license_labels(lines):
+    """
+    One pass over the page: every label occurrence as a dict with field, line, its first/last
+    word index, the estimated label rect, and the words after it on the same line (up to the
+    next label). Lines without a box are skipped.
+    """
+    labels = []
+    for li, line in enumerate(lines):
+        if line['rect'] is None:
+            continue
+        text, words = line['text'], line['words']
+        matches = list(LICENSE_LABEL_PATTERN.finditer(text))
+        for mi, m in enumerate(matches):
+            first = next((wi for wi, (a, b) in enumerate(words) if b > m.start()), None)
+            last = max((wi for wi, (a, b) in enumerate(words) if a < m.end()), default=None)
+            if first is None or last is None:
+                continue
+            stop = matches[mi + 1].start() if mi + 1 < len(matches) else len(text)
+            rest = [wi for wi, (a, b) in enumerate(words) if a >= m.end() and b <= stop
+                    and text[a:b].strip(LABEL_SEPARATORS)]
+            labels.append({'field': m.lastgroup, 'line': li, 'first': first, 'last': last, 'rest': rest,
+                           'rect': word_rect(line['rect'], text, first, last, words)})
+    # a label's column ends where the next label on the same row starts
+    for label in labels:
+        x0, y0, x1, y1 = label['rect']
+        cy = (y0 + y1) / 2.0
+        row = sorted((o['rect'][0], k) for k, o in enumerate(labels) if o['rect'][1] <= cy <= o['rect'][3])
+        label['row'] = [k for _, k in row]
+        label['column_end'] = min((x for x, _ in row if x >= x1 - 1), default=float('inf'))
+    return labels
+
+
+def column_words(line, x0, x1):
+    """
+    Indices of the words of a line whose estimated centre falls between x0 and x1.
+    """
+    rect, text, words = line['rect'], line['text'], line['words']
+    per_char = (rect[2] - rect[0]) / float(max(len(text), 1))
+    return [wi for wi, (a, b) in enumerate(words) if x0 <= rect[0] + per_char * (a + b) / 2.0 < x1]
+
+
+def license_field_candidates(lines, labels, index, label_lines):
+    """
+    Scored (score, field, line, word indices, anchor) candidates for every label, plus the
+    label-free ones. A candidate is only kept when its text normalizes as that field.
+    """
+    candidates = []
+
+    def consider(field, li, word_ids, anchor):
+        if not word_ids or field not in LICENSE_TEMPLATE:
+            return
+        line = lines[li]
+        text = value_text(line, word_ids)
+        value = normalize_license_field(field, text)
+        if value is None:
+            return
+        conf = line['confidence'] if line['confidence'] is not None else 0.8
+        candidates.append((FIELD_ANCHORS[anchor] * conf, field, li, tuple(word_ids), anchor))
+
+    for k, label in enumerate(labels):
+        field, li = label['field'], label['line']
+        x0, y0, x1, y1 = label['rect']
+        h = max(y1 - y0, 1.0)
+        consider(field, li, label['rest'], 'label')
+
+        # nearest box to the right on the same row, unless it starts with a label of its own
+        reach = (x1, y0 - 0.5 * h, min(x1 + 12 * h, label['column_end'] + h), y1 + 0.5 * h)
+        right = sorted((lines[j]['rect'][0], j) for j in index.overlapping(reach)
+                       if j != li and lines[j]['rect'][0] >= x1 - 0.5 * h)
+        if right and right[0][1] not in label_lines:
+            j = right[0][1]
+            consider(field, j, column_words(lines[j], x1 - 0.5 * h, label['column_end']), 'right')
+
+        # the first row below within a few line heights, cut to the label's column
+        col_x0, col_x1 = x0 - h, label['column_end']
+        below = (col_x0, y1, min(col_x1, x1 + 30 * h), y1 + 3 * h)
+        rows = sorted((lines[j]['rect'][1], j) for j in index.overlapping(below)
+                      if j != li and lines[j]['rect'][1] >= y0 + 0.5 * h)
+        for top, j in rows:
+            if top > rows[0][0] + 0.5 * h:
+                break
+            values = [wi for wi in range(len(lines[j]['words']))
+                      if not any(o['line'] == j and o['first'] <= wi <= o['last'] for o in labels)]
+            if len(label['row']) > 1 and len(values) == len(label['row']) and j not in label_lines:
+                # one value per header label: the box was read as one line, align by position
+                words = [values[label['row'].index(k)]]
+            else:
+                words = [wi for wi in column_words(lines[j], col_x0, col_x1) if wi in values]
+            consider(field, j, words, 'below')
+
+    for li, line in enumerate(lines):
+        if line['rect'] is None or li in label_lines:
+            continue
+        text = line['text']
+        if LICENSE_PATTERN.search(text.upper()):
+            consider('license_number', li, list(range(len(line['words']))), 'pattern')
+        # mirrors licenseParser.js: LTO names are printed SURNAME, GIVEN NAMES
+        if ',' in text and text == text.upper() and not any(ch.isdigit() for ch in text):
+            consider('name', li, list(range(len(line['words']))), 'name_shape')
+    return candidates
+
+
+def extract_license_fields(lines, min_score=FIELD_MIN_SCORE):
+    """
+    License fields from boxed page lines ({'text', 'confidence', 'box'}) by label geometry.
+    Candidates are taken best score first, each word is used by at most one field.
+    Returns {name: {'text', 'value', 'confidence', 'valid', 'box', 'source', 'anchor'}} where
+    confidence is the line's recognition score weighted by how the value was anchored.
+    """
+    prepared = []
+    for item in lines:
+        text = str(item.get('text') or '')
+        conf = item.get('confidence')
+        prepared.append({'text': text, 'words': split_words(text), 'rect': box_rect(item.get('box')),
+                         'confidence': float(conf) if isinstance(conf, (int, float)) else None})
+    boxed = [line['rect'] for line in prepared if line['rect'] is not None]
+    if not boxed:
+        return {}
+    heights = sorted(r[3] - r[1] for r in boxed)
+    index = BoxIndex(cell=4.0 * max(heights[len(heights) // 2], 1.0))
+    for line in prepared:
+        # keep index positions equal to line positions; boxless lines get an empty rect nothing overlaps
+        index.add(line['rect'] or (0.0, 0.0, 0.0, 0.0))
+
+    labels = index_license_labels(prepared)
+    label_lines = {label['line'] for label in labels}
+    candidates = license_field_candidates(prepared, labels, index, label_lines)
+
+    fields, used = {}, set()
+    for score, field, li, word_ids, anchor in sorted(candidates, key=lambda c: -c[0]):
+        if score < min_score:
+            break
+        if field in fields or any((li, wi) in used for wi in word_ids):
+            continue
+        used.update((li, wi) for wi in word_ids)
+        line = prepared[li]
+        text = value_text(line, word_ids)
+        x0, y0, x1, y1 = word_rect(line['rect'], line['text'], word_ids[0], word_ids[-1], line['words'])
+        fields[field] = {
+            'text': text,
+            'value': normalize_license_field(field, text),
+            'confidence': round(score, 4),
+            'valid': True,
+            'box': [[round(x0, 1), round(y0, 1)], [round(x1, 1), round(y0, 1)],
+                    [round(x1, 1), round(y1, 1)], [round(x0, 1), round(y1, 1)]],
+            'source': 'page',
+            'anchor': anchor,
+            'line': li,
+        }
+
+    # addresses often wrap: take the unlabeled, unused line right under the first one
+    address = fields.get('address')
+    if address is not None:
+        x0, y0, x1, y1 = box_rect(address['box'])
+        h = max(y1 - y0, 1.0)
+        below = sorted((prepared[j]['rect'][1], j) for j in index.overlapping((x0, y1, x1, y1 + 1.5 * h))
+                       if j != address['line'] and j not in label_lines and prepared[j]['rect'][1] >= y1 - 0.3 * h
+                       and not any((j, wi) in used for wi in range(len(prepared[j]['words']))))
+        if below:
+            line = prepared[below[0][1]]
+            address['text'] = address['value'] = f"{address['text']} {line['text'].strip()}"
+            rect = line['rect']
+            address['box'] = [[min(x0, rect[0]), y0], [max(x1, rect[2]), y0],
+                              [max(x1, rect[2]), rect[3]], [min(x0, rect[0]), rect[3]]]
+    for field in fields.values():
+        field.pop('line')
+    return fields
@@ -1,45 +1,59 @@
 #!/usr/bin/env python
 import sys, os, json
-# Debug: print runtime python and environment for diagnosing import issues
-sys.stderr.write(json.dumps({
-    'debug_python': sys.executable,
-    'debug_sys_path': sys.path[:5],            # truncated
-    'debug_virtual_env': os.environ.get('VIRTUAL_ENV'),
-    'debug_path_env_contains_venv': '.venv' in os.environ.get('PATH', '')
-}) + "\n")
+import time
 
+# Cold-start clock: startup_ms in ready events and metrics records counts from here
+_STARTED = time.perf_counter()
+
+if os.environ.get('OCR_DEBUG_ENV'):
+    # Debug: print runtime python and environment for diagnosing import issues
+    sys.stderr.write(json.dumps({
+        'debug_python': sys.executable,
+        'debug_sys_path': sys.path[:5],            # truncated
+        'debug_virtual_env': os.environ.get('VIRTUAL_ENV'),
+        'debug_path_env_contains_venv': '.venv' in os.environ.get('PATH', '')
+    }) + "\n")
+
+import base64
+import copy
+import hashlib
+import io
+import math
+import subprocess
 import tempfile
+import threading
+from collections import OrderedDict
 
 # This script requires paddleocr, paddlepaddle and Pillow installed in the same python environment.
 # Usage: python paddle_scan.py /path/to/image.jpg [--lang <lang>] [--no-cls]
+#        python paddle_scan.py - [--lang <lang>] < image.jpg              (image bytes on stdin)
+#        python paddle_scan.py license.jpg --profile license              (card fields keyed by name)
+#        python paddle_scan.py --server [--lang <lang>] [--preload en,fil]   (warm worker, NDJSON on stdin/stdout)
+#        python paddle_scan.py --listen unix:/tmp/ocr.sock [--workers 2] [--queue-size 16]   (shared job server)
+#        python paddle_scan.py --batch tmp_uploads [--batch list.txt] [--workers 4]   (NDJSON per image)
 # Install deps in your server venv:
 # pip install paddleocr paddlepaddle pillow
 
-try:
-    from paddleocr import PaddleOCR
-except Exception as e:
-    print(json.dumps({'error': 'Missing dependency paddleocr or paddlepaddle', 'detail': str(e)}))
-    sys.exit(2)
-
-try:
-    import paddle
-except Exception as e:
-    print(json.dumps({
-        'error': 'Missing dependency paddle',
-        'detail': str(e),
-        'hint': 'Activate the server venv and install paddlepaddle and paddleocr: pip install paddlepaddle -f https://www.paddlepaddle.org.cn/whl/windows/mkl/avx/stable.html && pip install paddleocr'
-    }))
-    sys.exit(2)
+# Exit status when a required package is missing. argparse already uses 2 for bad arguments, and the
+# controllers only try another python interpreter on this one.
+EXIT_MISSING_DEPENDENCY = 4
 
+# paddleocr/paddle take seconds to import, so they are loaded on first model build (load_paddleocr)
 try:
+    import numpy as np
     from PIL import Image, ImageEnhance, ImageOps
 except Exception as e:
     print(json.dumps({
-        'error': 'Missing dependency Pillow',
+        'error': 'Missing dependency Pillow or numpy',
         'detail': str(e),
-        'hint': 'Install Pillow in the server venv: pip install pillow'
+        'hint': 'Install Pillow in the server venv: pip install pillow (numpy ships with paddlepaddle)'
     }))
-    sys.exit(2)
+    sys.exit(EXIT_MISSING_DEPENDENCY)
+
+from ocr_boxes import BoxIndex, box_points, box_rect, line_confidence, merge_lines
+from ocr_license import (DATE_LOOSE_PATTERN, DATE_PATTERN, LICENSE_CHECKED_FIELDS, LICENSE_LABELS,
+                         LICENSE_LOOSE_PATTERN, LICENSE_PATTERN, LICENSE_TEMPLATE, extract_license_fields,
+                         is_near_miss, scan_license_card)
 
 
 def make_serializable(obj):
@@ -48,6 +62,9 @@ def make_serializable(obj):
             return obj
         if hasattr(obj, 'tolist'):
             try:
+                # numeric arrays already come back as plain nested lists of python scalars
+                if getattr(getattr(obj, 'dtype', None), 'kind', None) in ('i', 'u', 'f', 'b'):
+                    return obj.tolist()
                 return make_serializable(obj.tolist())
             except Exception:
                 return str(obj)
@@ -79,6 +96,21 @@ def extract_texts(obj, out):
                     'box': make_serializable(box)
                 })
             return
+        # PaddleOCR 3.x OCRResult: parallel rec_texts / rec_scores / rec_polys arrays
+        if 'rec_texts' in obj:
+            texts = obj.get('rec_texts') or []
+            scores = obj.get('rec_scores')
+            polys = obj.get('rec_polys')
+            for i, text in enumerate(texts):
+                if text and str(text).strip():
+                    conf = scores[i] if scores is not None and i < len(scores) else None
+                    box = polys[i] if polys is not None and i < len(polys) else None
+                    out.append({
+                        'text': make_serializable(text),
+                        'confidence': make_serializable(conf),
+                        'box': make_serializable(box)
+                    })
+            return
         # Also check for arrays of texts/boxes
         if 'texts' in obj and 'boxes' in obj:
             texts = obj.get('texts', [])
@@ -130,13 +162,49 @@ def extract_texts(obj, out):
             extract_texts(item, out)
 
 
-def preprocess_image(in_path, max_width=1600, contrast=1.2, enhance_sharpness=1.0, to_grayscale=False):
+def open_image(source):
+    """
+    Open a path or raw bytes lazily: only the header is read until the pixels are needed.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(bytes(source)))
+    return Image.open(source)
+
+
+def load_image(source, scale=1.0):
+    """
+    Decode an upload once into an RGB PIL image. source may be a path, raw bytes or a PIL image.
+    scale < 1 decodes a downscaled copy: JPEGs are decoded at that size directly (draft mode, so
+    the full-size pixels never exist in memory), other formats are reduced right after decoding.
+    """
+    if isinstance(source, Image.Image):
+        return source.convert('RGB') if source.mode != 'RGB' else source
+    img = open_image(source)
+    if scale < 1.0:
+        w, h = img.size
+        target = (max(1, int(math.ceil(w * scale))), max(1, int(math.ceil(h * scale))))
+        img.draft('RGB', target)
+        if img.size[0] > target[0]:
+            img = img.reduce(max(1, int(round(img.size[0] / float(target[0])))))
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    img.load()  # decode now so a corrupt upload fails here, not halfway through the pipeline
+    return img
+
+
+def to_ocr_array(img):
+    """
+    PIL RGB image -> contiguous BGR uint8 array, the layout PaddleOCR expects for ndarray input.
+    """
+    return np.ascontiguousarray(np.asarray(img.convert('RGB'))[:, :, ::-1])
+
+
+def enhance_image(img, max_width=1600, contrast=1.2, enhance_sharpness=1.0, to_grayscale=False):
     """
-    Preprocess the image: resize (if large), enhance contrast/sharpness, optional grayscale.
-    Returns path to temp preprocessed image.
-    Enhanced to preserve more detail for better OCR.
+    Preprocess the image in memory: resize (if large), enhance contrast/sharpness, optional grayscale.
+    Returns a new RGB PIL image.
     """
-    img = Image.open(in_path).convert('RGB')
+    img = load_image(img)
     w, h = img.size
     
     # Only resize if significantly larger than max_width to preserve detail
@@ -157,13 +225,8 @@ def preprocess_image(in_path, max_width=1600, contrast=1.2, enhance_sharpness=1.
     # Enhance sharpness to make text edges clearer
     if enhance_sharpness != 1.0:
         img = ImageEnhance.Sharpness(img).enhance(enhance_sharpness)
-    
-    # Save with high quality to preserve detail
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-    tmp_path = tmp.name
-    tmp.close()
-    img.save(tmp_path, quality=98, optimize=False)  # Higher quality, no optimization for speed
-    return tmp_path
+
+    return img
 
 
 # NEW: normalize/flatten detections returned by different PaddleOCR versions
@@ -191,6 +254,15 @@ def flatten_detections(result):
             for item in obj:
                 collect(item)
         elif isinstance(obj, dict):
+            # PaddleOCR 3.x OCRResult: one detection per rec_polys entry
+            if 'rec_texts' in obj and 'rec_polys' in obj:
+                texts = obj.get('rec_texts') or []
+                scores = obj.get('rec_scores')
+                for i, poly in enumerate(obj.get('rec_polys') or []):
+                    text = texts[i] if i < len(texts) else None
+                    score = scores[i] if scores is not None and i < len(scores) else None
+                    detections.append([poly, {'text': text, 'score': score}])
+                return
             # dict that has bbox/text keys
             bbox_keys = ('bbox', 'box', 'box_points', 'loc', 'points')
             text_keys = ('text', 'rec_text', 'transcription', 'predict', 'predict_text')
@@ -217,16 +289,15 @@ def flatten_detections(result):
     return detections
 
 
-def crop_and_rerun_ocr(ocr, original_image_path, detections, crop_padding=6, upscale=2.0):
+def crop_rects(image_size, detections, crop_padding=6, box_scale=1.0):
     """
-    Given PaddleOCR detections (list of [bbox, rec]) crop each bbox from original image,
-    upscale it and run OCR again on the crop to improve recognition accuracy.
-    Returns list of {text,confidence,box}.
+    Padded crop rectangle of every detection bbox on an image of image_size (w, h).
+    box_scale maps detection coordinates onto that image (its width / detection image width).
+    Returns list of (bbox, (x0, y0, x1, y1)) in detection order; unusable boxes are skipped.
+    Cutting the crops is left to cut_crop, so callers can do it a batch at a time.
     """
-    results = []
-    orig_img = Image.open(original_image_path).convert('RGB')
-    ow, oh = orig_img.size
-
+    rects = []
+    ow, oh = image_size
     for det in detections:
         try:
             if not isinstance(det, (list, tuple)) or len(det) < 1:
@@ -236,7 +307,7 @@ def crop_and_rerun_ocr(ocr, original_image_path, detections, crop_padding=6, ups
             pts = []
             for p in bbox:
                 try:
-                    x, y = float(p[0]), float(p[1])
+                    x, y = float(p[0]) * box_scale, float(p[1]) * box_scale
                 except Exception:
                     # fallback if structured differently
                     continue
@@ -249,257 +320,2368 @@ def crop_and_rerun_ocr(ocr, original_image_path, detections, crop_padding=6, ups
             miny, maxy = max(min(ys) - crop_padding, 0), min(max(ys) + crop_padding, oh)
             if minx >= maxx or miny >= maxy:
                 continue
-            crop = orig_img.crop((minx, miny, maxx, maxy))
-            # upscale for better recognition
-            cw, ch = crop.size
-            if cw > 0 and ch > 0:  # Ensure valid dimensions
-                crop = crop.resize((int(cw * upscale), int(ch * upscale)), Image.LANCZOS)
-            # save to temp and run OCR on crop
-            tmpc = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-            tmpc_path = tmpc.name
-            tmpc.close()
-            crop.save(tmpc_path, quality=98, optimize=False)  # Higher quality
-            try:
-                rec = None
-                # prefer predict where available
-                try:
-                    rec = ocr.predict(tmpc_path)
-                except Exception:
-                    rec = ocr.ocr(tmpc_path)
-                # try to extract text from rec (it may be nested)
-                extracted = []
-                extract_texts(rec, extracted)
-                if extracted:
-                    # take first extracted item from crop
-                    r = extracted[0]
-                    # ensure box refers to original bbox
-                    r['box'] = make_serializable(bbox)
-                    results.append(r)
-                else:
-                    # fallback: record raw rec
-                    results.append({'text': None, 'confidence': None, 'box': make_serializable(bbox), 'raw': make_serializable(rec)})
-            finally:
-                try:
-                    os.unlink(tmpc_path)
-                except Exception:
-                    pass
+            rects.append((bbox, (minx, miny, maxx, maxy)))
         except Exception:
             continue
+    return rects
+
+
+def cut_crop(orig_img, rect, upscale=2.0):
+    """
+    Cut rect out of orig_img and upscale it for recognition.
+    """
+    crop = orig_img.crop(rect)
+    cw, ch = crop.size
+    if cw > 0 and ch > 0 and upscale != 1.0:
+        crop = crop.resize((int(cw * upscale), int(ch * upscale)), Image.LANCZOS)
+    return crop
 
+
+def get_text_recognizer(ocr):
+    """
+    Return fn(list_of_bgr_arrays, batch_size) -> [(text, score), ...] backed by the recognition
+    model already loaded inside ocr, or None if it doesn't expose one. Only PaddleOCR 3.x is
+    supported (create_ocr passes 3.x arguments); callers fall back to full OCR per crop on None.
+    """
+    # the paddlex OCR pipeline owns a standalone text recognition predictor
+    pipeline = getattr(ocr, 'paddlex_pipeline', None)
+    rec_model = None
+    if pipeline is not None:
+        try:
+            rec_model = pipeline.text_rec_model
+        except Exception:
+            rec_model = None
+    if rec_model is None:
+        return None
+
+    def recognize(arrays, batch_size):
+        # paddlex keeps a batch_size passed to a call as the predictor's own: put the profile's
+        # rec_batch_size back so later page reads don't run at the crop batch size
+        sampler = getattr(rec_model, 'batch_sampler', None)
+        previous = getattr(sampler, 'batch_size', None)
+        try:
+            return [(res.get('rec_text'), res.get('rec_score')) for res in rec_model(arrays, batch_size=batch_size)]
+        finally:
+            if previous is not None and sampler.batch_size != previous:
+                sampler.batch_size = previous
+    return recognize
+
+
+def recognize_crops(ocr, crops, batch_size=16, should_stop=None, sizes=None, on_batch=None):
+    """
+    Recognition-only pass over PIL crops, in batches, without re-running detection.
+    Crops are sorted by aspect ratio so each batch pads to a similar width, then mapped back.
+    crops may also be a function i -> PIL crop, with sizes listing each crop's (w, h): crops are
+    then only cut when their batch is due, so one batch of upscaled crops is in memory at a time.
+    should_stop() is checked between batches; crops left unread come back as (None, None).
+    on_batch([(i, (text, score)), ...]) is called as each batch comes back.
+    Returns list of (text, score) aligned with crops, or None if no recognizer is available.
+    """
+    recognize = get_text_recognizer(ocr)
+    if recognize is None:
+        return None
+    if sizes is None:
+        sizes = [c.size for c in crops]
+        crops = crops.__getitem__
+    if not sizes:
+        return []
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i][0] / float(max(sizes[i][1], 1)))
+    batch_size = max(1, int(batch_size))
+    recognized = []
+    for start in range(0, len(order), batch_size):
+        if should_stop is not None and should_stop():
+            recognized.extend([(None, None)] * (len(order) - start))
+            break
+        # PaddleOCR consumes OpenCV-style BGR arrays
+        batch = order[start:start + batch_size]
+        arrays = [to_ocr_array(crops(i)) for i in batch]
+        batch_results = list(recognize(arrays, batch_size))
+        del arrays
+        recognized.extend(batch_results)
+        if on_batch is not None and len(batch_results) == len(batch):
+            on_batch(list(zip(batch, batch_results)))
+    if len(recognized) != len(order):
+        return None
+    results = [None] * len(sizes)
+    for pos, idx in enumerate(order):
+        results[idx] = recognized[pos]
     return results
 
 
-def run_tesseract_fullpage(image_path):
+def detection_text_conf(det):
     """
-    Optional fallback using pytesseract to read the whole page as plain text.
-    Returns (list_of_items, error_str). list_of_items is [{'text':..., 'confidence':None, 'box':None}, ...]
+    First-pass (text, confidence) of a flatten_detections item; either may be None.
     """
+    rec = det[1] if isinstance(det, (list, tuple)) and len(det) > 1 else None
+    text, conf = None, None
+    if isinstance(rec, dict):
+        text = rec.get('text') or rec.get('rec_text') or rec.get('transcription')
+        conf = rec.get('score') if rec.get('score') is not None else rec.get('confidence')
+    elif isinstance(rec, (list, tuple)) and rec and isinstance(rec[0], str):
+        text = rec[0]
+        conf = rec[1] if len(rec) > 1 else None
+    elif isinstance(rec, str):
+        text = rec
     try:
-        import pytesseract
-        import shutil
-        from PIL import ImageFilter
-    except Exception as e:
-        return None, f"pytesseract or PIL.ImageFilter not available: {e}"
-    # Prefer system PATH first
-    tpath = shutil.which('tesseract')
-    if not tpath:
-        # Try common Windows install locations as a fallback
-        candidates = [
-            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
-            r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
-        ]
-        found = None
-        for c in candidates:
-            try:
-                if os.path.exists(c):
-                    found = c
-                    break
-            except Exception:
-                continue
-        if found:
-            pytesseract.pytesseract.tesseract_cmd = found
+        conf = float(conf) if conf is not None else None
+    except (TypeError, ValueError):
+        conf = None
+    return text, conf
+
+
+def rerun_reason(text, conf, min_confidence=0.85, short_text_len=3, read_px=None, min_read_px=None):
+    """
+    Why a first-pass line deserves a crop re-read, or None if it can be trusted as is.
+    read_px is the line height in the image it was recognized from; lines smaller than
+    min_read_px were read from a downscaled page and are always re-read.
+    """
+    text = (text or '').strip()
+    if not text:
+        return 'no_text'
+    if conf is None or conf < min_confidence:
+        return 'low_confidence'
+    if min_read_px is not None and read_px is not None and read_px < min_read_px:
+        return 'small_text'
+    if len(text) <= short_text_len:
+        return 'short_text'
+    # blank out exact matches first so a valid license number doesn't read as a broken date
+    residual = LICENSE_PATTERN.sub(' ', DATE_PATTERN.sub(' ', text.upper()))
+    for reason, loose in (('near_license', LICENSE_LOOSE_PATTERN), ('near_date', DATE_LOOSE_PATTERN)):
+        if any(is_near_miss(match) for match in loose.finditer(residual)):
+            return reason
+    return None
+
+
+def select_detections_for_rerun(detections, min_confidence=0.85, short_text_len=3, min_read_px=None):
+    """
+    Split detections into the ones worth re-recognizing and a per-reason count.
+    Returns (selected_detections, reasons) where reasons maps reason -> count, 'trusted' included.
+    """
+    selected = []
+    reasons = {}
+    for det in detections:
+        text, conf = detection_text_conf(det)
+        rec = det[1] if isinstance(det, (list, tuple)) and len(det) > 1 else None
+        read_px = rec.get('read_px') if isinstance(rec, dict) else None
+        if isinstance(rec, dict) and rec.get('stitched'):
+            reason = 'seam'  # joined from two tiles, only a read of the whole box is reliable
         else:
-            return None, "tesseract executable not found in PATH or known install locations"
-    try:
-        img = Image.open(image_path).convert('RGB')
-        # simple preprocessing to help Tesseract
-        gray = ImageOps.grayscale(img)
-        gray = gray.filter(ImageFilter.MedianFilter(size=3))
-        gray = ImageOps.autocontrast(gray)
-        # get full-page text (psm 1 = automatic page segmentation + OSD)
-        text = pytesseract.image_to_string(gray, lang='eng', config='--psm 1')
-        lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-        items = [{'text': make_serializable(ln), 'confidence': None, 'box': None} for ln in lines]
-        return items, None
-    except Exception as e:
-        return None, str(e)
+            reason = rerun_reason(text, conf, min_confidence=min_confidence, short_text_len=short_text_len,
+                                  read_px=read_px, min_read_px=min_read_px)
+        reasons[reason or 'trusted'] = reasons.get(reason or 'trusted', 0) + 1
+        if reason is not None:
+            selected.append(det)
+    return selected, reasons
 
 
-def main():
-    if len(sys.argv) < 2:
-        print(json.dumps({'error': 'No image path provided'}))
-        sys.exit(1)
+def crop_line(bbox, text, score):
+    """
+    Result entry of one crop re-read; text and confidence are None when nothing was read.
+    """
+    if text and str(text).strip():
+        return {'text': make_serializable(text), 'confidence': make_serializable(score), 'box': make_serializable(bbox)}
+    return {'text': None, 'confidence': None, 'box': make_serializable(bbox)}
 
-    img_path = sys.argv[1]
-    if not os.path.exists(img_path):
-        print(json.dumps({'error': 'Image not found', 'path': img_path}))
-        sys.exit(1)
 
-    # Parse optional arguments: --lang / -l and --no-cls
-    lang = 'en'
-    use_cls = True
-    for i in range(2, len(sys.argv)):
-        a = sys.argv[i].lower()
-        if a in ('--lang', '-l') and i + 1 < len(sys.argv):
-            lang = sys.argv[i + 1]
-        if a == '--no-cls':
-            use_cls = False
-
-    # Debug chosen lang and cls usage
-    sys.stderr.write(json.dumps({'debug_chosen_lang': lang, 'debug_use_cls': use_cls}) + "\n")
-
-    # create OCR model with correct modern parameters - optimized for maximum text detection
-    # Using only validated parameters to avoid compatibility issues
-    ocr = PaddleOCR(
-        lang=lang,
-        text_det_thresh=0.2,  # Lower threshold to detect more text (was 0.3)
-        text_det_box_thresh=0.3,  # Lower box threshold to include more boxes (was 0.5)
-        text_det_unclip_ratio=2.0  # Expand detected boxes more to capture full text (was 1.8)
-    )
-
-    # preprocess full image to help detection - keep higher resolution for better text detection
-    pre_path = preprocess_image(img_path, max_width=3200, contrast=1.3, enhance_sharpness=1.1, to_grayscale=False)
+def crop_and_rerun_ocr(ocr, original_image, detections, crop_padding=6, upscale=2.0, batch_size=16, rec_only=True, box_scale=1.0,
+                       warnings=None, should_stop=None, on_results=None):
+    """
+    Given PaddleOCR detections (list of [bbox, rec]) crop each bbox from the original image
+    (path or PIL image), upscale it and run OCR again on the crop to improve recognition accuracy.
+    With rec_only, all crops go through the recognizer in batches of batch_size, each batch cut from
+    the original only when it is due so the upscaled crops never pile up in memory; otherwise
+    (or if the recognizer can't be reached) each crop runs the full det+rec pipeline.
+    Problems that forced a slower path are appended to warnings (a list) when given.
+    should_stop() is polled between batches/crops to abandon the pass early.
+    on_results(lines) receives each batch's (or crop's) entries as soon as they are read.
+    Returns list of {text,confidence,box}.
+    """
+    orig_img = load_image(original_image)
+    rects = crop_rects(orig_img.size, detections, crop_padding=crop_padding, box_scale=box_scale)
 
-    try:
-        # detection + recognition on preprocessed image
+    if rec_only:
+        sizes = [(int((r[2] - r[0]) * upscale), int((r[3] - r[1]) * upscale)) for _, r in rects]
+        on_batch = None
+        if on_results is not None:
+            on_batch = lambda batch: on_results([crop_line(rects[i][0], text, score) for i, (text, score) in batch])
+        try:
+            recognized = recognize_crops(ocr, lambda i: cut_crop(orig_img, rects[i][1], upscale), batch_size=batch_size,
+                                         should_stop=should_stop, sizes=sizes, on_batch=on_batch)
+        except Exception as ex:
+            if warnings is not None:
+                warnings.append(f"batched crop recognition failed, used full pipeline: {ex}")
+            recognized = None
+        if recognized is not None:
+            return [crop_line(bbox, text, score) for (bbox, _), (text, score) in zip(rects, recognized)]
+
+    results = []
+    for bbox, rect in rects:
+        if should_stop is not None and should_stop():
+            break
         try:
-            if use_cls:
-                raw_result = ocr.ocr(pre_path, cls=True)
+            arr = to_ocr_array(cut_crop(orig_img, rect, upscale))
+            rec = None
+            # prefer predict where available
+            try:
+                rec = ocr.predict(arr)
+            except Exception:
+                rec = ocr.ocr(arr)
+            # try to extract text from rec (it may be nested)
+            extracted = []
+            extract_texts(rec, extracted)
+            if extracted:
+                # take first extracted item from crop
+                r = extracted[0]
+                # ensure box refers to original bbox
+                r['box'] = make_serializable(bbox)
+                results.append(r)
+                if on_results is not None:
+                    on_results([r])
             else:
-                raw_result = ocr.ocr(pre_path)
+                # fallback: record raw rec
+                results.append({'text': None, 'confidence': None, 'box': make_serializable(bbox), 'raw': make_serializable(rec)})
         except Exception:
-            # fallback without cls
-            raw_result = ocr.ocr(pre_path)
-    except Exception as e:
-        # cleanup
+            continue
+
+    return results
+
+
+def find_tesseract():
+    """
+    Path of the tesseract executable: PATH first, then the usual Windows install locations. None if missing.
+    """
+    import shutil
+    tpath = shutil.which('tesseract')
+    if tpath:
+        return tpath
+    candidates = [
+        r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+        r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
+    ]
+    for c in candidates:
         try:
-            os.unlink(pre_path)
+            if os.path.exists(c):
+                return c
         except Exception:
-            pass
-        print(json.dumps({'error': 'OCR failed', 'detail': str(e)}))
-        sys.exit(3)
+            continue
+    return None
 
-    # DEBUG: Print raw result structure to stderr
-    import sys as _sys
-    _sys.stderr.write(f"\n=== DEBUG: Raw result type: {type(raw_result)} ===\n")
-    _sys.stderr.write(f"=== DEBUG: Raw result length: {len(raw_result) if isinstance(raw_result, (list, tuple)) else 'N/A'} ===\n")
-    _sys.stderr.write(f"=== DEBUG: Raw result: {str(raw_result)[:500]} ===\n\n")
 
-    # Handle None or empty results
-    if raw_result is None:
+class TesseractJob:
+    """
+    Full-page Tesseract read on a background thread. The tesseract binary runs as its own process
+    (image on stdin, text on stdout) so a job that lost a race can be killed with cancel().
+    result(timeout) waits and returns (list_of_items, error_str) like run_tesseract_fullpage.
+    """
+
+    def __init__(self, image, lang='eng', psm=1, timeout=30.0):
+        self.items = None
+        self.error = None
+        self.elapsed_ms = None
+        self._proc = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, args=(image, lang, psm, timeout), daemon=True)
+        self._thread.start()
+
+    def _run(self, image, lang, psm, timeout):
         try:
-            os.unlink(pre_path)
-        except Exception:
-            pass
-        print(json.dumps({'error': 'OCR returned no results', 'detail': 'PaddleOCR returned None'}))
-        sys.exit(3)
+            exe = find_tesseract()
+            if not exe:
+                self.error = "tesseract executable not found in PATH or known install locations"
+                return
+            from PIL import ImageFilter
+            img = load_image(image)
+            # simple preprocessing to help Tesseract
+            gray = ImageOps.grayscale(img)
+            gray = gray.filter(ImageFilter.MedianFilter(size=3))
+            gray = ImageOps.autocontrast(gray)
+            buf = io.BytesIO()
+            gray.save(buf, format='PNG')
+            del img, gray
+            with self._lock:
+                if self._cancelled:
+                    self.error = 'cancelled'
+                    return
+                # psm 1 = automatic page segmentation + OSD
+                self._proc = subprocess.Popen([exe, 'stdin', 'stdout', '-l', lang, '--psm', str(psm)],
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                out, err = self._proc.communicate(buf.getvalue(), timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+                self._proc.communicate()
+                self.error = 'tesseract timed out'
+                return
+            if self._cancelled:
+                self.error = 'cancelled'
+            elif self._proc.returncode != 0:
+                self.error = err.decode('utf-8', 'replace').strip() or f"tesseract exited with {self._proc.returncode}"
+            else:
+                text = out.decode('utf-8', 'replace')
+                lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+                self.items = [{'text': make_serializable(ln), 'confidence': None, 'box': None} for ln in lines]
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.elapsed_ms = (time.perf_counter() - self._started) * 1000.0
+            self._done.set()
 
-    # PaddleOCR standard format: list of detections where each is [bbox, (text, confidence)]
-    # For multi-page: [[page1_detections], [page2_detections], ...]
-    # For single page: [detection1, detection2, ...]
-    # Handle multi-page format by flattening
-    if isinstance(raw_result, (list, tuple)) and len(raw_result) > 0:
-        # Check if it's a list of pages (each page is a list of detections)
-        if isinstance(raw_result[0], (list, tuple)) and len(raw_result[0]) > 0:
-            # Check if first page's first element looks like a detection [bbox, text_info]
-            first_item = raw_result[0][0]
-            if isinstance(first_item, (list, tuple)) and len(first_item) >= 2:
-                # This is multi-page format, flatten it
-                flattened = []
-                for page in raw_result:
-                    if page is not None and isinstance(page, (list, tuple)):
-                        flattened.extend(page)
-                raw_result = flattened
-        # Handle case where first element is None (empty result)
-        elif raw_result[0] is None:
-            raw_result = []
+    def done(self):
+        return self._done.is_set()
 
-    # Attempt to extract lines from raw_result - this is the primary source
-    extracted = []
-    extract_texts(raw_result, extracted)
-    
-    _sys.stderr.write(f"=== DEBUG: Extracted {len(extracted)} lines from raw result ===\n")
-    
-    # Remove duplicates based on text content (keep first occurrence)
-    seen_texts = set()
-    unique_extracted = []
-    for item in extracted:
-        text = item.get('text', '').strip() if item.get('text') else ''
-        if text and text not in seen_texts:
-            seen_texts.add(text)
-            unique_extracted.append(item)
-    
-    _sys.stderr.write(f"=== DEBUG: After deduplication: {len(unique_extracted)} unique lines ===\n")
+    def result(self, timeout=None):
+        self._done.wait(timeout)
+        return self.items, self.error
 
-    # Normalize detections and perform per-box crop + re-recognition from the original (higher res) image
-    # This is optional enhancement - use extracted as primary source
-    crops_result = []
-    try:
-        detections = flatten_detections(raw_result)
-        # fallback: if flatten_detections found nothing and raw_result looks like a list of boxes, use it directly
-        if not detections and isinstance(raw_result, (list, tuple)):
-            detections = list(raw_result)
-        
-        _sys.stderr.write(f"=== DEBUG: Found {len(detections)} detections for cropping ===\n")
-        
-        if detections:
-            crops_result = crop_and_rerun_ocr(ocr, img_path, detections, crop_padding=8, upscale=2.5)
-            _sys.stderr.write(f"=== DEBUG: Crop processing returned {len(crops_result)} results ===\n")
-    except Exception as ex:
-        _sys.stderr.write(f"=== DEBUG: Crop processing failed: {str(ex)} ===\n")
-        crops_result = []
+    def cancel(self):
+        """
+        Stop the job; a running tesseract process is killed. Safe to call at any time.
+        """
+        with self._lock:
+            self._cancelled = True
+            proc = self._proc
+        if proc is not None and proc.poll() is None:
+            try:
+                proc.kill()
+            except Exception:
+                pass
 
-    # Merge results: use extracted as primary, supplement with crop results if they add new text
-    lines = unique_extracted.copy()
-    if crops_result:
-        extracted_texts = {item.get('text', '').strip() for item in lines if item.get('text')}
-        for crop_item in crops_result:
-            crop_text = crop_item.get('text', '').strip() if crop_item.get('text') else ''
-            if crop_text and crop_text not in extracted_texts:
-                lines.append(crop_item)
-                extracted_texts.add(crop_text)
-    
-    _sys.stderr.write(f"=== DEBUG: Final merged result: {len(lines)} total lines ===\n")
 
-    # If result is very small (1 line) try full-page fallback with Tesseract
-    if len(lines) <= 1:
-        _sys.stderr.write("=== DEBUG: PaddleOCR returned few lines, trying Tesseract full-page fallback ===\n")
-        t_lines, t_err = run_tesseract_fullpage(img_path)
-        if t_lines:
-            _sys.stderr.write(f"=== DEBUG: Tesseract returned {len(t_lines)} lines; replacing result ===\n")
-            lines = t_lines
-        else:
-            _sys.stderr.write(f"=== DEBUG: Tesseract fallback failed: {t_err} ===\n")
+def run_tesseract_fullpage(image):
+    """
+    Optional fallback reading the whole page (path or PIL image) with Tesseract as plain text.
+    Returns (list_of_items, error_str). list_of_items is [{'text':..., 'confidence':None, 'box':None}, ...]
+    """
+    return TesseractJob(image).result()
 
-    # If still empty, return raw for debugging
-    if not lines:
-        print(json.dumps({
-            'lines': [], 
-            'warning': 'No text lines extracted. Raw result included for debugging.',
-            'raw': make_serializable(raw_result)
-        }, ensure_ascii=False))
+
+# create OCR model with correct modern parameters - optimized for maximum text detection
+# Using only validated parameters to avoid compatibility issues
+OCR_DET_PARAMS = {
+    'text_det_thresh': 0.2,  # Lower threshold to detect more text (was 0.3)
+    'text_det_box_thresh': 0.3,  # Lower box threshold to include more boxes (was 0.5)
+    'text_det_unclip_ratio': 2.0,  # Expand detected boxes more to capture full text (was 1.8)
+}
+
+
+# CPU inference profiles (scan option 'inference_profile'): model variants and runtime settings,
+# None leaves a setting to paddleocr. 'balanced' is paddleocr's own choice for the language.
+# Models come in (det, rec) pairs per language because naming a model makes paddleocr ignore lang;
+# languages without a pair keep the default models.
+INFERENCE_PROFILES = {
+    # interactive uploads: mobile models, detection capped at 960px, few threads per worker
+    'fast': {
+        'models': {'en': ('PP-OCRv5_mobile_det', 'en_PP-OCRv5_mobile_rec'),
+                   'ch': ('PP-OCRv5_mobile_det', 'PP-OCRv5_mobile_rec')},
+        'cpu_threads': 4,
+        'enable_mkldnn': True,
+        'rec_batch_size': 16,
+        'det_limit_side_len': 960,
+        'det_limit_type': 'max',
+    },
+    'balanced': {
+        'models': {},
+        'cpu_threads': None,
+        'enable_mkldnn': None,
+        'rec_batch_size': None,
+        'det_limit_side_len': None,
+        'det_limit_type': None,
+    },
+    # backfills: server models at the resolution they are given
+    'accurate': {
+        'models': {'en': ('PP-OCRv5_server_det', 'PP-OCRv5_server_rec'),
+                   'ch': ('PP-OCRv5_server_det', 'PP-OCRv5_server_rec')},
+        'cpu_threads': None,
+        'enable_mkldnn': True,
+        'rec_batch_size': 8,
+        'det_limit_side_len': 64,
+        'det_limit_type': 'min',
+    },
+}
+# profile setting -> PaddleOCR keyword argument
+INFERENCE_ARGS = {
+    'cpu_threads': 'cpu_threads',
+    'enable_mkldnn': 'enable_mkldnn',
+    'rec_batch_size': 'text_recognition_batch_size',
+    'det_limit_side_len': 'text_det_limit_side_len',
+    'det_limit_type': 'text_det_limit_type',
+}
+# Set through set_cpu_threads by --batch workers: their share of the cores ('cpu_threads'), which replaces
+# the profile's own thread count so the pool doesn't run workers x profile threads on the machine.
+_CPU_THREADS = {}
+
+
+def set_cpu_threads(count):
+    """
+    Build every model from now on with count CPU threads whatever its inference profile says
+    (None restores the profiles' own setting).
+    """
+    _CPU_THREADS['cpu_threads'] = count
+
+
+def inference_settings(lang, profile='balanced'):
+    """
+    Effective settings of an inference profile for lang: {'profile', 'det_model', 'rec_model',
+    'cpu_threads', ...}, None where paddleocr's default applies. Reported with every scan.
+    """
+    if profile not in INFERENCE_PROFILES:
+        raise ValueError(f"unknown inference profile: {profile}")
+    spec = INFERENCE_PROFILES[profile]
+    det_model, rec_model = spec['models'].get(lang, (None, None))
+    settings = {'profile': profile, 'det_model': det_model, 'rec_model': rec_model}
+    settings.update((key, spec[key]) for key in INFERENCE_ARGS)
+    if _CPU_THREADS.get('cpu_threads'):
+        settings['cpu_threads'] = _CPU_THREADS['cpu_threads']
+    return settings
+
+
+PADDLE_INSTALL_HINT = ('Activate the server venv and install paddlepaddle and paddleocr: pip install paddlepaddle '
+                       '-f https://www.paddlepaddle.org.cn/whl/windows/mkl/avx/stable.html && pip install paddleocr')
+
+
+class MissingDependency(RuntimeError):
+    """
+    A required package failed to import; payload is the JSON error the CLI prints (exit code
+    EXIT_MISSING_DEPENDENCY).
+    """
+
+    def __init__(self, payload):
+        super().__init__(payload.get('detail') or payload['error'])
+        self.payload = payload
+
+
+# Set by load_paddleocr: the PaddleOCR class and how long importing it took
+_PADDLE = {}
+_PADDLE_LOCK = threading.Lock()
+
+
+def load_paddleocr():
+    """
+    Import paddleocr + paddle on first use and return the PaddleOCR class. Deferred so --check, a cache
+    hit or a refused photo never pays the import. With OCR_MODEL_DIR (--model-dir) set, paddlex keeps
+    its downloaded models under that directory, so they are fetched once and reused from there.
+    """
+    with _PADDLE_LOCK:
+        if 'PaddleOCR' in _PADDLE:
+            return _PADDLE['PaddleOCR']
+        started = time.perf_counter()
+        model_dir = os.environ.get('OCR_MODEL_DIR')
+        if model_dir:
+            # read by paddlex at import time: models live in $PADDLE_PDX_CACHE_HOME/official_models
+            os.environ.setdefault('PADDLE_PDX_CACHE_HOME', os.path.abspath(model_dir))
+        try:
+            from paddleocr import PaddleOCR
+        except Exception as e:
+            raise MissingDependency({'error': 'Missing dependency paddleocr or paddlepaddle', 'detail': str(e)})
+        try:
+            import paddle  # noqa: F401
+        except Exception as e:
+            raise MissingDependency({'error': 'Missing dependency paddle', 'detail': str(e),
+                                     'hint': PADDLE_INSTALL_HINT})
+        _PADDLE['import_ms'] = round((time.perf_counter() - started) * 1000.0, 1)
+        _PADDLE['PaddleOCR'] = PaddleOCR
+        return PaddleOCR
+
+
+def startup_report():
+    """
+    Cold-start timings of this process: ms since paddle_scan started loading, and the paddle import
+    share of it (None while paddle isn't loaded).
+    """
+    return {'startup_ms': round((time.perf_counter() - _STARTED) * 1000.0, 1),
+            'paddle_import_ms': _PADDLE.get('import_ms')}
+
+
+def model_cache_dir():
+    """
+    Directory paddlex downloads models into and loads them from (see load_paddleocr).
+    """
+    base = (os.environ.get('PADDLE_PDX_CACHE_HOME') or os.environ.get('OCR_MODEL_DIR')
+            or os.path.join(os.path.expanduser('~'), '.paddlex'))
+    return os.path.join(os.path.abspath(base), 'official_models')
+
+
+# (module, distributions it may be installed as, required)
+PREFLIGHT_DEPENDENCIES = (
+    ('paddleocr', ('paddleocr',), True),
+    ('paddle', ('paddlepaddle', 'paddlepaddle-gpu'), True),
+    ('numpy', ('numpy',), True),
+    ('PIL', ('pillow', 'Pillow'), True),
+    ('cv2', ('opencv-python', 'opencv-contrib-python', 'opencv-python-headless', 'opencv-contrib-python-headless'), False),
+)
+
+
+def preflight_check():
+    """
+    --check: can this python run scans? Finds the dependencies with importlib (nothing heavy is
+    imported), the Tesseract binary and the cached models, in a few tens of ms.
+    ok is False when a required package is missing; models.ready is False when the first scan will
+    have to download the detection/recognition models.
+    """
+    import importlib.util
+    from importlib.metadata import version as pkg_version
+
+    deps, missing = {}, []
+    for module, dists, required in PREFLIGHT_DEPENDENCIES:
         try:
-            os.unlink(pre_path)
+            found = importlib.util.find_spec(module) is not None
         except Exception:
-            pass
-        sys.exit(0)
+            found = False
+        version = None
+        for dist in dists if found else ():
+            try:
+                version = pkg_version(dist)
+                break
+            except Exception:
+                continue
+        deps[module] = {'found': found, 'version': version, 'required': required}
+        if required and not found:
+            missing.append(module)
+
+    models_dir = model_cache_dir()
+    try:
+        cached = sorted(name for name in os.listdir(models_dir) if os.path.isdir(os.path.join(models_dir, name)))
+    except OSError:
+        cached = []
+    report = {
+        'ok': not missing,
+        'python': sys.executable,
+        'python_version': sys.version.split()[0],
+        'deps': deps,
+        'missing': missing,
+        'tesseract': find_tesseract(),
+        'models': {'dir': models_dir, 'cached': cached,
+                   'ready': any(n.endswith('_det') for n in cached) and any(n.endswith('_rec') for n in cached)},
+    }
+    if missing:
+        report['hint'] = PADDLE_INSTALL_HINT
+    report.update(startup_report())
+    return report
+
+
+def create_ocr(lang='en', det_params=None, profile='balanced'):
+    """
+    Build a PaddleOCR instance with the detection thresholds tuned for licenses/receipts and the
+    models and CPU settings of an INFERENCE_PROFILES entry.
+    det_params overrides entries of OCR_DET_PARAMS (used by the benchmark harness).
+    """
+    settings = inference_settings(lang, profile)
+    params = dict(OCR_DET_PARAMS)
+    params.update(det_params or {})
+    params.update((arg, settings[key]) for key, arg in INFERENCE_ARGS.items() if settings[key] is not None)
+    if settings['det_model']:
+        params['text_detection_model_name'] = settings['det_model']
+        params['text_recognition_model_name'] = settings['rec_model']
+    else:
+        params['lang'] = lang
+    return load_paddleocr()(**params)
+
+
+def log_event(event, **fields):
+    """
+    Write one structured JSON line to stderr (stdout is reserved for results).
+    """
+    record = {'event': event}
+    record.update(fields)
+    try:
+        sys.stderr.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        sys.stderr.flush()
+    except Exception:
+        pass
 
-    print(json.dumps({'lines': make_serializable(lines)}, ensure_ascii=False))
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB, or None where it can't be read.
+    """
     try:
-        os.unlink(pre_path)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KB on Linux, bytes on macOS
+        return round(peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0, 1)
     except Exception:
         pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024.0 * 1024.0), 1)
+    except Exception:
+        return None
+
+
+def percentile(values, pct):
+    """
+    Linear-interpolated percentile of values (pct in 0..100); None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    pos = (len(ordered) - 1) * pct / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summarize_ms(values):
+    """
+    mean/p50/p95/max of a list of millisecond timings, rounded; all None for an empty list.
+    """
+    return {
+        'mean': round(sum(values) / len(values), 2) if values else None,
+        'p50': round(percentile(values, 50), 2) if values else None,
+        'p95': round(percentile(values, 95), 2) if values else None,
+        'max': round(max(values), 2) if values else None,
+    }
+
+
+class StageTimer:
+    """
+    Wall time per pipeline stage in milliseconds. lap(name) charges the time elapsed since the
+    previous lap (or reset) to name, so stages are timed without wrapping code in blocks.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def reset(self):
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + (now - self._last) * 1000.0
+        self._last = now
+
+    def expired(self):
+        return False
+
+
+class ScanCancelled(BaseException):
+    """
+    Raised at a stage boundary when a job was cancelled or ran past its deadline. A BaseException,
+    so the pipeline's `except Exception` fallbacks let it through instead of degrading the result.
+    """
+
+
+class DeadlineTimer(StageTimer):
+    """
+    StageTimer for queued jobs: once cancel() was called or the monotonic deadline passed, the next
+    lap() runs the registered abort callbacks and raises ScanCancelled, so an abandoned scan stops
+    at the next stage instead of running to completion.
+    """
+
+    def __init__(self, deadline=None):
+        super().__init__()
+        self.deadline = deadline
+        self.reason = None
+        self._cancelled = threading.Event()
+        self._on_abort = []
+
+    def cancel(self, reason='cancelled'):
+        self.reason = self.reason or reason
+        self._cancelled.set()
+
+    def on_abort(self, fn):
+        self._on_abort.append(fn)
+
+    def expired(self):
+        if not self._cancelled.is_set() and self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel('deadline exceeded')
+        return self._cancelled.is_set()
+
+    def lap(self, name):
+        super().lap(name)
+        if self.expired():
+            for fn in self._on_abort:
+                try:
+                    fn()
+                except Exception:
+                    pass
+            raise ScanCancelled(self.reason)
+
+
+# Warm PaddleOCR instances keyed by (lang, inference profile). Only long-lived processes (--server)
+# benefit from this, a one-shot scan builds a single instance and exits.
+_OCR_INSTANCES = {}
+
+
+def get_ocr(lang='en', profile='balanced'):
+    """
+    Return a cached PaddleOCR instance for lang and inference profile, building it on first use.
+    """
+    ocr = _OCR_INSTANCES.get((lang, profile))
+    if ocr is None:
+        ocr = create_ocr(lang, profile=profile)
+        _OCR_INSTANCES[(lang, profile)] = ocr
+    return ocr
+
+
+def loaded_langs():
+    return sorted({lang for lang, _ in _OCR_INSTANCES})
+
+
+_THREAD_OCR = threading.local()
+
+
+def get_thread_ocr(lang='en', profile='balanced'):
+    """
+    Like get_ocr, but one instance per thread: a Paddle predictor must not run two inferences at
+    once, so every inference thread of the job server (--listen) owns its models.
+    """
+    instances = getattr(_THREAD_OCR, 'instances', None)
+    if instances is None:
+        instances = _THREAD_OCR.instances = {}
+    ocr = instances.get((lang, profile))
+    if ocr is None:
+        ocr = create_ocr(lang, profile=profile)
+        instances[(lang, profile)] = ocr
+    return ocr
+
+
+# Tunables for scan_image. CLI flags and --server request fields override these by key.
+DEFAULT_SCAN_OPTIONS = {
+    'crop_mode': 'rec',       # 'rec' = batched recognition-only crop pass, 'full' = det+rec per crop
+    'crop_batch_size': 16,    # crops per recognizer call in 'rec' mode
+    'crop_select': 'all',     # 'all' = re-read every detection, 'gated' = only low-confidence/suspicious ones
+    'crop_min_confidence': 0.85,  # gated: first-pass lines below this score are re-read
+    'crop_short_text': 3,     # gated: lines this short or shorter are re-read
+    'detect_mode': 'auto',    # 'auto' = 'full', switching to 'tiled' for tall/huge pages (see plan_tiling),
+                              # 'full' = one pass at PAGE_PREPROCESS size, 'pyramid' = coarse-to-fine over
+                              # DETECT_PYRAMID levels, 'tiled' = overlapping TILING tiles
+    'memory_budget_mb': 1024,  # peak memory target per scan: in 'auto' tall or oversized pages are tiled, and huge
+                               # ones are decoded downscaled in every mode (see plan_tiling); 0 = no budget
+    'profile': 'generic',     # document type, see DOCUMENT_PROFILES
+    'fallback_mode': 'sequential',  # Tesseract: 'sequential' = only after the whole Paddle pass came back with
+                                    # <= 1 line, 'race' = start it alongside Paddle when the first pass looks weak
+    'quality_gate': 'off',    # 'on' = reject unreadable photos before inference (see QUALITY_GATE), 'off' = always scan
+    'field_extraction': 'off',  # 'on' = also return license 'fields' read off the page lines (see LICENSE_LABELS)
+    'inference_profile': 'balanced',  # models and CPU settings, see INFERENCE_PROFILES
+}
+
+
+# Pre-inference photo checks, measured on a work_px grayscale copy. Calibrated so a clearly
+# motion-blurred or underexposed phone photo fails while a normal one passes with a wide margin.
+QUALITY_GATE = {
+    'work_px': 640,
+    'min_side': 480,          # shorter side of the upload in pixels
+    'min_brightness': 40,     # mean gray level (0-255)
+    'max_brightness': 250,    # only with low contrast or no edges: white e-receipts/screenshots average above this
+    'min_contrast': 12,       # gray level standard deviation
+    'min_sharpness': 30,      # variance of the Laplacian, sharp uploads score in the hundreds
+    'min_edge_density': 0.005,  # share of pixels on a strong edge; ~0 means no card/document in frame
+}
+
+
+# When fallback_mode is 'race', a first Paddle pass this weak starts Tesseract right away.
+TESSERACT_RACE = {
+    'max_first_pass_lines': 2,  # first pass found this few lines or fewer
+    'min_mean_confidence': 0.5,  # or its lines average below this score
+    'min_lines': 2,             # a result needs this many lines to win (Paddle's existing bar)
+}
+
+
+# Document types. 'options' are defaults layered under explicit overrides; the license profile
+# reads template fields off the located card and only falls back to the page pipeline on failure.
+DOCUMENT_PROFILES = {
+    'generic': {'options': {}},
+    # receipts are long and mostly clean print, only re-read the doubtful lines
+    'receipt': {'options': {'crop_select': 'gated', 'quality_gate': 'on'}},
+    # 'quality' overrides QUALITY_GATE: a card photographed on its own is often well under 480px tall
+    'license': {'options': {'crop_select': 'gated', 'field_extraction': 'on', 'quality_gate': 'on'},
+                'quality': {'min_side': 320}},
+}
+
+
+# Full-page preprocessing applied before detection (also part of the result cache key).
+PAGE_PREPROCESS = {'max_width': 3200, 'contrast': 1.3, 'enhance_sharpness': 1.1, 'to_grayscale': False}
+
+
+# Coarse-to-fine detection (detect_mode 'pyramid'): read the page small first and only go up a
+# level, on the text region alone, when the text found is too small to trust at that scale.
+DETECT_PYRAMID = {
+    'levels': (1280, 2048, 3200),  # longest side of each pass, coarse to fine (capped by PAGE_PREPROCESS max_width)
+    'min_text_px': 16,     # escalate while the small lines (10th percentile height) are shorter than this
+    'rec_min_px': 24,      # lines recognized at a smaller height are always re-read from the original
+    'roi_padding': 0.03,   # fraction of the page kept around the text region for the finer pass
+}
+
+
+def run_page_ocr(ocr, arr, use_cls=True):
+    """
+    Detection + recognition over one page array. Multi-page output is flattened to one list of
+    detections and an empty page becomes []. Returns the raw PaddleOCR result (None if it gave none).
+    """
+    try:
+        if use_cls:
+            raw_result = ocr.ocr(arr, cls=True)
+        else:
+            raw_result = ocr.ocr(arr)
+    except Exception:
+        # fallback without cls
+        raw_result = ocr.ocr(arr)
+
+    # PaddleOCR standard format: list of detections where each is [bbox, (text, confidence)]
+    # For multi-page: [[page1_detections], [page2_detections], ...]
+    # For single page: [detection1, detection2, ...]
+    # Handle multi-page format by flattening
+    if isinstance(raw_result, (list, tuple)) and len(raw_result) > 0:
+        # Check if it's a list of pages (each page is a list of detections)
+        if isinstance(raw_result[0], (list, tuple)) and len(raw_result[0]) > 0:
+            # Check if first page's first element looks like a detection [bbox, text_info]
+            first_item = raw_result[0][0]
+            if isinstance(first_item, (list, tuple)) and len(first_item) >= 2:
+                # This is multi-page format, flatten it
+                flattened = []
+                for page in raw_result:
+                    if page is not None and isinstance(page, (list, tuple)):
+                        flattened.extend(page)
+                raw_result = flattened
+        # Handle case where first element is None (empty result)
+        elif raw_result[0] is None:
+            raw_result = []
+    return raw_result
+
+
+def detection_lines(detections):
+    """
+    flatten_detections items -> [{'text', 'confidence', 'box'}], skipping boxes without text.
+    """
+    lines = []
+    for det in detections:
+        text, conf = detection_text_conf(det)
+        if text and str(text).strip():
+            lines.append({'text': make_serializable(text), 'confidence': conf, 'box': make_serializable(det[0])})
+    return lines
+
+
+class LineStream:
+    """
+    Incremental view of one scan for an on_event consumer (--stream). First-pass lines get ids in
+    reading order; crop re-reads are paired with them by box overlap as in merge_lines and only
+    the reads that would win the merge are sent, under the id of the line they replace (regions
+    the first pass missed get new ids). The final payload remains the authoritative result.
+    """
+
+    def __init__(self, first_pass, emit, box_factor=1.0, iou_threshold=0.5):
+        self.emit = emit
+        self.box_factor = box_factor
+        self.iou_threshold = iou_threshold
+        self.lines = [dict(item, id=i) for i, item in enumerate(first_pass)]
+        rects = [box_rect(item.get('box')) for item in self.lines]
+        heights = sorted(r[3] - r[1] for r in rects if r is not None)
+        self.index = BoxIndex(cell=4.0 * heights[len(heights) // 2] if heights else 64.0)
+        for rect in rects:
+            # keep index positions equal to ids; boxless lines get an empty rect nothing overlaps
+            self.index.add(rect or (0.0, 0.0, 0.0, 0.0))
+
+    def send(self, event, lines, **extra):
+        message = dict(event=event, lines=[dict(line) for line in lines], **extra)
+        if self.box_factor != 1.0:
+            rescale_payload_boxes(message, self.box_factor)
+        self.emit(message)
+
+    def first_pass(self, fields=None, stage='first_pass'):
+        """
+        Send the 'lines' event every streamed scan starts with. stage is 'first_pass' for the page
+        pipeline, 'card' for a license template read and 'cache' for a cache hit (both final).
+        """
+        extra = {'fields': fields} if fields else {}
+        self.send('lines', self.lines, stage=stage, **extra)
+
+    def refine(self, crop_lines):
+        refined = []
+        for item in crop_lines:
+            if not str(item.get('text') or '').strip():
+                continue
+            rect = box_rect(item.get('box'))
+            match = self.index.best_overlap(rect, self.iou_threshold) if rect is not None else None
+            if match is None:
+                line = dict(item, id=len(self.lines))
+                self.index.add(rect or (0.0, 0.0, 0.0, 0.0))
+                self.lines.append(line)
+            elif line_confidence(item) >= line_confidence(self.lines[match]):
+                line = dict(item, id=match)
+                self.lines[match] = line
+            else:
+                continue
+            refined.append(line)
+        if refined:
+            self.send('refine', refined, stage='crop_rerun')
+
+
+def pyramid_detect(ocr, orig_img, use_cls=True, settings=None, preprocess=None, timer=None):
+    """
+    Coarse-to-fine page OCR. The first pass reads the whole page shrunk to the first level; while
+    its small lines are under min_text_px (or nothing was found) the padded union of the text
+    boxes is cut from the original and read again at the next level that makes them big enough.
+    The finest pass that found text wins.
+    Returns (detections, raw_result, passes): detections are [poly, {'text', 'score', 'read_px'}]
+    with polys in original image coordinates, passes describes each pass for the stage report.
+    Each pass charges its resize/enhance to timer's 'preprocess' and its OCR to 'detect_recognize'.
+    """
+    timer = timer if timer is not None else StageTimer()
+    settings = dict(DETECT_PYRAMID, **(settings or {}))
+    preprocess = dict(PAGE_PREPROCESS if preprocess is None else preprocess)
+    cap = preprocess.pop('max_width', None)
+    levels = sorted({min(int(l), int(cap)) if cap else int(l) for l in settings['levels']})
+    min_text_px = float(settings['min_text_px'])
+    ow, oh = orig_img.size
+    roi = (0, 0, ow, oh)
+    detections, raw_result, passes = [], None, []
+
+    level_idx = 0
+    while level_idx < len(levels):
+        level = levels[level_idx]
+        region = orig_img if roi == (0, 0, ow, oh) else orig_img.crop(roi)
+        rw = region.size[0]
+        img = enhance_image(region, max_width=level, **preprocess)
+        scale = img.size[0] / float(rw)
+        arr = to_ocr_array(img)
+        del img, region
+        timer.lap('preprocess')
+        try:
+            result = run_page_ocr(ocr, arr, use_cls)
+        finally:
+            del arr
+            timer.lap('detect_recognize')
+
+        found = []
+        for det in flatten_detections(result) if result is not None else []:
+            points = box_points(det[0])
+            if not points:
+                continue
+            text, conf = detection_text_conf(det)
+            ys = [y for _, y in points]
+            poly = [[round(x / scale + roi[0], 1), round(y / scale + roi[1], 1)] for x, y in points]
+            found.append([poly, {'text': text, 'score': conf, 'read_px': round(max(ys) - min(ys), 1)}])
+        passes.append({'level': level, 'roi': list(roi), 'scale': round(scale, 4), 'detections': len(found)})
+        if found or raw_result is None:
+            detections, raw_result = found, result
+
+        # already at native resolution, nothing finer to look at
+        if scale >= 1.0 or level_idx == len(levels) - 1:
+            break
+        heights = sorted(d[1]['read_px'] for d in detections)
+        small_px = heights[len(heights) // 10] if heights else 0.0
+        if heights and small_px >= min_text_px:
+            break
+
+        if detections:
+            pad = settings['roi_padding'] * max(ow, oh)
+            xs = [x for d in detections for x, _ in d[0]]
+            ys = [y for d in detections for _, y in d[0]]
+            roi = (int(max(0, min(xs) - pad)), int(max(0, min(ys) - pad)),
+                   int(min(ow, max(xs) + pad)), int(min(oh, max(ys) + pad)))
+            # smallest next level that brings the small lines up to min_text_px
+            needed = min_text_px / max(small_px / scale, 1e-6)
+            longest = max(roi[2] - roi[0], roi[3] - roi[1])
+            level_idx += 1
+            while level_idx < len(levels) - 1 and levels[level_idx] / float(longest) < needed:
+                level_idx += 1
+        else:
+            roi = (0, 0, ow, oh)
+            level_idx += 1
+
+    return detections, raw_result, passes
+
+
+# Tiled detection for pages too tall or too large to read in one pass within the memory budget
+# (options['memory_budget_mb']). Tiles are read one at a time, so the detection working set is
+# bounded by the tile size however large the page is.
+TILING = {
+    'tall_aspect': 3.0,       # pages this many times longer than wide are always tiled (long receipts)
+    'page_px': 2400,          # the page's shorter side is read at up to this many px, the longer one is not capped
+    'tile_px': 1600,          # tile side in detection px, lowered until a tile fits the budget
+    'min_tile_px': 640,
+    'overlap': 0.12,          # fraction of a tile shared with its neighbour, should exceed a text line
+    'det_bytes_per_px': 80,   # estimated detection working set per input pixel (arrays + network activations)
+    'decode_share': 0.5,      # budget share the decoded page may take, larger pages are decoded downscaled
+    'edge_px': 3,             # a box within this many detection px of an inner tile edge was cut by it
+}
+
+MB = 1024 * 1024
+
+
+def plan_tiling(image_size, options, settings=None):
+    """
+    Decide how a page of image_size (w, h) is read within options['memory_budget_mb'] (0 = no budget).
+    Returns {'tiled', 'reason', 'decode_scale', 'scale', 'tile_px', 'estimate_mb'}:
+      decode_scale  < 1 when the decoded page alone would take more than decode_share of the budget
+                    (a power of two, which JPEG draft decoding does natively)
+      tiled/reason  'forced' (detect_mode 'tiled'), 'tall' (height >= tall_aspect * width) or 'budget'
+                    (one pass at the finest detection level would not fit); reason is None when neither
+                    applies. Only 'auto' tiles for 'tall'/'budget', explicit 'full'/'pyramid' keep their
+                    pass and the reason is left for the caller to report
+      scale/tile_px tile geometry: decoded page px -> detection px, and the tile side in detection px
+    """
+    settings = dict(TILING, **(settings or {}))
+    budget = float(options.get('memory_budget_mb') or 0) * MB
+    w, h = image_size
+    decode_scale = 1.0
+    if budget > 0 and w * h * 3 > budget * settings['decode_share']:
+        ratio = math.sqrt(budget * settings['decode_share'] / float(w * h * 3))
+        decode_scale = 2.0 ** -math.ceil(math.log2(1.0 / ratio))
+    dw, dh = w * decode_scale, h * decode_scale
+    decoded = dw * dh * 3
+
+    # an untiled pass reads the whole page at the finest level (pyramid or full mode alike)
+    finest = min(max(DETECT_PYRAMID['levels']), PAGE_PREPROCESS['max_width'])
+    shrink = min(1.0, finest / float(max(dw, dh)))
+    estimate = decoded + dw * dh * shrink * shrink * settings['det_bytes_per_px']
+
+    reason = None
+    if options.get('detect_mode') == 'tiled':
+        reason = 'forced'
+    elif budget > 0 and dh >= settings['tall_aspect'] * dw:
+        reason = 'tall'
+    elif budget > 0 and estimate > budget:
+        reason = 'budget'
+
+    tile_px = int(settings['tile_px'])
+    if budget > 0:
+        fit = math.sqrt(max(budget - decoded, 0.0) / settings['det_bytes_per_px'])
+        tile_px = int(max(settings['min_tile_px'], min(tile_px, fit)))
+    return {
+        'tiled': reason == 'forced' or (reason is not None and options.get('detect_mode', 'auto') == 'auto'),
+        'reason': reason,
+        'decode_scale': decode_scale,
+        'scale': min(1.0, settings['page_px'] / float(min(dw, dh))),
+        'tile_px': tile_px,
+        'estimate_mb': round(estimate / MB, 1),
+    }
+
+
+def tile_starts(length, tile, overlap):
+    """
+    Evenly spaced tile offsets covering length, neighbours sharing at least overlap.
+    """
+    if length <= tile:
+        return [0]
+    step = max(tile - overlap, 1)
+    count = int(math.ceil((length - overlap) / float(step)))
+    count = max(count, 2)
+    return [int(round(i * (length - tile) / float(count - 1))) for i in range(count)]
+
+
+def join_seam_text(first, second):
+    """
+    Join two reads of one line split by a tile seam, dropping the characters both tiles saw.
+    """
+    first, second = (first or '').strip(), (second or '').strip()
+    for k in range(min(len(first), len(second)), 1, -1):
+        if first.endswith(second[:k]):
+            return first + second[k:]
+    return f"{first} {second}".strip()
+
+
+def stitch_tile_detections(detections, min_cover=0.7):
+    """
+    Reconcile detections from overlapping tiles ([poly, {'text', 'score', 'read_px', 'tile', 'cut'}],
+    'cut' set when the box touches an inner tile edge).
+      - a cut box mostly (min_cover) covered by a box from another tile is the partial copy of a line
+        the neighbour saw whole, and is dropped
+      - cut boxes from different tiles that still overlap are the two halves of one line: they become
+        one box, text joined at the seam, marked 'stitched' so the crop pass re-reads it whole
+    Whole duplicates from the overlap band are left to merge_lines.
+    Returns (detections, {'seam_dropped': n, 'stitched': n}).
+    """
+    rects = [box_rect(d[0]) for d in detections]
+    index = BoxIndex(cell=128.0)
+    for rect in rects:
+        index.add(rect)
+
+    def area(r):
+        return max(r[2] - r[0], 0.0) * max(r[3] - r[1], 0.0)
+
+    keep = [True] * len(detections)
+    dropped = 0
+    for i, det in enumerate(detections):
+        if not det[1].get('cut'):
+            continue
+        for j in index.overlapping(rects[i]):
+            other = detections[j]
+            if j == i or not keep[j] or other[1]['tile'] == det[1]['tile']:
+                continue
+            a, b = rects[i], rects[j]
+            inter = (min(a[2], b[2]) - max(a[0], b[0])) * (min(a[3], b[3]) - max(a[1], b[1]))
+            if inter >= min_cover * area(a) and (not other[1].get('cut') or area(b) > area(a)):
+                keep[i] = False
+                dropped += 1
+                break
+
+    # group the remaining cut boxes that overlap across a seam (union-find)
+    parent = list(range(len(detections)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, det in enumerate(detections):
+        if not keep[i] or not det[1].get('cut'):
+            continue
+        for j in index.overlapping(rects[i]):
+            if j != i and keep[j] and detections[j][1].get('cut') and detections[j][1]['tile'] != det[1]['tile']:
+                parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(detections)):
+        if keep[i]:
+            groups.setdefault(find(i), []).append(i)
+
+    out, stitched = [], 0
+    for members in groups.values():
+        if len(members) == 1:
+            out.append(detections[members[0]])
+            continue
+        stitched += 1
+        x0 = min(rects[i][0] for i in members)
+        y0 = min(rects[i][1] for i in members)
+        x1 = max(rects[i][2] for i in members)
+        y1 = max(rects[i][3] for i in members)
+        if x1 - x0 >= y1 - y0:
+            # split across a vertical seam: the halves read left to right
+            text = ''
+            for i in sorted(members, key=lambda m: rects[m][0]):
+                text = join_seam_text(text, detections[i][1]['text'])
+        else:
+            # split across a horizontal seam, neither half is a full read: keep the better one
+            text = max((detections[i][1] for i in members), key=lambda m: m['score'] or 0.0)['text']
+        scores = [detections[i][1]['score'] for i in members if detections[i][1]['score'] is not None]
+        out.append([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]],
+                    {'text': text, 'score': min(scores) if scores else None,
+                     'read_px': max(detections[i][1]['read_px'] for i in members), 'stitched': True}])
+    return out, {'seam_dropped': dropped, 'stitched': stitched}
+
+
+def tiled_detect(ocr, orig_img, use_cls=True, plan=None, settings=None, preprocess=None, timer=None):
+    """
+    Page OCR over overlapping tiles read one at a time (a generator pipeline: each tile is cut,
+    enhanced, read and released before the next), so memory stays bounded by the tile size.
+    plan comes from plan_tiling. Boxes cut by tile edges are stitched (stitch_tile_detections).
+    Returns (detections, raw_result, report) like pyramid_detect, polys in orig_img coordinates;
+    raw_result is the last tile's raw output (kept for the no-lines debug payload only).
+    """
+    timer = timer if timer is not None else StageTimer()
+    settings = dict(TILING, **(settings or {}))
+    plan = plan or plan_tiling(orig_img.size, {'detect_mode': 'tiled'}, settings)
+    preprocess = dict(PAGE_PREPROCESS if preprocess is None else preprocess)
+    preprocess.pop('max_width', None)
+    ow, oh = orig_img.size
+    scale, tile_px = plan['scale'], plan['tile_px']
+    overlap = int(tile_px * settings['overlap'])
+    xs = tile_starts(ow * scale, tile_px, overlap)
+    ys = tile_starts(oh * scale, tile_px, overlap)
+
+    def tiles():
+        for ty in ys:
+            for tx in xs:
+                rect = (int(tx / scale), int(ty / scale),
+                        min(ow, int(math.ceil((tx + tile_px) / scale))), min(oh, int(math.ceil((ty + tile_px) / scale))))
+                img = enhance_image(orig_img.crop(rect), max_width=tile_px, **preprocess)
+                tile_scale = img.size[0] / float(rect[2] - rect[0])
+                arr = to_ocr_array(img)
+                del img
+                yield rect, tile_scale, arr
+
+    detections, raw_result = [], None
+    for tile_idx, (rect, tile_scale, arr) in enumerate(tiles()):
+        timer.lap('preprocess')
+        try:
+            result = run_page_ocr(ocr, arr, use_cls)
+        finally:
+            del arr
+            timer.lap('detect_recognize')
+        if result is None:
+            continue
+        raw_result = result
+        edge = settings['edge_px'] / tile_scale
+        for det in flatten_detections(result):
+            points = box_points(det[0])
+            if not points:
+                continue
+            text, conf = detection_text_conf(det)
+            poly = [[round(x / tile_scale + rect[0], 1), round(y / tile_scale + rect[1], 1)] for x, y in points]
+            x0, y0 = min(p[0] for p in poly), min(p[1] for p in poly)
+            x1, y1 = max(p[0] for p in poly), max(p[1] for p in poly)
+            # touching an edge shared with a neighbouring tile: the line may continue there
+            cut = ((rect[0] > 0 and x0 - rect[0] <= edge) or (rect[2] < ow and rect[2] - x1 <= edge)
+                   or (rect[1] > 0 and y0 - rect[1] <= edge) or (rect[3] < oh and rect[3] - y1 <= edge))
+            ys_tile = [y for _, y in points]
+            detections.append([poly, {'text': text, 'score': conf, 'read_px': round(max(ys_tile) - min(ys_tile), 1),
+                                      'tile': tile_idx, 'cut': cut}])
+        del result
+
+    detections, counts = stitch_tile_detections(detections)
+    for det in detections:
+        det[1].pop('tile', None)
+        det[1].pop('cut', None)
+    report = {'count': len(xs) * len(ys), 'grid': [len(xs), len(ys)], 'tile_px': tile_px, 'overlap_px': overlap,
+              'scale': round(scale, 4), 'reason': plan['reason']}
+    report.update(counts)
+    return detections, raw_result, report
+
+
+def resolve_scan_options(overrides=None):
+    """
+    Merge overrides (dict, unknown keys and None values ignored) onto DEFAULT_SCAN_OPTIONS and
+    the defaults of the requested document profile.
+    """
+    options = dict(DEFAULT_SCAN_OPTIONS)
+    profile = (overrides or {}).get('profile') or options['profile']
+    if profile not in DOCUMENT_PROFILES:
+        raise ValueError(f"unknown profile: {profile}")
+    options.update(DOCUMENT_PROFILES[profile]['options'])
+    for key, value in (overrides or {}).items():
+        if key in options and value is not None:
+            options[key] = value
+    if options['inference_profile'] not in INFERENCE_PROFILES:
+        raise ValueError(f"unknown inference profile: {options['inference_profile']}")
+    return options
+
+
+def assess_quality(source, settings=None):
+    """
+    Cheap pre-inference check of a photo (path, bytes or PIL image): resolution, brightness,
+    contrast, blur and whether anything document-like is in frame. JPEGs are decoded straight at
+    reduced size, so this costs a few tens of ms even for 12MP uploads.
+    Returns {'ok', 'reasons', 'metrics', 'elapsed_ms'}; reasons are too_small, too_dark, too_bright,
+    low_contrast, blurry and no_document.
+    """
+    settings = dict(QUALITY_GATE, **(settings or {}))
+    started = time.perf_counter()
+    if isinstance(source, Image.Image):
+        img = source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        img = Image.open(io.BytesIO(bytes(source)))
+    else:
+        img = Image.open(source)
+    width, height = img.size
+    work_px = int(settings['work_px'])
+    if getattr(img, 'format', None) == 'JPEG':
+        # let libjpeg scale down while decoding (1/2, 1/4, 1/8, never below work_px)
+        img.draft('L', (work_px, work_px))
+    gray = img.convert('L')
+    gray.thumbnail((work_px, work_px))
+    a = np.asarray(gray, dtype=np.float32)
+
+    brightness = float(a.mean())
+    contrast = float(a.std())
+    if a.shape[0] > 2 and a.shape[1] > 2:
+        laplacian = a[1:-1, 1:-1] * -4.0 + a[:-2, 1:-1] + a[2:, 1:-1] + a[1:-1, :-2] + a[1:-1, 2:]
+        sharpness = float(laplacian.var())
+        gradient = np.abs(np.diff(a, axis=1))[:-1, :] + np.abs(np.diff(a, axis=0))[:, :-1]
+        edge_density = float((gradient > 40).mean())
+    else:
+        sharpness, edge_density = 0.0, 0.0
+
+    reasons = []
+    if min(width, height) < settings['min_side']:
+        reasons.append('too_small')
+    if brightness < settings['min_brightness']:
+        reasons.append('too_dark')
+    elif brightness > settings['max_brightness'] and (contrast < settings['min_contrast']
+                                                       or edge_density < settings['min_edge_density']):
+        # a bright page with legible text (white scan, screenshot) is fine, a washed-out one is not
+        reasons.append('too_bright')
+    if contrast < settings['min_contrast']:
+        reasons.append('low_contrast')
+    if sharpness < settings['min_sharpness']:
+        reasons.append('blurry')
+    if edge_density < settings['min_edge_density']:
+        reasons.append('no_document')
+    return {
+        'ok': not reasons,
+        'reasons': reasons,
+        'metrics': {
+            'width': width,
+            'height': height,
+            'brightness': round(brightness, 1),
+            'contrast': round(contrast, 1),
+            'sharpness': round(sharpness, 1),
+            'edge_density': round(edge_density, 4),
+        },
+        'elapsed_ms': round((time.perf_counter() - started) * 1000.0, 2),
+    }
+
+
+def first_pass_is_weak(lines, settings=None):
+    """
+    True when the first Paddle pass found so little, or so unsure, text that Tesseract should start now.
+    """
+    settings = dict(TESSERACT_RACE, **(settings or {}))
+    if len(lines) <= settings['max_first_pass_lines']:
+        return True
+    scores = []
+    for item in lines:
+        try:
+            scores.append(float(item.get('confidence')))
+        except (TypeError, ValueError):
+            continue
+    return bool(scores) and sum(scores) / len(scores) < settings['min_mean_confidence']
+
+
+def tesseract_wins(job, paddle_lines, settings=None):
+    """
+    True once a finished Tesseract job passes the bar and read more lines than Paddle has.
+    """
+    settings = dict(TESSERACT_RACE, **(settings or {}))
+    if job is None or not job.done() or not job.items:
+        return False
+    return len(job.items) >= settings['min_lines'] and len(job.items) > paddle_lines
+
+
+def settle_tesseract_race(job, lines, stages, warnings, settings=None):
+    """
+    Paddle has finished: keep its lines if they pass the bar (cancelling Tesseract), otherwise wait
+    for Tesseract and, like the sequential fallback, take whatever it read. Returns the lines to use.
+    """
+    settings = dict(TESSERACT_RACE, **(settings or {}))
+    if job is None:
+        return lines
+    if len(lines) >= settings['min_lines']:
+        if not job.done():
+            stages['tesseract_race'] = 'cancelled'
+        else:
+            stages['tesseract_race'] = 'lost' if job.items else 'failed'
+        job.cancel()
+        return lines
+    t_lines, t_err = job.result()
+    if t_lines:
+        stages['tesseract_race'] = 'won'
+        stages['tesseract_fallback'] = True
+        return t_lines
+    stages['tesseract_race'] = 'failed'
+    warnings.append(f"tesseract fallback failed: {t_err}")
+    return lines
+
+
+def image_size(source):
+    """
+    (w, h) of a path, raw bytes or PIL image, from the header only.
+    """
+    if isinstance(source, Image.Image):
+        return source.size
+    return open_image(source).size
+
+
+def rescale_payload_boxes(payload, factor):
+    """
+    Multiply every line and field box of payload by factor, in place (decoded -> original pixels).
+    """
+    rescale_boxes(list(payload.get('lines') or []) + list((payload.get('fields') or {}).values()), factor)
+    return payload
+
+
+def rescale_boxes(items, factor):
+    """
+    Multiply the 'box' of every item dict by factor, in place.
+    """
+    for item in items:
+        if isinstance(item, dict) and item.get('box') is not None:
+            points = box_points(item['box'])
+            if points:
+                item['box'] = [[round(x * factor, 1), round(y * factor, 1)] for x, y in points]
+
+
+def scan_image(ocr, source, use_cls=True, options=None, timer=None, metrics=None, ocr_factory=None, on_event=None):
+    """
+    Run the full pipeline (preprocess, detection + recognition, crop re-run, Tesseract fallback)
+    on one image given as a path or raw bytes. The upload is decoded once and every stage works on
+    in-memory arrays, no temp files are written.
+    ocr may be None with ocr_factory() given instead: the model is then only built once the image
+    exists, passed the quality gate and decoded.
+    Pass a StageTimer as timer to collect per-stage wall times, and a dict as metrics to receive
+    facts that aren't part of the payload (image size, warnings).
+    With the quality gate on, unreadable photos are refused before inference with
+    {'error': 'Image quality too low', 'quality': {...}, 'retake': True}.
+    on_event(message) receives the first-pass lines ({'event': 'lines'}, with the license 'fields'
+    they already give when field extraction is on) and then each batch of crop re-reads that improves
+    on them ({'event': 'refine'}), see LineStream. A license read off the card template sends its
+    lines as one 'lines' event (stage 'card').
+    Returns the JSON payload: {'lines': [...]} on success or {'error': ...} on failure.
+    """
+    options = resolve_scan_options(options)
+    timer = timer if timer is not None else StageTimer()
+    metrics = metrics if metrics is not None else {}
+    warnings = metrics.setdefault('warnings', [])
+    timer.reset()
+    if isinstance(source, str) and not os.path.exists(source):
+        return {'error': 'Image not found', 'path': source}
+
+    if options['quality_gate'] == 'on':
+        try:
+            quality = assess_quality(source, DOCUMENT_PROFILES[options['profile']].get('quality'))
+        except Exception as e:
+            return {'error': 'Could not decode image', 'detail': str(e)}
+        metrics['quality'] = quality
+        timer.lap('quality')
+        if not quality['ok']:
+            # tell the client to retake the photo instead of spending seconds on a useless OCR
+            return {'error': 'Image quality too low', 'quality': quality, 'retake': True}
+
+    # in 'auto' tall/huge pages are tiled; any page is decoded downscaled when it alone would blow the budget
+    plan, full_size = None, None
+    try:
+        if options['detect_mode'] == 'tiled' or float(options['memory_budget_mb'] or 0) > 0:
+            full_size = image_size(source)
+            plan = plan_tiling(full_size, options)
+        orig_img = load_image(source, scale=plan['decode_scale'] if plan else 1.0)
+    except Exception as e:
+        return {'error': 'Could not decode image', 'detail': str(e)}
+    full_size = full_size or orig_img.size
+    # every box is reported in the upload's pixels: decode_factor maps orig_img px (Tesseract, card
+    # template) there, box_factor maps the detection px of the Paddle lines
+    decode_factor = full_size[0] / float(orig_img.size[0])
+    box_factor = decode_factor
+    metrics['image_width'], metrics['image_height'] = full_size
+    timer.lap('decode')
+
+    if ocr is None:
+        ocr = ocr_factory()
+        timer.lap('model_init')
+
+    card_fields, profile_fallback = None, None
+    if options['profile'] == 'license':
+        recognize = lambda crops, batch_size: recognize_crops(ocr, crops, batch_size=batch_size)
+        payload, card_fields, profile_fallback = scan_license_card(recognize, orig_img, options, timer, warnings)
+        if payload is not None:
+            if decode_factor != 1.0:
+                rescale_payload_boxes(payload, decode_factor)
+            if on_event is not None:
+                LineStream(payload['lines'], on_event).first_pass(payload.get('fields'), stage='card')
+            timer.lap('serialize')
+            return payload
+
+    detections = None
+    try:
+        if plan is not None and plan['tiled']:
+            detections, raw_result, tiles = tiled_detect(ocr, orig_img, use_cls=use_cls, plan=plan, timer=timer)
+            box_scale = 1.0
+            metrics['tiles'] = tiles
+            metrics['detect_width'] = metrics['detect_height'] = tiles['tile_px']
+        elif options['detect_mode'] == 'pyramid':
+            detections, raw_result, passes = pyramid_detect(ocr, orig_img, use_cls=use_cls, timer=timer)
+            box_scale = 1.0
+            metrics['detect_passes'] = passes
+            last_roi, last_scale = passes[-1]['roi'], passes[-1]['scale']
+            metrics['detect_width'] = int((last_roi[2] - last_roi[0]) * last_scale)
+            metrics['detect_height'] = int((last_roi[3] - last_roi[1]) * last_scale)
+        else:
+            # preprocess full image to help detection - keep higher resolution for better text detection
+            pre_img = enhance_image(orig_img, **PAGE_PREPROCESS)
+            # detections are in pre_img coordinates, crops are cut from the (possibly larger) original
+            box_scale = orig_img.size[0] / float(pre_img.size[0])
+            box_factor = full_size[0] / float(pre_img.size[0])
+            pre_arr = to_ocr_array(pre_img)
+            del pre_img
+            metrics['detect_width'], metrics['detect_height'] = pre_arr.shape[1], pre_arr.shape[0]
+            timer.lap('preprocess')
+            try:
+                # detection + recognition on preprocessed image
+                raw_result = run_page_ocr(ocr, pre_arr, use_cls)
+            finally:
+                del pre_arr
+    except Exception as e:
+        return {'error': 'OCR failed', 'detail': str(e)}
+    timer.lap('detect_recognize')
+
+    # Handle None or empty results
+    if raw_result is None:
+        return {'error': 'OCR returned no results', 'detail': 'PaddleOCR returned None'}
+
+    # Attempt to extract lines from raw_result - this is the primary source
+    if detections is None:
+        detections = flatten_detections(raw_result)
+    extracted = detection_lines(detections)
+    if not extracted:
+        # shapes flatten_detections doesn't know (e.g. text without boxes)
+        extract_texts(raw_result, extracted)
+    metrics['extracted_lines'] = len(extracted)
+
+    # The same region read twice collapses to its more confident read; equal text elsewhere stays
+    unique_extracted, first_counts = merge_lines(extracted)
+
+    timer.lap('extract')
+
+    stream = None
+    if on_event is not None:
+        stream = LineStream(unique_extracted, on_event, box_factor=box_factor)
+        stream.first_pass(extract_license_fields(unique_extracted) if options['field_extraction'] == 'on' else None)
+        timer.lap('stream')
+
+    # Per-stage counts reported with the result, for tuning the crop gating
+    stages = {'first_pass_lines': len(unique_extracted), 'detections': 0, 'crops_selected': 0, 'crops_skipped': 0,
+              'duplicates_dropped': first_counts['duplicates_dropped']}
+
+    # Weak first pass: let Tesseract work on the page while Paddle re-reads its crops
+    tess_job = None
+    if options['fallback_mode'] == 'race' and first_pass_is_weak(unique_extracted):
+        tess_job = TesseractJob(orig_img)
+        stages['tesseract_race'] = 'started'
+        if isinstance(timer, DeadlineTimer):
+            timer.on_abort(tess_job.cancel)
+    if options['profile'] != 'generic':
+        stages['profile'] = options['profile']
+    if profile_fallback:
+        stages['profile_fallback'] = profile_fallback
+    if metrics.get('detect_passes'):
+        stages['detect_passes'] = metrics['detect_passes']
+    if metrics.get('tiles'):
+        stages['tiles'] = metrics['tiles']
+    if plan is not None and plan['reason'] and not plan['tiled']:
+        # the requested detect_mode was kept although the page would have been tiled in 'auto'
+        stages['tiling_skipped'] = {'reason': plan['reason'], 'estimate_mb': plan['estimate_mb']}
+        warnings.append(f"detect_mode {options['detect_mode']!r} kept for a page auto would tile "
+                        f"({plan['reason']}, ~{plan['estimate_mb']} MB)")
+    if orig_img.size[0] != full_size[0]:
+        stages['decode_scale'] = round(orig_img.size[0] / float(full_size[0]), 4)
+
+    # Tesseract may already have a usable page, then the crop re-reads are skipped
+    tess_won = tess_job is not None and tesseract_wins(tess_job, len(unique_extracted))
+
+    # Normalize detections and perform per-box crop + re-recognition from the original (higher res) image
+    # This is optional enhancement - use extracted as primary source
+    crops_result = []
+    try:
+        # fallback: if flatten_detections found nothing and raw_result looks like a list of boxes, use it directly
+        if not detections and isinstance(raw_result, (list, tuple)):
+            detections = list(raw_result)
+        stages['detections'] = len(detections)
+
+        if options['crop_select'] == 'gated':
+            detections, reasons = select_detections_for_rerun(
+                detections,
+                min_confidence=float(options['crop_min_confidence']),
+                short_text_len=int(options['crop_short_text']),
+                min_read_px=DETECT_PYRAMID['rec_min_px'] if metrics.get('detect_passes') or metrics.get('tiles') else None,
+            )
+            stages['crop_reasons'] = reasons
+        stages['crops_selected'] = len(detections)
+        stages['crops_skipped'] = stages['detections'] - len(detections)
+
+        if detections and not tess_won:
+            stop_rerun = None
+            if tess_job is not None or isinstance(timer, DeadlineTimer):
+                stop_rerun = lambda: timer.expired() or (tess_job is not None and tesseract_wins(tess_job, len(unique_extracted)))
+            crops_result = crop_and_rerun_ocr(
+                ocr, orig_img, detections, crop_padding=8, upscale=2.5,
+                batch_size=int(options['crop_batch_size']), rec_only=options['crop_mode'] != 'full',
+                box_scale=box_scale, warnings=warnings,
+                should_stop=stop_rerun, on_results=stream.refine if stream is not None else None,
+            )
+    except Exception as ex:
+        warnings.append(f"crop processing failed: {ex}")
+        crops_result = []
+
+    timer.lap('crop_rerun')
+    tess_won = tess_won or (tess_job is not None and tesseract_wins(tess_job, len(unique_extracted)))
+
+    # Merge results: each crop re-read is paired with its first-pass line by box overlap and the
+    # more confident read is kept; output is in reading order
+    stages['crop_results'] = len([c for c in crops_result if c.get('text')])
+    lines, merge_counts = merge_lines(unique_extracted, crops_result)
+    stages['crop_replaced'] = merge_counts['crop_replaced']
+    stages['crop_lines_added'] = merge_counts['crop_lines_added']
+
+    timer.lap('merge')
+
+    lines_factor = box_factor
+    if tess_job is not None:
+        if tess_won:
+            lines = tess_job.items
+            lines_factor = decode_factor
+            stages['crops_skipped'] += stages['crops_selected']
+            stages['crops_selected'] = 0
+            stages['tesseract_fallback'] = True
+            stages['tesseract_race'] = 'won'
+        else:
+            lines = settle_tesseract_race(tess_job, lines, stages, warnings)
+            if stages.get('tesseract_fallback'):
+                lines_factor = decode_factor
+        timer.lap('tesseract')
+
+    # If result is very small (1 line) try full-page fallback with Tesseract
+    if len(lines) <= 1 and tess_job is None:
+        t_lines, t_err = run_tesseract_fullpage(orig_img)
+        if t_lines:
+            lines = t_lines
+            lines_factor = decode_factor
+            stages['tesseract_fallback'] = True
+        else:
+            warnings.append(f"tesseract fallback failed: {t_err}")
+        timer.lap('tesseract')
+
+    # If still empty, return raw for debugging
+    if not lines:
+        payload = {
+            'lines': [],
+            'warning': 'No text lines extracted. Raw result included for debugging.',
+            'raw': make_serializable(raw_result),
+            'stages': stages
+        }
+    else:
+        payload = {'lines': make_serializable(lines), 'stages': stages}
+    if lines_factor != 1.0:
+        rescale_payload_boxes(payload, lines_factor)
+    fields = {}
+    if options['field_extraction'] == 'on' and lines:
+        fields = extract_license_fields(payload['lines'])
+        stages['fields_page'] = len(fields)
+        timer.lap('fields')
+    if card_fields:
+        # template reads that passed a format check beat the page lines, which fill in the rest
+        checked = {name: f for name, f in card_fields.items() if f['valid'] and name in LICENSE_CHECKED_FIELDS}
+        if decode_factor != 1.0:
+            rescale_boxes(checked.values(), decode_factor)
+        fields.update(checked)
+    if fields:
+        payload['fields'] = fields
+    timer.lap('serialize')
+    return payload
+
+
+def read_source_bytes(source):
+    """
+    Return the raw bytes of an upload given as a path or bytes.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    with open(source, 'rb') as fh:
+        return fh.read()
+
+
+_MODEL_VERSION = None
+
+
+def model_version():
+    """
+    Installed paddleocr/paddlepaddle versions, read from package metadata so the model isn't loaded.
+    """
+    global _MODEL_VERSION
+    if _MODEL_VERSION is None:
+        try:
+            from importlib.metadata import version as pkg_version
+        except Exception:
+            pkg_version = None
+        parts = []
+        for dist in ('paddleocr', 'paddlepaddle'):
+            try:
+                parts.append(f"{dist}={pkg_version(dist)}")
+            except Exception:
+                parts.append(f"{dist}=unknown")
+        _MODEL_VERSION = ','.join(parts)
+    return _MODEL_VERSION
+
+
+def cache_key(image_bytes, lang, use_cls, options):
+    """
+    Content address for a scan: hash of the image bytes plus everything that changes the output.
+    """
+    params = {
+        'lang': lang,
+        'use_cls': bool(use_cls),
+        'options': options,
+        'preprocess': PAGE_PREPROCESS,
+        'pyramid': DETECT_PYRAMID if options.get('detect_mode') == 'pyramid' else None,
+        'tiling': TILING if options.get('detect_mode') == 'tiled' or options.get('memory_budget_mb') else None,
+        'template': LICENSE_TEMPLATE if options.get('profile') == 'license' else None,
+        'labels': LICENSE_LABELS if options.get('field_extraction') == 'on' else None,
+        'model': model_version(),
+    }
+    h = hashlib.sha256(image_bytes)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+class OcrResultCache:
+    """
+    Two-tier cache of scan payloads keyed by cache_key().
+    The memory tier (LRU, max_entries) only pays off in a long-lived process (--server); the disk tier
+    stores one JSON file per key under cache_dir and evicts least recently used files past max_bytes.
+    Safe to share between the inference threads of the job server (--listen). Payloads are copied on
+    the way in and out, so a caller editing its result can't change what later hits get.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=200 * 1024 * 1024, max_entries=0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+        Return (payload, tier) on a hit, (None, None) on a miss.
+        """
+        with self._lock:
+            payload = self.memory.get(key)
+            if payload is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+        if payload is not None:
+            return copy.deepcopy(payload), 'memory'
+        if self.cache_dir:
+            path = self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as fh:
+                    payload = json.load(fh)
+                try:
+                    os.utime(path, None)  # mtime doubles as LRU clock
+                except Exception:
+                    pass
+                self._remember(key, copy.deepcopy(payload))
+                with self._lock:
+                    self.hits += 1
+                return payload, 'disk'
+            except Exception:
+                pass
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def put(self, key, payload):
+        # errors may be transient (model init, decode), never cache them
+        if 'error' in payload:
+            return
+        self._remember(key, copy.deepcopy(payload))
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._disk_bytes is not None:
+                    self._disk_bytes += len(data)
+                self._evict_disk()
+        except Exception as e:
+            log_event('cache_write_failed', detail=str(e))
+
+    def _remember(self, key, payload):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self.memory[key] = payload
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def _disk_entries(self):
+        entries = []
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_disk(self):
+        if self._disk_bytes is not None and self._disk_bytes <= self.max_bytes:
+            return
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            # trim to 90% so we don't rescan the directory on every write
+            target = int(self.max_bytes * 0.9)
+            for _mtime, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                    total -= size
+                except OSError:
+                    pass
+        self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'memory_entries': len(self.memory),
+                    'dir': self.cache_dir}
+
+
+def cached_scan(cache, ocr_factory, source, lang, use_cls=True, options=None, timer=None, metrics=None,
+                on_event=None):
+    """
+    scan_image behind the result cache. ocr_factory(lang, profile=...) is only called on a miss, once
+    the image passed scan_image's cheap checks, so a repeat scan or a refused photo in a one-shot process
+    never imports paddle or builds the model. Adds a 'cache' block to the payload, and an 'inference'
+    block (inference_settings()) to every scan that ran the model.
+    timer/metrics/on_event are passed through to scan_image (a hit sends its lines as one 'lines'
+    event, stage 'cache', so streaming clients see the same sequence either way). metrics also gets
+    cache_hit, model_init_ms and, for the scan that imported paddle, cold_start (startup_report() +
+    model_init_ms).
+    """
+    options = resolve_scan_options(options)
+    metrics = metrics if metrics is not None else {}
+
+    def build_ocr():
+        started = time.perf_counter()
+        cold = 'PaddleOCR' not in _PADDLE
+        ocr = ocr_factory(lang, profile=options['inference_profile'])
+        metrics['inference_profile'] = options['inference_profile']
+        metrics['model_init_ms'] = round((time.perf_counter() - started) * 1000.0, 2)
+        if cold and 'PaddleOCR' in _PADDLE:
+            # this scan paid for importing paddle
+            metrics['cold_start'] = dict(startup_report(), model_init_ms=metrics['model_init_ms'])
+        return ocr
+
+    def scan(image):
+        payload = scan_image(None, image, use_cls=use_cls, options=options, timer=timer, metrics=metrics,
+                             ocr_factory=build_ocr, on_event=on_event)
+        if 'inference_profile' in metrics and 'error' not in payload:
+            payload['inference'] = inference_settings(lang, options['inference_profile'])
+        return payload
+
+    if cache is None:
+        return scan(source)
+    try:
+        image_bytes = read_source_bytes(source)
+    except Exception as e:
+        return {'error': 'Image not found', 'path': source, 'detail': str(e)}
+
+    key = cache_key(image_bytes, lang, use_cls, options)
+    payload, tier = cache.get(key)
+    metrics['cache_hit'] = payload is not None
+    if payload is not None:
+        payload['cache'] = {'hit': True, 'tier': tier, 'key': key}
+        if on_event is not None and 'lines' in payload:
+            LineStream(payload['lines'], on_event).first_pass(payload.get('fields'), stage='cache')
+        return payload
+
+    payload = scan(image_bytes)
+    cache.put(key, payload)
+    payload['cache'] = {'hit': False, 'key': key}
+    return payload
+
+
+METRICS_MODES = ('off', 'summary', 'profile')
+
+
+def build_metrics_record(payload, timer, metrics, total_ms, context=None):
+    """
+    One flat, aggregatable record describing a scan.
+    """
+    stages = payload.get('stages') or {}
+    record = {'event': 'ocr_metrics'}
+    record.update(context or {})
+    record.update({
+        'total_ms': round(total_ms, 2),
+        'stages_ms': {name: round(ms, 2) for name, ms in timer.stages.items()},
+        'model_init_ms': metrics.get('model_init_ms'),
+        'image_width': metrics.get('image_width'),
+        'image_height': metrics.get('image_height'),
+        'detect_width': metrics.get('detect_width'),
+        'detect_height': metrics.get('detect_height'),
+        'detections': stages.get('detections'),
+        'crops': stages.get('crops_selected'),
+        'lines': len(payload.get('lines') or []),
+        'cache_hit': metrics.get('cache_hit'),
+        'inference_profile': metrics.get('inference_profile'),
+        'fallback_used': bool(stages.get('tesseract_fallback')),
+        'tesseract_race': stages.get('tesseract_race'),
+        'peak_rss_mb': peak_rss_mb(),
+        'error': payload.get('error'),
+    })
+    if metrics.get('cold_start'):
+        record['cold_start'] = metrics['cold_start']
+    if metrics.get('quality'):
+        record['quality'] = metrics['quality']
+    if metrics.get('warnings'):
+        record['warnings'] = metrics['warnings']
+    return record
+
+
+def profile_summary(profiler, top=15):
+    """
+    Top functions by cumulative time from a cProfile.Profile, as JSON-friendly dicts.
+    """
+    import pstats
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, lineno, func), (cc, nc, tt, ct, _callers) in stats.stats.items():
+        rows.append({'func': f"{os.path.basename(filename)}:{lineno}({func})", 'calls': nc,
+                     'tot_ms': round(tt * 1000.0, 2), 'cum_ms': round(ct * 1000.0, 2)})
+    rows.sort(key=lambda r: r['cum_ms'], reverse=True)
+    return rows[:top]
+
+
+def instrumented_scan(mode, scan_fn, context=None, profile_dir=None, timer=None):
+    """
+    Run scan_fn(timer, metrics) -> payload under a metrics mode and return the payload.
+    A timer passed in (e.g. a DeadlineTimer) is used in every mode, otherwise one is only made when
+    metrics are on.
+      off      no instrumentation output
+      summary  one {"event": "ocr_metrics", ...} JSON line on stderr per scan
+      profile  summary plus a cProfile dump (<profile_dir>/paddle_scan-<pid>-<ms>.prof, readable
+               with pstats/snakeviz) and the hottest functions inlined in the record
+    """
+    if mode not in ('summary', 'profile'):
+        return scan_fn(timer, None)
+
+    timer = timer if timer is not None else StageTimer()
+    metrics = {}
+    profiler = None
+    if mode == 'profile':
+        import cProfile
+        profiler = cProfile.Profile()
+    started = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        payload = scan_fn(timer, metrics)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    total_ms = (time.perf_counter() - started) * 1000.0
+
+    record = build_metrics_record(payload, timer, metrics, total_ms, context)
+    if profiler is not None:
+        try:
+            out_dir = profile_dir or tempfile.gettempdir()
+            os.makedirs(out_dir, exist_ok=True)
+            path = os.path.join(out_dir, f"paddle_scan-{os.getpid()}-{int(time.time() * 1000)}.prof")
+            profiler.dump_stats(path)
+            record['profile'] = {'path': path, 'top': profile_summary(profiler)}
+        except Exception as e:
+            record['profile'] = {'error': str(e)}
+    log_event(record.pop('event'), **record)
+    return payload
+
+
+OUTPUT_FORMATS = ('json', 'compact')
+
+
+def encode_compact(payload):
+    """
+    Columnar form of a scan payload: 'texts' and 'confidences' as parallel arrays and every box
+    in one base64 little-endian int32 array of shape (count, 4, 2). Lines without a box are listed
+    in 'boxes_missing' (their slots are zero): coordinates may be negative for boxes slightly off-page.
+    Other per-line keys (e.g. 'field') become parallel arrays under 'columns'. The remaining
+    payload keys pass through unchanged, except the debugging 'raw' dump which is dropped.
+    """
+    lines = payload.get('lines')
+    out = {k: v for k, v in payload.items() if k not in ('lines', 'raw')}
+    if lines is None:
+        return out
+    count = len(lines)
+    boxes = np.zeros((count, 4, 2), dtype='<i4')
+    missing = []
+    texts, confidences = [], []
+    extra_keys = sorted({k for item in lines for k in item} - {'text', 'confidence', 'box'})
+    columns = {k: [] for k in extra_keys}
+    for i, item in enumerate(lines):
+        texts.append(item.get('text'))
+        try:
+            confidences.append(round(float(item.get('confidence')), 4))
+        except (TypeError, ValueError):
+            confidences.append(None)
+        points = box_points(item.get('box'))
+        if len(points) != 4:
+            rect = box_rect(item.get('box'))
+            points = [(rect[0], rect[1]), (rect[2], rect[1]), (rect[2], rect[3]), (rect[0], rect[3])] if rect else []
+        if points:
+            boxes[i] = np.rint(np.asarray(points, dtype=np.float64))
+        else:
+            missing.append(i)
+        for k in extra_keys:
+            columns[k].append(item.get(k))
+    out.update({
+        'format': 'compact',
+        'count': count,
+        'texts': texts,
+        'confidences': confidences,
+        'boxes': base64.b64encode(boxes.tobytes()).decode('ascii'),
+        'boxes_dtype': '<i4',
+        'boxes_shape': [count, 4, 2],
+        'boxes_missing': missing,
+    })
+    if columns:
+        out['columns'] = columns
+    return out
+
+
+def decode_compact(payload):
+    """
+    Inverse of encode_compact: rebuild the {'lines': [{'text', 'confidence', 'box'}, ...]} shape.
+    """
+    if payload.get('format') != 'compact':
+        return payload
+    out = {k: v for k, v in payload.items()
+           if k not in ('format', 'count', 'texts', 'confidences', 'boxes', 'boxes_dtype', 'boxes_shape',
+                        'boxes_missing', 'columns')}
+    count = payload['count']
+    boxes = np.frombuffer(base64.b64decode(payload['boxes']), dtype=payload.get('boxes_dtype', '<i4'))
+    boxes = boxes.reshape(payload.get('boxes_shape') or (count, 4, 2))
+    columns = payload.get('columns') or {}
+    missing = set(payload.get('boxes_missing') or ())
+    lines = []
+    for i in range(count):
+        item = {'text': payload['texts'][i], 'confidence': payload['confidences'][i],
+                'box': None if i in missing else boxes[i].tolist()}
+        for k, values in columns.items():
+            item[k] = values[i]
+        lines.append(item)
+    out['lines'] = lines
+    return out
+
+
+def dump_payload(payload, fmt='json'):
+    """
+    One-line JSON text for a payload in the requested output format.
+    """
+    if fmt == 'compact':
+        return json.dumps(encode_compact(payload), ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def open_protocol_stream():
+    """
+    Reserve the real stdout for protocol messages and point fd 1 at stderr, so model download
+    progress or native library logs printed to stdout can never corrupt the JSON stream.
+    """
+    sys.stdout.flush()
+    proto_fd = os.dup(1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    return os.fdopen(proto_fd, 'w', buffering=1, encoding='utf-8')
+
+
+def parse_scan_request(req, default_lang='en', default_use_cls=True, default_options=None):
+    """
+    Validate a scan request of the --server/--listen protocol.
+    Returns ((source, lang, use_cls, options), None), or (None, error_payload) for a bad request.
+    """
+    source = req.get('path')
+    if req.get('image_b64'):
+        try:
+            source = base64.b64decode(req['image_b64'], validate=True)
+        except Exception as e:
+            return None, {'error': 'Invalid image_b64', 'detail': str(e)}
+    if not source:
+        return None, {'error': 'No image path provided'}
+    lang = req.get('lang') or default_lang
+    use_cls = bool(req.get('use_cls', default_use_cls))
+    try:
+        options = resolve_scan_options({**(default_options or {}), **req})
+    except ValueError as e:
+        return None, {'error': 'Invalid options', 'detail': str(e)}
+    return (source, lang, use_cls, options), None
+
+
+def serve(default_lang='en', default_use_cls=True, preload_langs=None, default_options=None, cache=None,
+          metrics_mode='off', profile_dir=None, output_format='json'):
+    """
+    Long-lived worker mode: read line-delimited JSON requests on stdin and write one JSON
+    response per line on stdout. PaddleOCR instances stay warm between requests.
+
+    Requests:
+      {"id": ..., "op": "scan", "path": "/tmp/x.jpg", "lang": "en", "use_cls": true}
+        ("image_b64": "<base64 image bytes>" may be sent instead of "path")
+        (any DEFAULT_SCAN_OPTIONS key, e.g. "crop_mode", may be given per request)
+        ("stream": true first sends {"event": "lines"} / {"event": "refine"} messages with the same id,
+         see scan_image, and marks the final payload "event": "done")
+      {"id": ..., "op": "ping"}
+      {"id": ..., "op": "shutdown"}
+    Responses echo "id". A scan answers with the same payload as the one-shot CLI
+    ({"lines": [...]} or {"error": ...}); ping answers {"event": "pong", "ready": true, ...}.
+    On startup, once the preloaded models are built, {"event": "ready", ...} is emitted.
+    With metrics_mode other than 'off', one ocr_metrics record per scan goes to stderr.
+    """
+    out = open_protocol_stream()
+
+    def send(payload):
+        out.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        out.flush()
+
+    served = 0
+    try:
+        profile = resolve_scan_options(default_options)['inference_profile']
+        for lang in (preload_langs or [default_lang]):
+            get_ocr(lang, profile=profile)
+    except Exception as e:
+        send({'event': 'error', 'error': 'Failed to initialize PaddleOCR', 'detail': str(e)})
+        return 3
+
+    send(dict({'event': 'ready', 'pid': os.getpid(), 'langs': loaded_langs(), 'inference_profile': profile},
+              **startup_report()))
+
+    for raw_line in sys.stdin:
+        raw_line = raw_line.strip()
+        if not raw_line:
+            continue
+        try:
+            req = json.loads(raw_line)
+            if not isinstance(req, dict):
+                raise ValueError('request must be a JSON object')
+        except Exception as e:
+            send({'error': 'Invalid request', 'detail': str(e)})
+            continue
+
+        req_id = req.get('id')
+        op = req.get('op', 'scan')
+        if op == 'ping':
+            send({'id': req_id, 'event': 'pong', 'ready': True, 'pid': os.getpid(),
+                  'langs': loaded_langs(), 'served': served,
+                  'cache': cache.stats() if cache is not None else None})
+            continue
+        if op == 'shutdown':
+            send({'id': req_id, 'event': 'bye', 'served': served})
+            break
+        if op != 'scan':
+            send({'id': req_id, 'error': 'Unknown op', 'op': op})
+            continue
+
+        args, error = parse_scan_request(req, default_lang, default_use_cls, default_options)
+        if error:
+            error['id'] = req_id
+            send(error)
+            continue
+        source, lang, use_cls, options = args
+        stream = bool(req.get('stream'))
+        on_event = (lambda event: send(dict(event, id=req_id))) if stream else None
+        try:
+            payload = instrumented_scan(
+                metrics_mode,
+                lambda timer, metrics: cached_scan(cache, get_ocr, source, lang, use_cls=use_cls,
+                                                   options=options, timer=timer, metrics=metrics, on_event=on_event),
+                context={'id': req_id, 'lang': lang}, profile_dir=profile_dir,
+            )
+        except Exception as e:
+            payload = {'error': 'OCR failed', 'detail': str(e)}
+        served += 1
+        payload['id'] = req_id
+        if stream:
+            payload['event'] = 'done'
+        fmt = req.get('format') or output_format
+        if fmt == 'compact':
+            payload = encode_compact(payload)
+        send(payload)
+
+    return 0
+
+
+def env_inference_profile():
+    """
+    $OCR_INFERENCE_PROFILE, or None when unset or not an INFERENCE_PROFILES name (warned on stderr, so a
+    typo in the server's env doesn't fail every scan with argparse's exit code).
+    """
+    value = os.environ.get('OCR_INFERENCE_PROFILE') or None
+    if value is not None and value not in INFERENCE_PROFILES:
+        sys.stderr.write(f"ignoring invalid OCR_INFERENCE_PROFILE={value!r}, "
+                         f"expected one of: {', '.join(INFERENCE_PROFILES)}\n")
+        return None
+    return value
+
+
+def parse_args(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Run PaddleOCR on an image and print the text lines as JSON.')
+    parser.add_argument('image', nargs='?', help="path to the image to scan, or '-' to read image bytes from stdin")
+    parser.add_argument('--lang', '-l', default='en', help='PaddleOCR language (default: en)')
+    parser.add_argument('--no-cls', dest='use_cls', action='store_false', help='disable the angle classifier')
+    parser.add_argument('--crop-mode', choices=('rec', 'full'), default=None,
+                        help="second pass over detected boxes: 'rec' batches crops through the recognizer only, "
+                             "'full' re-runs detection+recognition per crop (default: rec)")
+    parser.add_argument('--crop-batch-size', type=int, default=None,
+                        help='crops per recognizer call in rec mode (default: 16)')
+    parser.add_argument('--crop-select', choices=('all', 'gated'), default=None,
+                        help="which detections get a crop re-read: 'all' (default) or 'gated' "
+                             "(low confidence, very short text, near-miss license/date patterns)")
+    parser.add_argument('--crop-min-confidence', type=float, default=None,
+                        help='gated: re-read first-pass lines scoring below this (default: 0.85)')
+    parser.add_argument('--crop-short-text', type=int, default=None,
+                        help='gated: re-read lines with at most this many characters (default: 3)')
+    parser.add_argument('--detect-mode', choices=('auto', 'full', 'pyramid', 'tiled'), default=None,
+                        help="page detection: 'auto' is 'full' but tiles long receipts and pages over the memory "
+                             "budget (default), 'full' runs one pass at the full 3200px preprocessing size, "
+                             "'pyramid' reads a downscaled page first and only revisits the text region at higher "
+                             "resolution when the text is small, 'tiled' reads overlapping tiles one at a time")
+    parser.add_argument('--memory-budget-mb', type=float, default=None,
+                        help="per-scan memory target: with --detect-mode auto long receipts and pages too big "
+                             "for one pass are tiled; huge photos are decoded downscaled (default: 1024, 0 = no budget)")
+    parser.add_argument('--profile', choices=tuple(DOCUMENT_PROFILES), default=None,
+                        help="document type: 'license' reads the LTO card's field boxes directly and returns them "
+                             "under 'fields', 'receipt' tunes the page pipeline for receipts (default: generic)")
+    parser.add_argument('--fallback-mode', choices=('race', 'sequential'), default=None,
+                        help="Tesseract fallback: 'sequential' only runs it after Paddle (default), 'race' starts it "
+                             "next to Paddle when the first pass looks weak and keeps whichever result is usable first")
+    parser.add_argument('--quality-gate', choices=('on', 'off'), default=None,
+                        help="reject blurry, dark, tiny or empty photos before running OCR "
+                             "(default: off, on for the license and receipt profiles)")
+    parser.add_argument('--inference-profile', choices=tuple(INFERENCE_PROFILES),
+                        default=env_inference_profile(),
+                        help="models and CPU settings: 'fast' = mobile models, detection capped at 960px, 4 threads; "
+                             "'balanced' = paddleocr's defaults for the language (default); 'accurate' = server "
+                             "models at full resolution. Reported as 'inference' in every scan")
+    parser.add_argument('--field-extraction', choices=('on', 'off'), default=None,
+                        help="also return license 'fields' found by label position on the page lines, each with a "
+                             "confidence (default: on for --profile license, off otherwise)")
+    parser.add_argument('--stream', action='store_true',
+                        help='print NDJSON as the scan goes: the first-pass lines ({"event": "lines"}), crop re-reads '
+                             'that replace them by id ({"event": "refine"}), then the result ({"event": "done"}); '
+                             '"stream": true does the same per --server/--listen request')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='json',
+                        help="output shape: 'json' = {'lines': [...]} (default), 'compact' = parallel texts/confidences "
+                             "arrays plus all boxes as one base64 int32 array; also a --server request field")
+    parser.add_argument('--cache-dir', default=os.environ.get('OCR_CACHE_DIR'),
+                        help='directory for the on-disk OCR result cache (default: $OCR_CACHE_DIR, unset = no disk cache)')
+    parser.add_argument('--cache-max-mb', type=float, default=200,
+                        help='disk cache size budget in MB, least recently used entries are evicted (default: 200)')
+    parser.add_argument('--cache-mem-entries', type=int, default=256,
+                        help='in-memory cache entries kept by --server (default: 256)')
+    parser.add_argument('--no-cache', action='store_true', help='disable the OCR result cache')
+    parser.add_argument('--metrics', choices=METRICS_MODES, default=os.environ.get('OCR_METRICS', 'off'),
+                        help="per-scan instrumentation on stderr: 'off', 'summary' (one ocr_metrics JSON line) or "
+                             "'profile' (summary + cProfile dump) (default: $OCR_METRICS or off)")
+    parser.add_argument('--profile-dir', default=os.environ.get('OCR_PROFILE_DIR'),
+                        help='where --metrics profile writes .prof files (default: $OCR_PROFILE_DIR or the temp dir)')
+    parser.add_argument('--model-dir', default=os.environ.get('OCR_MODEL_DIR'),
+                        help='keep downloaded models in this directory and load them from there '
+                             '(default: $OCR_MODEL_DIR, unset = ~/.paddlex)')
+    parser.add_argument('--check', action='store_true',
+                        help='print a JSON pre-flight report (dependencies, Tesseract, cached models) without '
+                             'importing paddle or loading a model; exit code 4 when a dependency is missing')
+    parser.add_argument('--batch', action='append', metavar='DIR|GLOB|MANIFEST',
+                        help='scan many images (directory, glob, or manifest file with one path per line / JSON list); '
+                             'repeatable. Streams one JSON line per image')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes for --batch (default: min(4, cpu count)) or inference threads for '
+                             '--listen (default: 2); each holds its own model')
+    parser.add_argument('--server', action='store_true',
+                        help='keep the model warm and serve line-delimited JSON requests on stdin/stdout')
+    parser.add_argument('--listen', default=os.environ.get('OCR_LISTEN'), metavar='unix:PATH|HOST:PORT',
+                        help='run the shared job server: the --server protocol over a Unix socket or local TCP port, '
+                             'with a bounded queue, per-job deadlines and busy replies (default: $OCR_LISTEN)')
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help='--listen: scans allowed to wait for a worker before new ones get a busy reply (default: 16)')
+    parser.add_argument('--job-timeout', type=float, default=30.0,
+                        help='--listen: seconds a scan may take from submission, unless the request sets timeout_ms '
+                             '(default: 30)')
+    parser.add_argument('--preload', default=None,
+                        help='comma separated langs to load before reporting ready in --server/--listen mode '
+                             '(default: --lang)')
+    args = parser.parse_args(argv)
+    if args.stream and args.batch:
+        parser.error('--stream applies to single scans, --batch already prints one line per image')
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args.model_dir:
+        # also inherited by --batch worker processes
+        os.environ['OCR_MODEL_DIR'] = args.model_dir
+
+    if args.check:
+        report = preflight_check()
+        print(json.dumps(report))
+        sys.exit(0 if report['ok'] else EXIT_MISSING_DEPENDENCY)
+
+    overrides = {
+        'crop_mode': args.crop_mode,
+        'crop_batch_size': args.crop_batch_size,
+        'crop_select': args.crop_select,
+        'crop_min_confidence': args.crop_min_confidence,
+        'crop_short_text': args.crop_short_text,
+        'detect_mode': args.detect_mode,
+        'memory_budget_mb': args.memory_budget_mb,
+        'profile': args.profile,
+        'fallback_mode': args.fallback_mode,
+        'quality_gate': args.quality_gate,
+        'field_extraction': args.field_extraction,
+        'inference_profile': args.inference_profile,
+    }
+    options = resolve_scan_options(overrides)
+
+    cache = None
+    long_lived = bool(args.server or args.listen)
+    if not args.no_cache and (args.cache_dir or long_lived):
+        cache = OcrResultCache(
+            cache_dir=args.cache_dir,
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+            # a one-shot process exits right away, only the disk tier helps there
+            max_entries=args.cache_mem_entries if long_lived else 0,
+        )
+
+    if args.batch:
+        from ocr_batch import run_batch
+        sys.exit(run_batch(args.batch, workers=args.workers, lang=args.lang, use_cls=args.use_cls, options=options,
+                           cache_dir=None if args.no_cache else args.cache_dir,
+                           cache_max_bytes=int(args.cache_max_mb * 1024 * 1024),
+                           metrics_mode=args.metrics, profile_dir=args.profile_dir, output_format=args.format))
+
+    if args.listen:
+        from ocr_job_server import serve_jobs
+        preload = [l.strip() for l in (args.preload or args.lang).split(',') if l.strip()]
+        sys.exit(serve_jobs(args.listen, workers=args.workers, queue_size=args.queue_size,
+                            job_timeout=args.job_timeout, default_lang=args.lang, default_use_cls=args.use_cls,
+                            preload_langs=preload, default_options=overrides, cache=cache,
+                            metrics_mode=args.metrics, profile_dir=args.profile_dir, output_format=args.format))
+
+    if args.server:
+        preload = [l.strip() for l in (args.preload or args.lang).split(',') if l.strip()]
+        sys.exit(serve(default_lang=args.lang, default_use_cls=args.use_cls, preload_langs=preload,
+                       default_options=overrides, cache=cache, metrics_mode=args.metrics,
+                       profile_dir=args.profile_dir, output_format=args.format))
+
+    if not args.image:
+        print(json.dumps({'error': 'No image path provided'}))
+        sys.exit(1)
+
+    if args.image == '-':
+        # image bytes piped on stdin, no upload temp file needed
+        source = sys.stdin.buffer.read()
+        if not source:
+            print(json.dumps({'error': 'No image data on stdin'}))
+            sys.exit(1)
+    else:
+        source = args.image
+        if not os.path.exists(source):
+            print(json.dumps({'error': 'Image not found', 'path': source}))
+            sys.exit(1)
+
+    on_event = (lambda event: print(json.dumps(event, ensure_ascii=False), flush=True)) if args.stream else None
+    try:
+        payload = instrumented_scan(
+            args.metrics,
+            lambda timer, metrics: cached_scan(cache, create_ocr, source, args.lang, use_cls=args.use_cls,
+                                               options=options, timer=timer, metrics=metrics, on_event=on_event),
+            context={'lang': args.lang, 'path': source if isinstance(source, str) else '-'},
+            profile_dir=args.profile_dir,
+        )
+    except MissingDependency as e:
+        print(json.dumps(e.payload))
+        sys.exit(EXIT_MISSING_DEPENDENCY)
+    if args.stream:
+        payload['event'] = 'done'
+    print(dump_payload(payload, args.format))
+    if 'error' in payload:
+        sys.exit(3)
 
 
 if __name__ == '__main__':
+    # ocr_job_server and ocr_batch import paddle_scan: let them share this module instead of loading a second copy
+    sys.modules.setdefault('paddle_scan', sys.modules[__name__])
     main()
@@ -0,0 +1,5 @@
+# The OCR scripts are run from server/ocr, not installed: make them importable as top-level modules.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,31 @@
+import json
+import os
+
+from ocr_batch import resolve_batch_inputs
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return path
+
+
+def test_resolves_directories_manifests_and_globs_once(tmp_path):
+    a = touch(str(tmp_path / 'imgs' / 'a.jpg'))
+    b = touch(str(tmp_path / 'imgs' / 'b.PNG'))
+    touch(str(tmp_path / 'imgs' / 'notes.txt'))
+    c = touch(str(tmp_path / 'deep' / 'x' / 'c.jpeg'))
+    manifest = tmp_path / 'list.txt'
+    manifest.write_text('# uploads\nimgs/b.PNG\n\ndeep/x/c.jpeg\n', encoding='utf-8')
+    listing = tmp_path / 'list.json'
+    listing.write_text(json.dumps([a]), encoding='utf-8')
+
+    paths = resolve_batch_inputs([str(tmp_path / 'imgs'), str(manifest), str(listing),
+                                  str(tmp_path / '**' / '*.jpeg')])
+
+    assert [os.path.normcase(os.path.abspath(p)) for p in paths] == \
+        [os.path.normcase(os.path.abspath(p)) for p in (a, b, c)]
+
+
+def test_unmatched_specs_resolve_to_nothing(tmp_path):
+    assert resolve_batch_inputs([str(tmp_path / 'missing' / '*.jpg')]) == []
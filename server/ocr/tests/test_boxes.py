@@ -0,0 +1,67 @@
+import numpy as np
+
+from ocr_boxes import BoxIndex, box_points, box_rect, merge_lines, reading_order, rect_iou
+
+
+def line(text, x0, y0, x1, y1, confidence=0.9):
+    return {'text': text, 'confidence': confidence, 'box': [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]}
+
+
+def test_box_points_accepts_arrays_and_flat_rects():
+    assert box_points(np.array([[1, 2], [5, 2], [5, 8], [1, 8]], dtype=np.float32)) == \
+        [(1.0, 2.0), (5.0, 2.0), (5.0, 8.0), (1.0, 8.0)]
+    assert box_points((1, 2, 5, 8)) == [(1, 2), (5, 2), (5, 8), (1, 8)]
+    assert box_rect([np.array([3, 4]), np.array([9, 1])]) == (3.0, 1.0, 9.0, 4.0)
+    assert box_rect(None) is None
+
+
+def test_rect_iou():
+    assert rect_iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1.0
+    assert rect_iou((0, 0, 10, 10), (5, 0, 15, 10)) == 50 / 150
+    assert rect_iou((0, 0, 10, 10), (10, 0, 20, 10)) == 0.0
+
+
+def test_box_index_finds_only_intersecting_rects():
+    index = BoxIndex(cell=10)
+    a = index.add((0, 0, 30, 8))
+    b = index.add((100, 100, 130, 108))
+    c = index.add((25, 4, 60, 12))
+    assert sorted(index.overlapping((20, 2, 40, 6))) == [a, c]
+    assert list(index.overlapping((200, 200, 210, 210))) == []
+    assert index.best_overlap((101, 100, 131, 108)) == b
+    # touching edges do not overlap, and a weak overlap is below the threshold
+    assert index.best_overlap((30, 0, 40, 8)) is None
+    assert index.best_overlap((20, 0, 50, 8), min_iou=0.5) is None
+
+
+def test_merge_prefers_confident_crop_reads_and_keeps_repeated_text():
+    first = [
+        line('T0TAL', 10, 100, 80, 120, 0.6),
+        line('1.00', 200, 40, 240, 60, 0.95),
+        line('1.00', 200, 140, 240, 160, 0.95),  # same text, different row: kept
+        line('1.00', 201, 141, 241, 161, 0.8),   # same region read twice: dropped
+    ]
+    crops = [
+        line('TOTAL', 11, 101, 81, 121, 0.92),   # replaces the weak first-pass read
+        line('1.OO', 200, 40, 240, 60, 0.5),     # less confident than what is kept
+        line('CASH', 10, 180, 60, 200, 0.9),     # nothing there yet: added
+    ]
+    lines, counts = merge_lines(first, crops)
+
+    assert [l['text'] for l in lines] == ['1.00', 'TOTAL', '1.00', 'CASH']
+    assert lines[2]['confidence'] == 0.95
+    assert counts == {'duplicates_dropped': 1, 'crop_replaced': 1, 'crop_lines_added': 1}
+
+
+def test_merge_dedups_boxless_lines_by_text():
+    first = [{'text': 'A', 'confidence': 0.9, 'box': None}, {'text': 'A', 'confidence': 0.8, 'box': None},
+             {'text': ' ', 'confidence': 0.9, 'box': None}]
+    lines, counts = merge_lines(first, [{'text': 'A', 'confidence': 0.99, 'box': None}])
+    assert lines == [first[0]]
+    assert counts['duplicates_dropped'] == 1
+
+
+def test_reading_order_groups_rows():
+    lines = [line('right', 300, 12, 360, 30), line('below', 10, 60, 80, 80), line('left', 10, 10, 80, 28),
+             {'text': 'no box', 'box': None}]
+    assert [l['text'] for l in reading_order(lines)] == ['left', 'right', 'below', 'no box']
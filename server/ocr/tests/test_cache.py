@@ -0,0 +1,78 @@
+import json
+import os
+
+import paddle_scan
+from paddle_scan import OcrResultCache, cache_key, cached_scan, resolve_scan_options
+
+
+def payload(text):
+    return {'lines': [{'text': text, 'confidence': 0.9, 'box': [[0, 0], [10, 0], [10, 5], [0, 5]]}]}
+
+
+def test_memory_tier_is_a_bounded_lru():
+    cache = OcrResultCache(max_entries=2)
+    cache.put('a', payload('a'))
+    cache.put('b', payload('b'))
+    assert cache.get('a')[1] == 'memory'  # a is now the most recent
+    cache.put('c', payload('c'))
+
+    assert list(cache.memory) == ['a', 'c']
+    assert cache.get('b') == (None, None)
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_errors_are_not_cached():
+    cache = OcrResultCache(max_entries=2)
+    cache.put('a', {'error': 'OCR failed'})
+    assert cache.get('a') == (None, None)
+
+
+def test_disk_tier_evicts_least_recently_used_past_max_bytes(tmp_path):
+    size = len(json.dumps(payload('k0')))
+    # room for three entries and a half, trimmed to 90% once exceeded
+    cache = OcrResultCache(cache_dir=str(tmp_path), max_bytes=int(size * 3.5))
+    keys = ['k0', 'k1', 'k2', 'k3']
+    for age, key in enumerate(keys[:3]):
+        cache.put(key, payload(key))
+        os.utime(cache._path(key), (1000 + age, 1000 + age))
+    assert all(os.path.exists(cache._path(key)) for key in keys[:3])
+
+    # reading k0 makes it recent, so the next write evicts k1 instead
+    assert cache.get('k0')[1] == 'disk'
+    cache.put('k3', payload('k3'))
+
+    assert [os.path.exists(cache._path(key)) for key in keys] == [True, False, True, True]
+
+
+def test_key_changes_with_anything_that_changes_the_output():
+    options = resolve_scan_options({})
+    base = cache_key(b'img', 'en', True, options)
+
+    assert cache_key(b'img', 'en', True, resolve_scan_options({})) == base
+    assert cache_key(b'img2', 'en', True, options) != base
+    assert cache_key(b'img', 'ch', True, options) != base
+    assert cache_key(b'img', 'en', False, options) != base
+    for override in ({'detect_mode': 'pyramid'}, {'profile': 'license'}, {'inference_profile': 'fast'},
+                     {'crop_select': 'gated'}, {'memory_budget_mb': 64}):
+        assert cache_key(b'img', 'en', True, resolve_scan_options(override)) != base, override
+
+
+def test_hits_are_copies(monkeypatch, tmp_path):
+    scans = []
+
+    def fake_scan(ocr, source, use_cls=True, options=None, timer=None, metrics=None, ocr_factory=None,
+                  on_event=None):
+        scans.append(source)
+        return payload('TOTAL')
+
+    monkeypatch.setattr(paddle_scan, 'scan_image', fake_scan)
+    for cache in (OcrResultCache(max_entries=4), OcrResultCache(cache_dir=str(tmp_path))):
+        first = cached_scan(cache, None, b'img', 'en')
+        first['lines'][0]['text'] = 'edited by the caller'
+        second = cached_scan(cache, None, b'img', 'en')
+        second['lines'].append({'text': 'appended'})
+        third = cached_scan(cache, None, b'img', 'en')
+
+        assert first['cache']['hit'] is False and third['cache']['hit'] is True
+        assert [l['text'] for l in third['lines']] == ['TOTAL']
+    assert len(scans) == 2
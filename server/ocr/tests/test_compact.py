@@ -0,0 +1,39 @@
+import base64
+
+import numpy as np
+
+from paddle_scan import decode_compact, encode_compact
+
+
+def test_round_trip_keeps_negative_and_missing_boxes():
+    payload = {
+        'lines': [
+            {'text': 'TOTAL', 'confidence': 0.91234, 'box': [[-3, 10], [80.6, 10], [80.6, 30], [-3, 30]]},
+            {'text': 'no box', 'confidence': None, 'box': None},
+            {'text': 'rect', 'confidence': '0.5', 'box': (1, 2, 5, 8), 'field': 'expiry'},
+        ],
+        'raw': [['debug']],
+        'engine': 'paddle',
+    }
+    compact = encode_compact(payload)
+
+    assert 'raw' not in compact and 'lines' not in compact
+    assert compact['engine'] == 'paddle'
+    assert compact['count'] == 3
+    assert compact['confidences'] == [0.9123, None, 0.5]
+    assert compact['boxes_missing'] == [1]
+    assert compact['columns'] == {'field': [None, None, 'expiry']}
+    boxes = np.frombuffer(base64.b64decode(compact['boxes']), dtype='<i4').reshape(3, 4, 2)
+    assert boxes[0].tolist() == [[-3, 10], [81, 10], [81, 30], [-3, 30]]
+
+    lines = decode_compact(compact)['lines']
+    assert lines[0]['box'] == [[-3, 10], [81, 10], [81, 30], [-3, 30]]
+    assert lines[1] == {'text': 'no box', 'confidence': None, 'box': None, 'field': None}
+    assert lines[2]['box'] == [[1, 2], [5, 2], [5, 8], [1, 8]]
+    assert lines[2]['field'] == 'expiry'
+
+
+def test_payloads_without_lines_pass_through():
+    assert encode_compact({'error': 'x', 'raw': 1}) == {'error': 'x'}
+    assert decode_compact({'lines': []}) == {'lines': []}
+    assert decode_compact(encode_compact({'lines': []}))['lines'] == []
@@ -0,0 +1,146 @@
+"""
+JobServer backpressure and deadlines, with the scan replaced by one that runs until released (or
+abandoned at its next lap), so no model is needed.
+"""
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import ocr_job_server
+from ocr_job_server import JobServer
+
+
+@pytest.fixture
+def release(monkeypatch):
+    """
+    Event that lets the fake scans finish; set on teardown so no inference thread is left waiting.
+    """
+    event = threading.Event()
+
+    def fake_scan(cache, ocr_factory, source, lang, use_cls=True, options=None, timer=None, metrics=None,
+                  on_event=None):
+        while not event.is_set():
+            timer.lap('wait')  # raises ScanCancelled once the job was abandoned
+            time.sleep(0.01)
+        return {'lines': [{'text': source, 'confidence': 0.9, 'box': None}]}
+
+    monkeypatch.setattr(ocr_job_server, 'cached_scan', fake_scan)
+    monkeypatch.setattr(ocr_job_server, 'get_thread_ocr', lambda lang='en', profile='balanced': object())
+    yield event
+    event.set()
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.received = []
+
+    async def send(self, **req):
+        self.writer.write((json.dumps(req) + '\n').encode('utf-8'))
+        await self.writer.drain()
+
+    async def wait_for(self, match, timeout=5.0):
+        """
+        First message (already received or arriving within timeout) for which match(msg) is true.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            for msg in self.received:
+                if match(msg):
+                    self.received.remove(msg)
+                    return msg
+            line = await asyncio.wait_for(self.reader.readline(), max(0.0, deadline - time.monotonic()))
+            assert line, 'server closed the connection'
+            self.received.append(json.loads(line))
+
+    async def wait_running(self, count):
+        for attempt in range(200):
+            await self.send(id='stats', op='stats')
+            stats = await self.wait_for(lambda m: m.get('event') == 'stats')
+            if stats['running'] == count:
+                return stats
+            await asyncio.sleep(0.01)
+        raise AssertionError(f"running never reached {count}: {stats}")
+
+
+def run_scenario(scenario, **kwargs):
+    """
+    Start a JobServer on a free local port, run scenario(client, server), then shut it down.
+    """
+    async def main():
+        server = JobServer(preload_langs=['en'], **kwargs)
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        task = asyncio.ensure_future(server.run(('tcp', '127.0.0.1', 0), ready.set_result))
+        event = await asyncio.wait_for(ready, 10)
+        assert event['event'] == 'ready', event
+        host, port = event['listen'].rsplit(':', 1)
+        client = Client(*await asyncio.open_connection(host, int(port)))
+        try:
+            await scenario(client, server)
+        finally:
+            await client.send(id='bye', op='shutdown')
+            assert await asyncio.wait_for(task, 10) == 0
+            client.writer.close()
+
+    asyncio.run(main())
+
+
+def test_full_queue_answers_busy(release):
+    async def scenario(client, server):
+        await client.send(id='a', path='a.jpg')
+        await client.wait_running(1)
+        await client.send(id='b', path='b.jpg')
+        await client.send(id='c', path='c.jpg')
+        busy = await client.wait_for(lambda m: m.get('id') == 'c')
+        assert busy['error'] == 'Server busy'
+        assert busy['busy'] is True
+        assert busy['queue_depth'] == 1 and busy['queue_size'] == 1
+
+        release.set()
+        for req_id in ('a', 'b'):
+            done = await client.wait_for(lambda m: m.get('id') == req_id)
+            assert done['lines'][0]['text'] == f"{req_id}.jpg"
+            assert 'queue_ms' in done['job'] and 'run_ms' in done['job']
+        assert server.counters['rejected_busy'] == 1
+        assert server.counters['completed'] == 2
+
+    run_scenario(scenario, workers=1, queue_size=1)
+
+
+def test_deadline_answers_and_abandons_the_scan(release):
+    async def scenario(client, server):
+        await client.send(id='slow', path='slow.jpg', timeout_ms=150)
+        reply = await client.wait_for(lambda m: m.get('id') == 'slow')
+        assert reply['error'] == 'Job timed out'
+        assert reply['timeout_ms'] == 150
+        # the scan stops at its next lap and frees the worker
+        await client.wait_running(0)
+        assert server.counters['timed_out'] == 1
+        assert server.counters['completed'] == 0
+
+    run_scenario(scenario, workers=1, queue_size=2)
+
+
+def test_cancel_running_and_queued_jobs(release):
+    async def scenario(client, server):
+        await client.send(id='run', path='run.jpg')
+        await client.wait_running(1)
+        await client.send(id='queued', path='queued.jpg')
+        for target in ('queued', 'run', 'unknown'):
+            await client.send(id=f"cancel-{target}", op='cancel', target=target)
+            ack = await client.wait_for(lambda m: m.get('id') == f"cancel-{target}")
+            assert ack['found'] is (target != 'unknown')
+        for target in ('queued', 'run'):
+            reply = await client.wait_for(lambda m: m.get('id') == target)
+            assert reply['error'] == 'Job cancelled'
+        await client.wait_running(0)
+        assert server.counters['cancelled'] == 2
+        # the queued job was never started
+        assert len(server.run_ms) == 1
+
+    run_scenario(scenario, workers=1, queue_size=2)
@@ -0,0 +1,116 @@
+import pytest
+from PIL import Image
+
+from ocr_license import (LICENSE_TEMPLATE, extract_license_fields, license_fields_trusted, normalize_license_field,
+                         read_card_fields)
+
+
+def line(text, x0, y0, x1, y1, confidence=0.95):
+    return {'text': text, 'confidence': confidence, 'box': [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]}
+
+
+def test_normalize_license_field():
+    assert normalize_license_field('license_number', 'lic n01 12 345678') == 'N01-12-345678'
+    assert normalize_license_field('expiry', 'EXP 2030-05-17') == '2030/05/17'
+    assert normalize_license_field('sex', 'female') == 'F'
+    assert normalize_license_field('blood_type', 'AB−') == 'AB-'
+    assert normalize_license_field('name', 'J.') is None
+    assert normalize_license_field('address', '  12 RIZAL ST ') == '12 RIZAL ST'
+    assert normalize_license_field('birthdate', '') is None
+
+
+def test_read_card_fields_reads_every_template_box_in_one_call():
+    card = Image.new('RGB', (1600, 1009), 'white')
+    reads = {'license_number': ('N01-12-345678', 0.97), 'expiry': ('2030/05/17', '0.9'), 'sex': ('X', None)}
+    calls = []
+
+    def recognize(crops, batch_size):
+        calls.append((len(crops), batch_size))
+        return [reads.get(name, (None, 0.1)) for name in LICENSE_TEMPLATE]
+
+    fields = read_card_fields(recognize, card, batch_size=8)
+
+    assert calls == [(len(LICENSE_TEMPLATE), 8)]
+    assert fields['license_number']['value'] == 'N01-12-345678'
+    assert fields['expiry']['confidence'] == 0.9
+    assert fields['sex'] == {'text': 'X', 'value': None, 'confidence': None, 'valid': False,
+                             'card_box': (688, 423, 800, 494), 'source': 'card'}
+    assert fields['name']['text'] == '' and not fields['name']['valid']
+    assert license_fields_trusted(fields)
+    assert read_card_fields(lambda crops, batch_size: None, card) is None
+
+
+# An LTO card read as page lines: header rows come back as one box with the values below them
+CARD_LINES = [
+    line('REPUBLIC OF THE PHILIPPINES', 400, 20, 1200, 60),
+    line("DRIVER'S LICENSE", 500, 70, 1000, 110),
+    line('Last Name, First Name, Middle Name', 450, 280, 1000, 310),
+    line('DELA CRUZ, JUAN SANTOS', 450, 315, 1100, 360, 0.93),
+    line('Nationality  Sex  Date of Birth  Weight (kg)  Height(m)', 450, 400, 1500, 430),
+    line('PHL  M  1990/05/17  70  1.70', 450, 435, 1500, 475, 0.9),
+    line('Address', 450, 500, 600, 530),
+    line('123 RIZAL ST BRGY SAN ROQUE', 450, 535, 1200, 575, 0.88),
+    line('MARIKINA CITY', 450, 580, 800, 620, 0.9),
+    line('License No.', 450, 640, 650, 670),
+    line('Expiration Date', 820, 640, 1080, 670),
+    line('Agency Code', 1110, 640, 1330, 670),
+    line('N01-12-345678', 450, 675, 790, 715, 0.97),
+    line('2030/05/17', 820, 675, 1070, 715, 0.96),
+    line('N01', 1110, 675, 1200, 715, 0.9),
+    line('Blood Type: O+', 450, 760, 700, 800, 0.9),
+    line('Restrictions', 900, 760, 1100, 790),
+    line('1,2', 900, 795, 980, 830, 0.85),
+    line('Conditions NONE', 1300, 760, 1560, 800),
+]
+
+
+def test_extract_license_fields_from_card_layout():
+    fields = extract_license_fields(CARD_LINES)
+    values = {name: (f['value'], f['anchor']) for name, f in fields.items()}
+
+    assert values == {
+        'name': ('DELA CRUZ, JUAN SANTOS', 'below'),
+        'nationality': ('PHL', 'below'),
+        'sex': ('M', 'below'),
+        'birthdate': ('1990/05/17', 'below'),
+        'address': ('123 RIZAL ST BRGY SAN ROQUE MARIKINA CITY', 'below'),
+        'license_number': ('N01-12-345678', 'below'),
+        'expiry': ('2030/05/17', 'below'),
+        'agency_code': ('N01', 'below'),
+        'blood_type': ('O+', 'label'),
+        'restrictions': ('1,2', 'below'),
+        'conditions': ('NONE', 'label'),
+    }
+    assert all(f['source'] == 'page' and f['valid'] for f in fields.values())
+    # score = line confidence x anchor weight
+    assert fields['license_number']['confidence'] == pytest.approx(0.97 * 0.9, abs=1e-3)
+    # the address spans both of its lines
+    assert fields['address']['box'] == [[450, 535], [1200, 535], [1200, 620], [450, 620]]
+
+
+def test_extract_license_fields_from_split_boxes():
+    fields = extract_license_fields([
+        line('License No.', 100, 100, 260, 130), line('N01-12-345678', 300, 100, 560, 135, 0.92),
+        line('Birth Date', 300, 160, 440, 190), line('1988-02-03', 460, 160, 640, 190, 0.9),
+        line('Sex M', 100, 220, 190, 250),
+        line('Blood Type', 100, 280, 250, 310), line('AB-', 110, 315, 170, 345, 0.8),
+    ])
+
+    assert {name: (f['value'], f['anchor']) for name, f in fields.items()} == {
+        'license_number': ('N01-12-345678', 'right'),
+        'birthdate': ('1988/02/03', 'right'),
+        'sex': ('M', 'label'),
+        'blood_type': ('AB-', 'below'),
+    }
+    assert fields['sex']['box'] == [[172.0, 220.0], [190.0, 220.0], [190.0, 250.0], [172.0, 250.0]]
+
+
+def test_extract_license_fields_without_labels():
+    fields = extract_license_fields([line('SANTOS, MARIA', 0, 0, 300, 30), line('D12 34 567890', 0, 40, 300, 70)])
+    assert fields['license_number']['value'] == 'D12-34-567890'
+    assert fields['license_number']['anchor'] == 'pattern'
+    assert fields['name']['anchor'] == 'name_shape'
+    # boxless lines can't be placed, a weak read stays under min_score
+    assert extract_license_fields([{'text': 'License No N01-12-345678', 'confidence': 0.9}]) == {}
+    assert extract_license_fields([line('D12 34 567890', 0, 40, 300, 70, 0.4)]) == {}
+    assert extract_license_fields([]) == {}
@@ -0,0 +1,53 @@
+import io
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from paddle_scan import DOCUMENT_PROFILES, assess_quality
+
+
+def page(width, height, paper=235, ink=20):
+    """
+    Synthetic document: rows of dark word blocks on paper.
+    """
+    img = Image.new('L', (width, height), paper)
+    draw = ImageDraw.Draw(img)
+    for y in range(20, height - 20, 24):
+        for x in range(20, width - 60, 70):
+            draw.rectangle([x, y, x + 50, y + 10], fill=ink)
+    return img.convert('RGB')
+
+
+def test_clean_page_passes_from_image_or_jpeg_bytes():
+    img = page(800, 600)
+    result = assess_quality(img)
+    assert result['ok'] and result['reasons'] == []
+    assert result['metrics']['width'] == 800 and result['metrics']['height'] == 600
+
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG')
+    assert assess_quality(buf.getvalue())['ok']
+
+
+def test_white_screenshot_with_dark_text_passes():
+    # e-receipt screenshot: mostly white, so brighter than max_brightness, but sharp and legible
+    img = Image.new('RGB', (1080, 1920), 'white')
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=36)
+    for row in range(10):
+        draw.text((60, 80 + 64 * row), 'ITEM 1 x 2.50      PHP 12.00', fill='black', font=font)
+    result = assess_quality(img)
+    assert result['metrics']['brightness'] > 250
+    assert result['ok'], result['reasons']
+
+
+def test_small_photo_fails_unless_the_profile_relaxes_min_side():
+    small = page(400, 360)
+    assert assess_quality(small)['reasons'] == ['too_small']
+    assert assess_quality(small, DOCUMENT_PROFILES['license']['quality'])['ok']
+
+
+def test_dark_blurry_and_empty_photos():
+    assert 'too_dark' in assess_quality(page(800, 600, paper=25, ink=5))['reasons']
+    assert 'blurry' in assess_quality(page(800, 600).filter(ImageFilter.GaussianBlur(6)))['reasons']
+    assert assess_quality(Image.new('RGB', (800, 600), 'white'))['reasons'] == \
+        ['too_bright', 'low_contrast', 'blurry', 'no_document']
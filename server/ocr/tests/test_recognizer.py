@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+from paddle_scan import get_text_recognizer
+
+
+class FakeRecModel:
+    """
+    Like a paddlex predictor: a batch_size passed to a call replaces the sampler's for good.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_sampler = SimpleNamespace(batch_size=batch_size)
+        self.calls = []
+
+    def __call__(self, arrays, batch_size=None):
+        if batch_size is not None:
+            self.batch_sampler.batch_size = batch_size
+        self.calls.append(self.batch_sampler.batch_size)
+        for _ in arrays:
+            yield {'rec_text': 'A', 'rec_score': 0.9}
+
+
+def test_crop_reads_leave_the_profile_batch_size():
+    model = FakeRecModel(batch_size=8)
+    recognize = get_text_recognizer(SimpleNamespace(paddlex_pipeline=SimpleNamespace(text_rec_model=model)))
+
+    assert recognize([None, None], 16) == [('A', 0.9), ('A', 0.9)]
+    assert model.calls == [16]
+    assert model.batch_sampler.batch_size == 8
+
+
+def test_no_recognizer_without_a_pipeline():
+    assert get_text_recognizer(object()) is None
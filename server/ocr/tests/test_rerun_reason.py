@@ -0,0 +1,37 @@
+import pytest
+
+from paddle_scan import rerun_reason
+
+
+@pytest.mark.parametrize('text, reason', [
+    ('N0I-12-345678', 'near_license'),   # look-alike letter among the digits
+    ('N01-12-34567', 'near_license'),    # separated like a license, one digit short
+    ('2O24/05/17', 'near_date'),
+    ('Exp 2030-O5-17', 'near_date'),
+    ('2024/5/17', 'near_date'),          # separated like a date, unpadded month
+    ('2024 05 17', 'near_date'),
+])
+def test_misread_fields_are_re_read(text, reason):
+    assert rerun_reason(text, 0.99) == reason
+
+
+@pytest.mark.parametrize('text', [
+    'OR No. 123456',
+    '09171234567',
+    'Tel 8123-4567',
+    '0917 123 4567',
+    'TOTAL 1,234.50',
+    'BOILS',
+    # exact matches are trusted
+    'N01-12-345678 2030/05/17',
+])
+def test_plain_numbers_are_trusted(text):
+    assert rerun_reason(text, 0.99) is None
+
+
+def test_other_reasons():
+    assert rerun_reason('  ', 0.99) == 'no_text'
+    assert rerun_reason('TOTAL', 0.5) == 'low_confidence'
+    assert rerun_reason('TOTAL', None) == 'low_confidence'
+    assert rerun_reason('TOTAL', 0.99, read_px=12, min_read_px=24) == 'small_text'
+    assert rerun_reason('OK', 0.99) == 'short_text'
@@ -0,0 +1,64 @@
+"""
+Box coordinates of scan_image across detect modes, with the model replaced by one that "reads"
+every dark band of the array it is given, so no model is needed.
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from paddle_scan import scan_image
+
+# dark bands drawn on the page, in upload pixels: (x0, y0, x1, y1)
+BANDS = [(400, 200, 2400, 260), (400, 600, 3000, 660)]
+
+
+class BandOcr:
+    """
+    Detects each run of rows holding dark pixels as one line boxed around its dark pixels.
+    """
+
+    def ocr(self, arr, cls=True):
+        dark = np.asarray(arr).min(axis=2) < 128
+        rows = np.flatnonzero(dark.any(axis=1))
+        detections = []
+        if not len(rows):
+            return [detections]
+        runs = np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1)
+        for n, run in enumerate(runs):
+            cols = np.flatnonzero(dark[run[0]:run[-1] + 1].any(axis=0))
+            x0, x1, y0, y1 = float(cols[0]), float(cols[-1] + 1), float(run[0]), float(run[-1] + 1)
+            detections.append([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]], (f"TOTAL AMOUNT LINE {'AB'[n % 2]}", 0.99)])
+        return [detections]
+
+
+def page_bytes(size=(4000, 1000)):
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    for band in BANDS:
+        draw.rectangle([band[0], band[1], band[2] - 1, band[3] - 1], fill='black')
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize('options', [
+    {'detect_mode': 'full'},
+    {'detect_mode': 'pyramid'},
+    {'detect_mode': 'tiled'},
+    # 12MB of decoded pixels over half a 16MB budget: decoded at 1/2, then auto tiles
+    {'detect_mode': 'full', 'memory_budget_mb': 16},
+    {'detect_mode': 'auto', 'memory_budget_mb': 16},
+])
+def test_boxes_are_in_upload_pixels_in_every_detect_mode(options):
+    payload = scan_image(BandOcr(), page_bytes(), use_cls=False, options=dict(options, crop_select='gated'))
+
+    assert 'error' not in payload, payload
+    assert not payload['stages'].get('tesseract_fallback')
+    rects = sorted((min(x for x, _ in l['box']), min(y for _, y in l['box']),
+                    max(x for x, _ in l['box']), max(y for _, y in l['box'])) for l in payload['lines'])
+    assert len(rects) == len(BANDS)
+    tolerance = 4 if options.get('memory_budget_mb') else 2
+    for rect, band in zip(rects, BANDS):
+        assert rect == pytest.approx(band, abs=tolerance)
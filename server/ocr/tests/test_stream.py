@@ -0,0 +1,91 @@
+"""
+LineStream events, and the event sequence scan_image/cached_scan send on each path.
+"""
+import io
+from types import SimpleNamespace
+
+from PIL import Image, ImageDraw
+
+from paddle_scan import LineStream, OcrResultCache, cached_scan, scan_image
+from test_scan_boxes import BandOcr, page_bytes
+
+
+def line(text, x0, y0, x1, y1, confidence=0.9):
+    return {'text': text, 'confidence': confidence, 'box': [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]}
+
+
+def test_refined_lines_replace_their_provisional_id():
+    events = []
+    stream = LineStream([line('T0TAL', 0, 0, 100, 20, 0.6), line('CASH', 0, 40, 100, 60)], events.append)
+    stream.first_pass()
+    stream.refine([
+        line('TOTAL', 1, 1, 101, 21, 0.95),     # better read of line 0
+        line('CA5H', 0, 40, 100, 60, 0.5),      # worse than what line 1 has: not sent
+        line('', 0, 80, 100, 100, 0.99),        # nothing read
+        line('CHANGE', 0, 80, 100, 100, 0.9),   # region the first pass missed: new id
+    ])
+    stream.refine([line('CA5H', 0, 40, 100, 60, 0.5)])  # nothing better: no event
+
+    assert [(e['event'], e['stage']) for e in events] == [('lines', 'first_pass'), ('refine', 'crop_rerun')]
+    assert [(l['id'], l['text']) for l in events[0]['lines']] == [(0, 'T0TAL'), (1, 'CASH')]
+    assert [(l['id'], l['text']) for l in events[1]['lines']] == [(0, 'TOTAL'), (2, 'CHANGE')]
+
+
+def test_events_are_scaled_to_upload_pixels():
+    events = []
+    stream = LineStream([line('A', 0, 0, 10, 5)], events.append, box_factor=2.0)
+    stream.first_pass(fields={'sex': {'value': 'M', 'box': [[0, 0], [10, 0], [10, 5], [0, 5]]}})
+    assert events[0]['lines'][0]['box'] == [[0, 0], [20, 0], [20, 10], [0, 10]]
+    assert events[0]['fields']['sex']['box'] == [[0, 0], [20, 0], [20, 10], [0, 10]]
+    # the stream's own lines keep their detection coordinates for matching
+    assert stream.lines[0]['box'] == [[0, 0], [10, 0], [10, 5], [0, 5]]
+
+
+class RecModel:
+    def __call__(self, arrays, batch_size=None):
+        for _ in arrays:
+            yield {'rec_text': 'N01-12-345678 2030/05/17', 'rec_score': 0.99}
+
+
+class RecOcr(BandOcr):
+    paddlex_pipeline = SimpleNamespace(text_rec_model=RecModel())
+
+
+def test_page_scan_sends_first_pass_then_refinements():
+    events = []
+    payload = scan_image(RecOcr(), page_bytes(), use_cls=False, options={'detect_mode': 'full'},
+                         on_event=events.append)
+
+    assert [e['event'] for e in events] == ['lines', 'refine']
+    assert len(events[0]['lines']) == len(payload['lines']) == 2
+    assert {l['id'] for l in events[1]['lines']} == {0, 1}
+    assert [l['box'] for l in events[1]['lines']] == [l['box'] for l in payload['lines']]
+
+
+def card_bytes():
+    img = Image.new('RGB', (1600, 1200), (30, 30, 30))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([300, 300, 300 + 856, 300 + 540], fill='white')
+    draw.rectangle([560, 500, 1000, 530], fill='black')
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+def test_card_reads_and_cache_hits_send_one_lines_event():
+    cache = OcrResultCache(max_entries=4)
+    options = {'profile': 'license', 'quality_gate': 'off'}
+    runs = []
+    for _ in range(2):
+        events = []
+        payload = cached_scan(cache, lambda lang, profile: RecOcr(), card_bytes(), 'en', options=options,
+                              on_event=events.append)
+        runs.append((events, payload))
+
+    (card_events, card), (hit_events, hit) = runs
+    assert card['stages']['profile'] == 'license' and 'profile_fallback' not in card['stages']
+    assert hit['cache']['hit'] is True
+    for events, stage, payload in ((card_events, 'card', card), (hit_events, 'cache', hit)):
+        assert [(e['event'], e['stage']) for e in events] == [('lines', stage)]
+        assert [l['text'] for l in events[0]['lines']] == [l['text'] for l in payload['lines']]
+        assert events[0]['fields']['license_number']['value'] == 'N01-12-345678'
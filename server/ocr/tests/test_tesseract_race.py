@@ -0,0 +1,68 @@
+from paddle_scan import first_pass_is_weak, settle_tesseract_race, tesseract_wins
+
+
+class FakeJob:
+    """
+    Stands in for TesseractJob: finished (or not) with items or an error.
+    """
+
+    def __init__(self, items=None, error=None, done=True):
+        self.items = items
+        self.error = error
+        self._done = done
+        self.cancelled = False
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout=None):
+        return self.items, self.error
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def lines(*texts):
+    return [{'text': t, 'confidence': 0.9, 'box': None} for t in texts]
+
+
+def test_weak_first_pass_starts_the_race():
+    assert first_pass_is_weak(lines('A', 'B'))
+    assert first_pass_is_weak([dict(l, confidence=0.3) for l in lines('A', 'B', 'C')])
+    assert not first_pass_is_weak(lines('A', 'B', 'C'))
+
+
+def test_tesseract_wins_only_when_finished_and_ahead():
+    assert tesseract_wins(FakeJob(lines('A', 'B', 'C')), 1)
+    assert not tesseract_wins(FakeJob(lines('A', 'B', 'C')), 3)
+    assert not tesseract_wins(FakeJob(lines('A')), 0)  # under min_lines
+    assert not tesseract_wins(FakeJob(lines('A', 'B', 'C'), done=False), 0)
+    assert not tesseract_wins(FakeJob(error='tesseract timed out'), 0)
+    assert not tesseract_wins(None, 0)
+
+
+def test_paddle_keeps_its_lines_when_they_pass_the_bar():
+    paddle = lines('TOTAL', 'CASH')
+    for job, outcome in ((FakeJob(done=False), 'cancelled'), (FakeJob(lines('X', 'Y', 'Z')), 'lost'),
+                         (FakeJob(error='boom'), 'failed')):
+        stages, warnings = {}, []
+        assert settle_tesseract_race(job, paddle, stages, warnings) is paddle
+        assert stages == {'tesseract_race': outcome}
+        assert job.cancelled and warnings == []
+
+
+def test_tesseract_replaces_a_paddle_result_under_the_bar():
+    stages, warnings = {}, []
+    # like the sequential fallback, any Tesseract read beats a Paddle result under min_lines
+    result = settle_tesseract_race(FakeJob(lines('TOTAL 12.00')), lines('T'), stages, warnings)
+    assert [l['text'] for l in result] == ['TOTAL 12.00']
+    assert stages == {'tesseract_race': 'won', 'tesseract_fallback': True}
+    assert warnings == []
+
+
+def test_tesseract_timeout_keeps_the_paddle_lines():
+    stages, warnings = {}, []
+    paddle = lines('T')
+    assert settle_tesseract_race(FakeJob(error='tesseract timed out'), paddle, stages, warnings) is paddle
+    assert stages == {'tesseract_race': 'failed'}
+    assert warnings == ['tesseract fallback failed: tesseract timed out']
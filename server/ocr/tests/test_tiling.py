@@ -0,0 +1,84 @@
+from paddle_scan import join_seam_text, plan_tiling, stitch_tile_detections, tile_starts
+
+
+def det(x0, y0, x1, y1, text, tile, cut=False, score=0.9, read_px=20):
+    return [[[x0, y0], [x1, y0], [x1, y1], [x0, y1]],
+            {'text': text, 'score': score, 'read_px': read_px, 'tile': tile, 'cut': cut}]
+
+
+def test_tall_pages_tile_in_auto_mode_only():
+    plan = plan_tiling((1000, 4000), {'memory_budget_mb': 512})
+    assert (plan['tiled'], plan['reason']) == (True, 'tall')
+    # an explicit mode keeps its pass, the reason is reported for the caller
+    plan = plan_tiling((1000, 4000), {'memory_budget_mb': 512, 'detect_mode': 'full'})
+    assert (plan['tiled'], plan['reason']) == (False, 'tall')
+    # no budget, no automatic tiling
+    assert plan_tiling((1000, 4000), {})['reason'] is None
+
+
+def test_wide_strips_are_not_tall():
+    plan = plan_tiling((4000, 1000), {'memory_budget_mb': 512})
+    assert (plan['tiled'], plan['reason']) == (False, None)
+
+
+def test_forced_tiling_ignores_the_budget():
+    plan = plan_tiling((800, 600), {'detect_mode': 'tiled'})
+    assert (plan['tiled'], plan['reason']) == (True, 'forced')
+    assert plan['decode_scale'] == 1.0
+
+
+def test_budget_tiles_and_downscales_the_decode():
+    plan = plan_tiling((4000, 3000), {'memory_budget_mb': 256})
+    assert (plan['tiled'], plan['reason'], plan['decode_scale']) == (True, 'budget', 1.0)
+    assert plan['scale'] == 0.8  # shorter side read at page_px
+
+    plan = plan_tiling((4000, 3000), {'memory_budget_mb': 64})
+    assert (plan['tiled'], plan['reason'], plan['decode_scale']) == (True, 'budget', 0.5)
+    assert 640 <= plan['tile_px'] < 1600
+    plan = plan_tiling((4000, 3000), {'memory_budget_mb': 64, 'detect_mode': 'pyramid'})
+    assert (plan['tiled'], plan['reason'], plan['decode_scale']) == (False, 'budget', 0.5)
+
+    assert plan_tiling((2000, 1500), {'memory_budget_mb': 512})['reason'] is None
+
+
+def test_tile_starts_cover_the_length():
+    assert tile_starts(1000, 1600, 200) == [0]
+    starts = tile_starts(4000, 1600, 200)
+    assert starts[0] == 0 and starts[-1] == 4000 - 1600
+    assert all(b - a <= 1600 - 200 for a, b in zip(starts, starts[1:]))
+
+
+def test_join_seam_text_drops_the_shared_characters():
+    assert join_seam_text('GRAND TOT', 'TOTAL 12.00') == 'GRAND TOTAL 12.00'
+    assert join_seam_text('CASH', 'CHANGE') == 'CASH CHANGE'
+    assert join_seam_text(None, 'X') == 'X'
+
+
+def test_stitch_drops_partial_copies_and_joins_halves():
+    detections = [
+        # line seen whole by tile 0, cut copy from tile 1 lies inside it
+        det(100, 10, 400, 30, 'SUBTOTAL 9.00', 0),
+        det(300, 10, 400, 30, '9.00', 1, cut=True),
+        # line split by the vertical seam at x=1000, each tile read one half
+        det(800, 100, 1003, 120, 'GRAND TOT', 0, cut=True, score=0.8),
+        det(997, 100, 1200, 120, 'TOTAL 12.00', 1, cut=True, score=0.9, read_px=24),
+        # a whole duplicate from the overlap band is left to merge_lines
+        det(950, 200, 1050, 220, 'CASH', 1),
+    ]
+    out, counts = stitch_tile_detections(detections)
+
+    assert counts == {'seam_dropped': 1, 'stitched': 1}
+    texts = [d[1]['text'] for d in out]
+    assert texts.count('9.00') == 0 and 'SUBTOTAL 9.00' in texts and 'CASH' in texts
+    stitched = next(d for d in out if d[1].get('stitched'))
+    assert stitched[0] == [[800, 100], [1200, 100], [1200, 120], [800, 120]]
+    assert stitched[1] == {'text': 'GRAND TOTAL 12.00', 'score': 0.8, 'read_px': 24, 'stitched': True}
+
+
+def test_stitch_keeps_the_better_half_across_a_horizontal_seam():
+    out, counts = stitch_tile_detections([
+        det(10, 990, 30, 1003, 'A1', 0, cut=True, score=0.6),
+        det(10, 997, 30, 1060, 'B2', 1, cut=True, score=0.9),
+    ])
+    assert counts == {'seam_dropped': 0, 'stitched': 1}
+    assert out[0][1]['text'] == 'B2' and out[0][1]['score'] == 0.6
@@ -32,6 +32,32 @@ export const parseLicenseText = (ocrResult) => {
         expiry: ''
     };
 
+    // Fields returned by `paddle_scan.py --profile license` win over the line scan: template reads off
+    // the located card, or values found next to / under their labels on the page lines (each scored)
+    const templateKeys = {
+        license_number: 'licenseNumber',
+        name: 'name',
+        birthdate: 'birthdate',
+        address: 'address',
+        sex: 'sex',
+        blood_type: 'bloodType',
+        restrictions: 'restrictions',
+        expiry: 'expiry'
+    };
+    const templateData = {};
+    if (ocrResult && ocrResult.fields && typeof ocrResult.fields === 'object') {
+        Object.entries(templateKeys).forEach(([field, key]) => {
+            const entry = ocrResult.fields[field];
+            if (entry && entry.valid && entry.value) templateData[key] = String(entry.value).trim();
+        });
+    }
+    Object.assign(data, templateData);
+    // everything came back structured: no need to re-scan the lines
+    if (Object.keys(data).every((key) => key === 'issued' || data[key])) {
+        delete data.issued;
+        return data;
+    }
+
     // Helper to clean text
     const clean = (str) => str ? str.trim() : '';
 
@@ -208,6 +234,9 @@ export const parseLicenseText = (ocrResult) => {
         }
     }
 
+    // the line scan only fills what the card template couldn't read
+    Object.assign(data, templateData);
+
     // Remove issued date logic as requested
     delete data.issued;
 
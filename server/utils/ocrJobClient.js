@@ -0,0 +1,112 @@
+// Client for the shared OCR job server (`paddle_scan.py --listen`).
+// The server owns one bounded queue and a fixed number of inference threads, so concurrent uploads
+// wait there instead of each starting a Python process; when the queue is full it answers "busy" and
+// the controllers turn that into a 503 rather than adding more load.
+// Enabled when OCR_JOB_SERVER is set, e.g. "unix:/tmp/ocr.sock" or "127.0.0.1:7071".
+
+import net from 'net';
+import { createNdjsonParser, defaultLang, envInt } from './ocrProtocol.js';
+
+const parseAddress = (spec) => {
+  if (spec.startsWith('unix:')) return { path: spec.slice('unix:'.length) };
+  const idx = spec.lastIndexOf(':');
+  return {
+    host: idx > 0 ? spec.slice(0, idx) : '127.0.0.1',
+    port: Number.parseInt(spec.slice(idx + 1), 10),
+  };
+};
+
+class OcrJobClient {
+  constructor(spec) {
+    this.spec = spec;
+    this.socket = null;
+    this.pending = new Map();
+    this.nextId = 1;
+  }
+
+  connect() {
+    if (this.socket) return this.socket;
+    const socket = net.createConnection(parseAddress(this.spec));
+    socket.setEncoding('utf8');
+    // a fresh parser per connection, so a line cut off by a dropped socket never prefixes the next one
+    socket.on('data', createNdjsonParser((msg) => this.onMessage(msg)));
+    socket.on('error', (error) => {
+      this.lastError = error;
+    });
+    socket.on('close', () => this.onClose(socket));
+    this.socket = socket;
+    return socket;
+  }
+
+  onMessage(msg) {
+    const job = this.pending.get(String(msg.id));
+    if (!job) return;
+    this.pending.delete(String(msg.id));
+    clearTimeout(job.timer);
+
+    if (msg.error) {
+      const err = new Error(msg.error);
+      err.meta = { detail: msg, server: this.spec };
+      job.reject(err);
+    } else {
+      delete msg.id;
+      job.resolve(msg);
+    }
+  }
+
+  onClose(socket) {
+    if (this.socket !== socket) return;
+    this.socket = null;
+    // jobs already sent are lost with the connection; the next scan reconnects
+    this.pending.forEach((job) => {
+      clearTimeout(job.timer);
+      const err = new Error('OCR job server connection closed');
+      err.meta = { server: this.spec, reason: this.lastError?.message };
+      job.reject(err);
+    });
+    this.pending.clear();
+  }
+
+  scan({ filepath, buffer, langArg, noClsFlag, profile }) {
+    return new Promise((resolve, reject) => {
+      const id = String(this.nextId++);
+      const timeoutMs = envInt('OCR_JOB_TIMEOUT_MS', 30000);
+      const request = {
+        id,
+        op: 'scan',
+        lang: langArg ? String(langArg) : defaultLang(),
+        use_cls: !noClsFlag,
+        // the server enforces this deadline and answers "Job timed out" itself
+        timeout_ms: timeoutMs,
+      };
+      if (profile) request.profile = profile;
+      if (buffer) request.image_b64 = Buffer.from(buffer).toString('base64');
+      else request.path = filepath;
+
+      const timer = setTimeout(() => {
+        // only reached when the server stopped answering altogether
+        this.pending.delete(id);
+        const err = new Error('OCR job server did not answer');
+        err.meta = { server: this.spec, timeoutMs };
+        reject(err);
+        if (this.socket) this.socket.write(JSON.stringify({ op: 'cancel', target: id }) + '\n');
+      }, timeoutMs + 5000);
+      this.pending.set(id, { resolve, reject, timer });
+
+      this.connect().write(JSON.stringify(request) + '\n');
+    });
+  }
+}
+
+let client = null;
+
+export const isOcrJobServerEnabled = () => Boolean(process.env.OCR_JOB_SERVER);
+
+// True for the job server's { error: 'Server busy', busy: true } answer: the OCR capacity is used up,
+// so the request should be retried later rather than pushed onto another engine.
+export const isOcrBusy = (error) => Boolean(error?.meta?.detail?.busy);
+
+export const runJobServerOcr = (options) => {
+  if (!client) client = new OcrJobClient(process.env.OCR_JOB_SERVER);
+  return client.scan(options);
+};
@@ -0,0 +1,29 @@
+// Helpers shared by the two transports that speak paddle_scan.py's NDJSON protocol:
+// the warm `--server` worker pool (ocrWorkerPool.js) and the `--listen` job server client (ocrJobClient.js).
+
+// Read lazily: ES module imports run before dotenv.config() in main/index.js.
+export const envInt = (name, fallback) => Number.parseInt(process.env[name] || '', 10) || fallback;
+export const defaultLang = () => process.env.PADDLE_OCR_LANG || 'en';
+
+// Returns a `data` handler that splits a stream into lines and calls onMessage with each JSON object.
+// Partial lines are kept until their newline arrives; blank and malformed lines are skipped.
+// Use one handler per stream, its buffer belongs to that stream.
+export const createNdjsonParser = (onMessage) => {
+  let buffer = '';
+  return (chunk) => {
+    buffer += chunk.toString();
+    let idx;
+    while ((idx = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, idx).trim();
+      buffer = buffer.slice(idx + 1);
+      if (!line) continue;
+      let msg;
+      try {
+        msg = JSON.parse(line);
+      } catch (_) {
+        continue;
+      }
+      onMessage(msg);
+    }
+  };
+};
@@ -0,0 +1,233 @@
+// Runs paddle_scan.py for the controllers: through the shared job server (OCR_JOB_SERVER) or the warm
+// worker pool (OCR_POOL_SIZE) when enabled, falling back to a one-shot python process per scan.
+
+import { spawn } from 'child_process';
+import fs from 'fs';
+import path from 'path';
+import { getQualityRejection, isOcrPoolEnabled, runPooledOcr } from './ocrWorkerPool.js';
+import { isOcrBusy, isOcrJobServerEnabled, runJobServerOcr } from './ocrJobClient.js';
+
+const resolveOcrScriptPath = () => {
+  const scriptCandidates = [
+    path.join(process.cwd(), 'ocr', 'paddle_scan.py'),
+    path.join(process.cwd(), 'server', 'ocr', 'paddle_scan.py'),
+    path.join(process.cwd(), '..', 'server', 'ocr', 'paddle_scan.py'),
+  ];
+
+  for (const candidate of scriptCandidates) {
+    try {
+      if (fs.existsSync(candidate)) {
+        return { scriptPath: candidate, scriptCandidates };
+      }
+    } catch (error) {
+      // ignore fs permission errors and continue
+    }
+  }
+
+  return { scriptPath: null, scriptCandidates };
+};
+
+// Interpreter that last ran paddle_scan.py with its dependencies present; tried first next time.
+let workingPython = null;
+// paddle_scan.py's exit code when a package is missing (EXIT_MISSING_DEPENDENCY), worth trying another python.
+const MISSING_DEPENDENCY_EXIT = 4;
+
+// Pass `buffer` to pipe the image bytes on stdin instead of writing an upload to disk first.
+export const runPaddleOcr = async ({ filepath, buffer, langArg, noClsFlag, profile }) => {
+  if (isOcrJobServerEnabled()) {
+    try {
+      return await runJobServerOcr({ filepath, buffer, langArg, noClsFlag, profile });
+    } catch (error) {
+      // a full queue means OCR is at capacity, another python process would only add load
+      if (isOcrBusy(error) || getQualityRejection(error)) throw error;
+      console.warn('OCR job server failed, falling back:', error.message);
+    }
+  }
+
+  if (isOcrPoolEnabled()) {
+    try {
+      return await runPooledOcr({ filepath, buffer, langArg, noClsFlag, profile });
+    } catch (error) {
+      // a photo the worker refused would be refused again
+      if (getQualityRejection(error)) throw error;
+      // fall back to a one-shot python process below
+      console.warn('OCR worker pool failed, spawning python directly:', error.message);
+    }
+  }
+
+  const { scriptPath, scriptCandidates } = resolveOcrScriptPath();
+
+  if (!scriptPath) {
+    const err = new Error('OCR script not found on server');
+    err.meta = { scriptCandidates };
+    throw err;
+  }
+
+  const baseArgs = [scriptPath, buffer ? '-' : filepath];
+  if (langArg) {
+    baseArgs.push('--lang', String(langArg));
+  }
+  if (noClsFlag) {
+    baseArgs.push('--no-cls');
+  }
+  if (profile) {
+    baseArgs.push('--profile', String(profile));
+  }
+
+  const trySpawn = (cmd) =>
+    new Promise((resolve, reject) => {
+      let proc;
+      try {
+        proc = spawn(cmd, baseArgs, { shell: false, cwd: process.cwd() });
+      } catch (error) {
+        return reject({ code: 'spawn_error', error });
+      }
+
+      if (buffer) {
+        // a failed spawn closes stdin early; the 'error'/'close' handlers report it
+        proc.stdin.on('error', () => {});
+        proc.stdin.end(buffer);
+      }
+
+      let out = '';
+      let err = '';
+      proc.stdout.on('data', (d) => {
+        out += d.toString();
+      });
+      proc.stderr.on('data', (d) => {
+        err += d.toString();
+      });
+
+      const timeout = setTimeout(() => {
+        try {
+          proc.kill();
+        } catch (_) {
+          // ignore
+        }
+        reject({ code: 'timeout', error: new Error('Python script execution timed out') });
+      }, 30000);
+
+      proc.on('error', (error) => {
+        clearTimeout(timeout);
+        reject({ code: 'spawn_error', error });
+      });
+
+      proc.on('close', (code) => {
+        clearTimeout(timeout);
+        resolve({ code, out, err, cmd, args: baseArgs });
+      });
+    });
+
+  const isWindows = process.platform === 'win32';
+  const pythonCommands = isWindows ? ['py', 'python', 'python3'] : ['python3', 'python'];
+  const venvCandidates = [
+    path.join(process.cwd(), '.venv', isWindows ? 'Scripts' : 'bin', isWindows ? 'python.exe' : 'python'),
+    path.join(process.cwd(), 'venv', isWindows ? 'Scripts' : 'bin', isWindows ? 'python.exe' : 'python'),
+  ];
+  for (const vp of venvCandidates) {
+    try {
+      if (fs.existsSync(vp) && !pythonCommands.includes(vp)) {
+        pythonCommands.unshift(vp);
+        break;
+      }
+    } catch (_) {
+      // ignore
+    }
+  }
+  if (workingPython) {
+    const idx = pythonCommands.indexOf(workingPython);
+    if (idx >= 0) pythonCommands.splice(idx, 1);
+    pythonCommands.unshift(workingPython);
+  }
+
+  const attempts = [];
+  let result = null;
+
+  for (const cmd of pythonCommands) {
+    try {
+      const attempt = await trySpawn(cmd);
+      attempts.push({
+        cmd,
+        code: attempt.code,
+        stderr: attempt.err,
+        hasOutput: Boolean(attempt.out && attempt.out.length > 0),
+      });
+
+      // Any answer other than "missing dependency" (exit code 4) comes from an interpreter that ran the
+      // scan; another python would only repeat it, paying the paddle import and model load again.
+      if (attempt.out && attempt.out.length > 0 && attempt.code !== MISSING_DEPENDENCY_EXIT) {
+        result = attempt;
+        workingPython = cmd;
+        break;
+      }
+
+      if (!result && attempt.out && attempt.out.length > 0) {
+        result = attempt; // keep the most informative output even if exit code != 0
+      }
+    } catch (spawnErr) {
+      attempts.push({
+        cmd,
+        code: spawnErr.code || 'spawn_error',
+        error: spawnErr.error?.message || spawnErr.message || String(spawnErr),
+      });
+    }
+  }
+
+  if (!result || (result.code !== 0 && (!result.out || result.out.length === 0))) {
+    const err = new Error('Failed to execute OCR python');
+    err.meta = { attempts, scriptPath, platform: process.platform };
+    throw err;
+  }
+
+  if (result.out && result.out.length > 0) {
+    try {
+      const parsed = JSON.parse(result.out);
+      if (parsed.error) {
+        const err = new Error(parsed.error || 'OCR python reported an error');
+        err.meta = { detail: parsed, attempts, scriptPath, stderr: result.err };
+        throw err;
+      }
+      return parsed;
+    } catch (parseErr) {
+      // the error payload reported by the script itself
+      if (parseErr.meta) throw parseErr;
+      const err = new Error('Invalid OCR output');
+      err.meta = {
+        parseError: parseErr.message || String(parseErr),
+        raw: result.out,
+        stderr: result.err,
+        attempts,
+        scriptPath,
+      };
+      throw err;
+    }
+  }
+
+  const err = new Error('OCR python returned no output');
+  err.meta = { attempts, scriptPath, stderr: result?.err };
+  throw err;
+};
+
+// Answers the OCR errors that are the client's to act on: a photo refused by the quality gate (422,
+// retake) and a full job server queue (503, retry shortly). Returns the response it sent, or null
+// when the caller should handle the error (e.g. fall back to Tesseract).
+export const sendOcrRejection = (res, error) => {
+  const quality = getQualityRejection(error);
+  if (quality) {
+    return res.status(422).json({
+      success: false,
+      message: 'Image quality too low, please retake the photo',
+      retake: true,
+      quality,
+    });
+  }
+  if (isOcrBusy(error)) {
+    res.set('Retry-After', '2');
+    return res.status(503).json({
+      success: false,
+      message: 'OCR is busy, please try again shortly',
+      busy: true,
+    });
+  }
+  return null;
+};
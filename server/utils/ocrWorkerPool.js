@@ -0,0 +1,246 @@
+// Pool of warm `paddle_scan.py --server` workers.
+// Each worker loads PaddleOCR once and answers line-delimited JSON requests on stdin/stdout,
+// so a scan no longer pays for interpreter startup + model construction.
+// Enabled when OCR_POOL_SIZE > 0; otherwise the controllers keep spawning one process per scan.
+
+import { spawn } from 'child_process';
+import fs from 'fs';
+import path from 'path';
+import { createNdjsonParser, defaultLang, envInt } from './ocrProtocol.js';
+
+const resolveScriptPath = () => {
+  const candidates = [
+    path.join(process.cwd(), 'ocr', 'paddle_scan.py'),
+    path.join(process.cwd(), 'server', 'ocr', 'paddle_scan.py'),
+    path.join(process.cwd(), '..', 'server', 'ocr', 'paddle_scan.py'),
+  ];
+  return candidates.find((candidate) => {
+    try {
+      return fs.existsSync(candidate);
+    } catch (_) {
+      return false;
+    }
+  }) || null;
+};
+
+const resolvePython = () => {
+  if (process.env.OCR_PYTHON) return process.env.OCR_PYTHON;
+  const isWindows = process.platform === 'win32';
+  const venvCandidates = [
+    path.join(process.cwd(), '.venv', isWindows ? 'Scripts' : 'bin', isWindows ? 'python.exe' : 'python'),
+    path.join(process.cwd(), 'venv', isWindows ? 'Scripts' : 'bin', isWindows ? 'python.exe' : 'python'),
+  ];
+  for (const vp of venvCandidates) {
+    try {
+      if (fs.existsSync(vp)) return vp;
+    } catch (_) {
+      // ignore
+    }
+  }
+  return isWindows ? 'py' : 'python3';
+};
+
+class OcrWorker {
+  constructor(pool, scriptPath, python) {
+    this.pool = pool;
+    this.ready = false;
+    this.busy = false;
+    this.job = null;
+    this.stderrTail = '';
+
+    this.proc = spawn(python, [scriptPath, '--server', '--lang', defaultLang()], {
+      shell: false,
+      cwd: process.cwd(),
+    });
+
+    this.readyTimer = setTimeout(() => {
+      if (!this.ready) this.kill('worker did not become ready in time');
+    }, envInt('OCR_READY_TIMEOUT_MS', 120000));
+
+    this.proc.stdout.on('data', createNdjsonParser((msg) => this.onMessage(msg)));
+    this.proc.stderr.on('data', (d) => {
+      // keep only the tail for diagnostics; workers are chatty on stderr
+      this.stderrTail = (this.stderrTail + d.toString()).slice(-4000);
+    });
+    // a worker dying while a request is written surfaces as EPIPE here, not as a throw from write()
+    this.proc.stdin.on('error', (error) => this.onStdinError(error));
+    this.proc.on('error', (error) => this.onExit(null, error));
+    this.proc.on('close', (code) => this.onExit(code));
+  }
+
+  onMessage(msg) {
+    if (msg.event === 'ready') {
+      clearTimeout(this.readyTimer);
+      this.ready = true;
+      this.pool.drain();
+      return;
+    }
+    if (msg.event === 'error' && !this.ready) {
+      this.kill(msg.detail || msg.error);
+      return;
+    }
+    if (!this.job || msg.id !== this.job.id) return;
+
+    const { resolve, reject, timer } = this.job;
+    clearTimeout(timer);
+    this.job = null;
+    this.busy = false;
+
+    if (msg.error) {
+      const err = new Error(msg.error);
+      err.meta = { detail: msg, pid: this.proc.pid };
+      reject(err);
+    } else {
+      delete msg.id;
+      resolve(msg);
+    }
+    this.pool.drain();
+  }
+
+  run(job) {
+    this.busy = true;
+    this.job = job;
+    const timeoutMs = envInt('OCR_JOB_TIMEOUT_MS', 30000);
+    job.timer = setTimeout(() => {
+      const err = new Error('OCR worker timed out');
+      err.meta = { pid: this.proc.pid, timeoutMs };
+      this.job = null;
+      job.reject(err);
+      // a stuck worker cannot be trusted with the next job
+      this.kill('job timeout');
+    }, timeoutMs);
+
+    const request = { id: job.id, op: 'scan', lang: job.lang, use_cls: job.useCls };
+    if (job.profile) request.profile = job.profile;
+    if (job.buffer) request.image_b64 = Buffer.from(job.buffer).toString('base64');
+    else request.path = job.filepath;
+    this.proc.stdin.write(JSON.stringify(request) + '\n');
+  }
+
+  onStdinError(error) {
+    // retire the worker: no new job until 'close' replaces it
+    this.busy = true;
+    if (this.job) {
+      const { job } = this;
+      clearTimeout(job.timer);
+      this.job = null;
+      const err = new Error('OCR worker stdin failed');
+      err.meta = { pid: this.proc.pid, reason: error.message, stderr: this.stderrTail };
+      job.reject(err);
+    }
+    this.kill(`stdin error: ${error.message}`);
+  }
+
+  kill(reason) {
+    this.exitReason = reason;
+    try {
+      this.proc.kill();
+    } catch (_) {
+      // ignore
+    }
+  }
+
+  onExit(code, error) {
+    if (this.exited) return;
+    this.exited = true;
+    clearTimeout(this.readyTimer);
+    if (this.job) {
+      clearTimeout(this.job.timer);
+      const err = new Error('OCR worker exited');
+      err.meta = { code, reason: this.exitReason || error?.message, stderr: this.stderrTail };
+      this.job.reject(err);
+      this.job = null;
+    }
+    this.pool.onWorkerExit(this, { code, reason: this.exitReason || error?.message });
+  }
+}
+
+class OcrWorkerPool {
+  constructor(size) {
+    this.size = size;
+    this.workers = [];
+    this.queue = [];
+    this.nextId = 1;
+    this.consecutiveFailures = 0;
+    this.scriptPath = resolveScriptPath();
+    this.python = resolvePython();
+  }
+
+  start() {
+    if (!this.scriptPath) return;
+    while (this.workers.length < this.size) {
+      this.workers.push(new OcrWorker(this, this.scriptPath, this.python));
+    }
+  }
+
+  onWorkerExit(worker, info) {
+    this.workers = this.workers.filter((w) => w !== worker);
+    if (!worker.ready) this.consecutiveFailures += 1;
+    else this.consecutiveFailures = 0;
+
+    // Workers that never got ready (missing deps, bad python) would just crash-loop.
+    if (this.consecutiveFailures >= this.size * 2) {
+      console.error('OCR worker pool disabled: workers keep failing to start', info);
+      const pending = this.queue.splice(0);
+      pending.forEach((job) => {
+        const err = new Error('OCR worker pool unavailable');
+        err.meta = info;
+        job.reject(err);
+      });
+      return;
+    }
+    this.start();
+  }
+
+  isHealthy() {
+    return Boolean(this.scriptPath) && this.consecutiveFailures < this.size * 2;
+  }
+
+  drain() {
+    while (this.queue.length) {
+      const worker = this.workers.find((w) => w.ready && !w.busy);
+      if (!worker) return;
+      worker.run(this.queue.shift());
+    }
+  }
+
+  scan({ filepath, buffer, langArg, noClsFlag, profile }) {
+    return new Promise((resolve, reject) => {
+      if (!this.isHealthy()) {
+        const err = new Error('OCR worker pool unavailable');
+        err.meta = { scriptPath: this.scriptPath, python: this.python };
+        reject(err);
+        return;
+      }
+      this.queue.push({
+        id: String(this.nextId++),
+        filepath,
+        buffer,
+        lang: langArg ? String(langArg) : defaultLang(),
+        useCls: !noClsFlag,
+        profile,
+        resolve,
+        reject,
+      });
+      this.start();
+      this.drain();
+    });
+  }
+}
+
+let pool = null;
+
+export const isOcrPoolEnabled = () => envInt('OCR_POOL_SIZE', 0) > 0;
+
+// paddle_scan.py refuses unreadable photos before inference ({ error, quality, retake: true }).
+// Returns that quality report for such an error so callers can ask for a retake instead of
+// retrying with another engine, or null for any other error.
+export const getQualityRejection = (error) => {
+  const detail = error?.meta?.detail;
+  return detail && detail.retake && detail.quality ? detail.quality : null;
+};
+
+export const runPooledOcr = (options) => {
+  if (!pool) pool = new OcrWorkerPool(envInt('OCR_POOL_SIZE', 1));
+  return pool.scan(options);
+};